@@ -62,6 +62,9 @@ class BaseItemExporter(ABC):
 
     def close(self): ...
 
+    def flush(self):
+        """Waits until the exported items are written, for exporters writing in the background."""
+
     @abstractmethod
     def export_item(self, item): ...
 
@@ -22,15 +22,22 @@
 
 
 import contextlib
+import gzip
 import os
 import pathlib
 import sys
+import threading
+
+from ethereumetl.config.envs import envs
+
+# File extensions of the streams get_file_handle compresses and decompresses transparently
+COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.zst': 'zstd', '.lz4': 'lz4'}
 
 
 # https://stackoverflow.com/questions/17602878/how-to-handle-both-with-open-and-sys-stdout-nicely
 @contextlib.contextmanager
-def smart_open(filename=None, mode='w', binary=False, create_parent_dirs=True):
-    fh = get_file_handle(filename, mode, binary, create_parent_dirs)
+def smart_open(filename=None, mode='w', binary=False, create_parent_dirs=True, compression=None):
+    fh = get_file_handle(filename, mode, binary, create_parent_dirs, compression)
 
     try:
         yield fh
@@ -38,22 +45,69 @@ def smart_open(filename=None, mode='w', binary=False, create_parent_dirs=True):
         fh.close()
 
 
-def get_file_handle(filename, mode='w', binary=False, create_parent_dirs=True):
+def get_file_handle(filename, mode='w', binary=False, create_parent_dirs=True, compression=None):
+    """
+    Opens the file, '-' for stdout or stdin, None for a file discarding writes.
+
+    Files are compressed with gzip, zstd or lz4 by `compression`, which defaults to the one of
+    the file extension, e.g. blocks.csv.gz.
+    """
     if create_parent_dirs and filename is not None:
         dirname = os.path.dirname(filename)
         pathlib.Path(dirname).mkdir(parents=True, exist_ok=True)
     full_mode = mode + ('b' if binary else '')
     is_file = filename and filename != '-'
+    if compression is None and is_file:
+        compression = get_compression(filename)
     if is_file:
+        if compression:
+            return open_compressed(filename, mode + ('b' if binary else 't'), compression)
         fh = open(filename, full_mode)
     elif filename == '-':
         fd = sys.stdout.fileno() if mode == 'w' else sys.stdin.fileno()
+        if compression:
+            # stdout and stdin stay open after the compressed stream is closed
+            fileobj = os.fdopen(fd, mode + 'b', closefd=False)
+            return open_compressed(fileobj, mode + ('b' if binary else 't'), compression)
         fh = os.fdopen(fd, full_mode)
     else:
         fh = NoopFile()
     return fh
 
 
+def get_compression(filename) -> str | None:
+    return COMPRESSION_EXTENSIONS.get(os.path.splitext(str(filename))[1])
+
+
+def strip_compression_extension(filename):
+    """blocks.csv.gz -> blocks.csv, for choosing the format of compressed files."""
+    root, extension = os.path.splitext(str(filename))
+    return root if extension in COMPRESSION_EXTENSIONS else str(filename)
+
+
+def open_compressed(file, mode, compression):
+    """Opens a gzip, zstd or lz4 stream over a file name or a binary file object."""
+    if compression == 'gzip':
+        fh = gzip.open(file, mode, compresslevel=envs.GZIP_LEVEL)
+    elif compression == 'zstd':
+        import zstandard
+
+        compressor = None
+        if 'w' in mode:
+            compressor = zstandard.ZstdCompressor(level=envs.ZSTD_LEVEL, threads=envs.ZSTD_THREADS)
+        fh = zstandard.open(file, mode, cctx=compressor)
+    elif compression == 'lz4':
+        import lz4.frame
+
+        fh = lz4.frame.open(file, mode)
+    else:
+        raise ValueError(f'Unknown compression {compression!r}')
+    if 'w' in mode:
+        # compressors keep state between writes, exporters write from several threads
+        fh = LockedFile(fh)
+    return fh
+
+
 def close_silently(file_handle):
     if file_handle is None:
         pass
@@ -61,6 +115,35 @@ def close_silently(file_handle):
         file_handle.close()
 
 
+class LockedFile:
+    """Serializes writes to a stream that is not thread-safe."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, data):
+        with self.lock:
+            return self.stream.write(data)
+
+    def flush(self):
+        with self.lock:
+            self.stream.flush()
+
+    def close(self):
+        with self.lock:
+            self.stream.close()
+
+
 class NoopFile:
     def __enter__(self):
         pass
@@ -1,15 +1,58 @@
 import logging
+import threading
+from collections.abc import Iterable, Iterator
 from typing import Any
 
 import kombu
+from kombu.utils.json import dumps
 from retry import retry
 
 from blockchainetl.exporters import BaseItemExporter
+from ethereumetl.config.envs import envs
+
+
+class PublisherConfirms:
+    """
+    Delivery tags published on a channel in confirm mode and not confirmed by the broker yet.
+
+    Messages are published without waiting for their confirms, the broker acks them in the
+    background and the publisher only waits when too many are in flight.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.delivery_tag = 0
+        self.unconfirmed: set[int] = set()
+        self.nacked_count = 0
+        channel.confirm_select()
+        channel.events['basic_ack'].add(self._on_ack)
+        channel.events['basic_nack'].add(self._on_nack)
+
+    def published(self):
+        self.delivery_tag += 1
+        self.unconfirmed.add(self.delivery_tag)
+
+    def _confirm(self, delivery_tag: int, multiple: bool):
+        if multiple:
+            self.unconfirmed = {tag for tag in self.unconfirmed if tag > delivery_tag}
+        else:
+            self.unconfirmed.discard(delivery_tag)
+
+    def _on_ack(self, delivery_tag: int, multiple: bool):
+        self._confirm(delivery_tag, multiple)
+
+    def _on_nack(self, delivery_tag: int, multiple: bool):
+        before = len(self.unconfirmed)
+        self._confirm(delivery_tag, multiple)
+        self.nacked_count += before - len(self.unconfirmed)
 
 
 class AMQPItemExporter(BaseItemExporter):
     """
     Publishes items to AMQP broker.
+
+    Every thread publishes on its own channel of the shared connection. Items of a routing key
+    are published as JSON lists of up to `max_message_bytes`, pre_events one per message.
     """
 
     def __init__(
@@ -17,15 +60,41 @@ class AMQPItemExporter(BaseItemExporter):
         amqp_url: str,
         exchange: str,
         item_type_to_routing_key_mapping: dict[str, str] | None = None,
+        max_message_bytes: int = envs.AMQP_MAX_MESSAGE_BYTES,
+        compression: str | None = envs.AMQP_COMPRESSION or None,
+        confirm_window: int = envs.AMQP_CONFIRM_WINDOW,
     ):
         super().__init__()
         self._item_type_to_topic_mapping = item_type_to_routing_key_mapping or {}
 
         self._exchange = exchange
         self._amqp_url = amqp_url
+        self._max_message_bytes = max_message_bytes
+        self._compression = compression
+        # 0 publishes without confirms
+        self._confirm_window = confirm_window
 
         self._connection: kombu.Connection = ...
-        self._producer: kombu.Producer = ...
+        self._local = threading.local()
+        self._producers: list[kombu.Producer] = []
+        # the connection's socket is shared by the channels of all threads
+        self._io_lock = threading.RLock()
+
+    @property
+    def _producer(self) -> kombu.Producer:
+        return getattr(self._local, 'producer', ...)
+
+    @_producer.setter
+    def _producer(self, producer: kombu.Producer):
+        self._local.producer = producer
+
+    @property
+    def _confirms(self) -> PublisherConfirms | None:
+        return getattr(self._local, 'confirms', None)
+
+    @_confirms.setter
+    def _confirms(self, confirms: PublisherConfirms | None):
+        self._local.confirms = confirms
 
     def open(self):
         """
@@ -34,35 +103,57 @@ class AMQPItemExporter(BaseItemExporter):
         if self._connection is not Ellipsis and self._producer is not Ellipsis:
             raise RuntimeError('already opened')
 
-        try:
-            self._connection = kombu.Connection(
-                self._amqp_url,
-                connect_timeout=5,
-                transport_options={'max_retries': 0},
-            )
-            exchange = kombu.Exchange(
-                self._exchange,
-                type='direct',
-                durable=True,
-            )
-            self._producer = kombu.Producer(
-                self._connection.channel(),
-                exchange=exchange,
-                auto_declare=True,
-            )
-        except OSError as e:
-            logging.error('Failed to connect to AMQP broker: %s', e)
-            self._connection = ...
-            self._producer = ...
-            raise
+        with self._io_lock:
+            try:
+                if self._connection is Ellipsis:
+                    self._connection = kombu.Connection(
+                        self._amqp_url,
+                        connect_timeout=5,
+                        transport_options={'max_retries': 0},
+                    )
+                exchange = kombu.Exchange(
+                    self._exchange,
+                    type='direct',
+                    durable=True,
+                )
+                channel = self._connection.channel()
+                self._producer = kombu.Producer(
+                    channel,
+                    exchange=exchange,
+                    auto_declare=True,
+                )
+                self._producers.append(self._producer)
+                self._confirms = PublisherConfirms(channel) if self._confirm_window else None
+            except OSError as e:
+                logging.error('Failed to connect to AMQP broker: %s', e)
+                self._close_connection()
+                raise
 
     def close(self):
-        if self._producer is not Ellipsis:
-            self._producer.close()
-            self._producer = ...
-        if self._connection is not Ellipsis:
-            self._connection.close()
-            self._connection = ...
+        if self._producer is not Ellipsis and self._confirms is not None:
+            try:
+                self._wait_for_confirms(0)
+            except ConnectionError as e:
+                logging.error('%s', e)
+        self._close_connection()
+
+    def _close_connection(self):
+        with self._io_lock:
+            for producer in self._producers:
+                try:
+                    producer.close()
+                except OSError as e:
+                    logging.debug('Failed to close AMQP channel: %s', e)
+            self._producers.clear()
+            self._local = threading.local()
+            if self._connection is not Ellipsis:
+                self._connection.close()
+                self._connection = ...
+
+    def _ensure_opened(self):
+        if self._producer is Ellipsis:
+            self.open()
+        self._connection.ensure_connection(errback=self._reopen)
 
     @retry(ConnectionError, tries=3)
     def export_item(self, item: dict[str, Any]):
@@ -70,9 +161,7 @@ class AMQPItemExporter(BaseItemExporter):
         ,
         raises: ConnectionError.
         """
-        if self._producer is Ellipsis:
-            self.open()
-        self._connection.ensure_connection(errback=self._reopen)
+        self._ensure_opened()
 
         item_type = item['type']
         routing_key = self._item_type_to_topic_mapping.get(item_type)
@@ -82,45 +171,104 @@ class AMQPItemExporter(BaseItemExporter):
             return
 
         try:
-            self._producer.publish(item, routing_key=routing_key, serializer='json')
+            with self._io_lock:
+                self._producer.publish(
+                    item,
+                    routing_key=routing_key,
+                    serializer='json',
+                    compression=self._compression,
+                )
+                self._published()
         except OSError as e:
             msg = f'Failed to publish item to AMQP broker: {e}'
             logging.error(msg)
             self._reopen()
             raise ConnectionError(msg) from e
+        self._wait_for_confirms_or_reopen(self._confirm_window)
 
     @retry(ConnectionError, tries=3)
     def export_items(self, items):
         """
+        Returns when the broker confirmed all the messages, when confirms are enabled.
+
         raises: ConnectionError.
         """
-        if self._producer is Ellipsis:
-            self.open()
-        self._connection.ensure_connection(errback=self._reopen)
+        self._ensure_opened()
 
         items_grouped_by_routing_key = self._group_items_by_routing_key(items)
 
         for routing_key, grouped_items in items_grouped_by_routing_key.items():
             if routing_key == 'pre_event':
                 # pre_events are published one by one
-                for item in grouped_items:
-                    try:
-                        self._producer.publish(item, routing_key=routing_key, serializer='json')
-                    except OSError as e:
-                        msg = f'Failed to publish item to AMQP broker: {e}'
-                        logging.error(msg)
-                        self._reopen()
-                        raise ConnectionError(msg) from e
+                bodies = (dumps(item) for item in grouped_items)
             else:
+                bodies = self._batch_bodies(grouped_items)
+            for body in bodies:
                 try:
-                    self._producer.publish(
-                        grouped_items, routing_key=routing_key, serializer='json'
-                    )
+                    with self._io_lock:
+                        self._producer.publish(
+                            body,
+                            routing_key=routing_key,
+                            content_type='application/json',
+                            content_encoding='utf-8',
+                            compression=self._compression,
+                        )
+                        self._published()
                 except OSError as e:
                     msg = f'Failed to publish items to AMQP broker: {e}'
                     logging.error(msg)
                     self._reopen()
                     raise ConnectionError(msg) from e
+                self._wait_for_confirms_or_reopen(self._confirm_window)
+        self._wait_for_confirms_or_reopen(0)
+
+    def _batch_bodies(self, items: Iterable[dict]) -> Iterator[str]:
+        """JSON lists of the items, each up to `max_message_bytes` unless a single item is larger."""
+        batch: list[str] = []
+        batch_size = 2
+        for item in items:
+            serialized_item = dumps(item)
+            if batch and batch_size + len(serialized_item) + 1 > self._max_message_bytes:
+                yield f'[{",".join(batch)}]'
+                batch = []
+                batch_size = 2
+            batch.append(serialized_item)
+            batch_size += len(serialized_item) + 1
+        if batch:
+            yield f'[{",".join(batch)}]'
+
+    def _published(self):
+        if self._confirms is not None:
+            self._confirms.published()
+
+    def _wait_for_confirms(self, max_unconfirmed: int):
+        """
+        Reads confirms from the broker until at most `max_unconfirmed` messages are in flight.
+
+        raises: ConnectionError.
+        """
+        confirms = self._confirms
+        if confirms is None:
+            return
+        try:
+            while len(confirms.unconfirmed) > max_unconfirmed:
+                with self._io_lock:
+                    self._connection.drain_events(timeout=envs.AMQP_CONFIRM_TIMEOUT_SECONDS)
+        except OSError as e:
+            msg = f'Failed to receive publisher confirms from AMQP broker: {e}'
+            logging.error(msg)
+            raise ConnectionError(msg) from e
+        if confirms.nacked_count:
+            nacked_count, confirms.nacked_count = confirms.nacked_count, 0
+            raise ConnectionError(f'AMQP broker rejected {nacked_count} messages')
+
+    def _wait_for_confirms_or_reopen(self, max_unconfirmed: int):
+        """Unconfirmed messages are published again on a new channel by the retry."""
+        try:
+            self._wait_for_confirms(max_unconfirmed)
+        except ConnectionError:
+            self._reopen()
+            raise
 
     def _group_items_by_routing_key(self, items):
         items_grouped_by_routing_key: dict[str, list] = {}
@@ -133,6 +281,29 @@ class AMQPItemExporter(BaseItemExporter):
             items_grouped_by_routing_key.setdefault(routing_key, []).append(item)
         return items_grouped_by_routing_key
 
+    def _close_channel(self):
+        """Closes the channel of the calling thread, the other threads keep publishing."""
+        producer = self._producer
+        if producer is Ellipsis:
+            return
+        with self._io_lock:
+            try:
+                producer.channel.close()
+            except (
+                OSError,
+                *self._connection.connection_errors,
+                *self._connection.channel_errors,
+            ) as e:
+                logging.debug('Failed to close AMQP channel: %s', e)
+            if producer in self._producers:
+                self._producers.remove(producer)
+        self._producer = ...
+        self._confirms = None
+
     def _reopen(self):
-        self.close()
+        """Reopens the channel of the calling thread, and the connection if it is broken."""
+        self._close_channel()
+        with self._io_lock:
+            if self._connection is not Ellipsis and not self._connection.connected:
+                self._close_connection()
         self.open()
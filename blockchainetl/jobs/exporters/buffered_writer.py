@@ -0,0 +1,108 @@
+import logging
+import queue
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# tells the writer thread to write everything and stop
+_CLOSE_WRITER = object()
+
+
+class BufferedWriter:
+    """
+    Writes the batches an exporter queues from a background thread.
+
+    `write(batch, force)` buffers the batch, None when the buffer aged without a new one, and
+    writes what is due, everything when `force`. The thread waits `seconds_to_next_flush()` for
+    a batch, None waits until one is queued. A full queue blocks `put`.
+
+    The first error of `write` is kept and raised by the next `put` or `flush`, the writer keeps
+    running. `flush` waits until everything queued so far is written.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        write: Callable[[Any, bool], None],
+        seconds_to_next_flush: Callable[[], float | None],
+        queue_size: int,
+    ):
+        self.name = name
+        self.write = write
+        self.seconds_to_next_flush = seconds_to_next_flush
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.thread: threading.Thread | None = None
+        # first error of the writes since it was last raised
+        self.error: BaseException | None = None
+        self._error_lock = threading.Lock()
+
+    def start(self):
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def put(self, batch):
+        self.raise_error()
+        self.queue.put(batch)
+
+    def flush(self):
+        """
+        Writes everything queued so far and raises the first error since the last call.
+
+        Batches of a failed write are dropped, the caller exports them again.
+        """
+        if self.thread is None:
+            self.raise_error()
+            return
+        flushed: Future = Future()
+        self.queue.put(flushed)
+        flushed.result()
+
+    def close(self):
+        """Writes everything queued, stops the thread and raises the error of the last writes."""
+        if self.thread is not None:
+            self.queue.put(_CLOSE_WRITER)
+            self.thread.join()
+            self.thread = None
+        self.raise_error()
+
+    def pop_error(self) -> BaseException | None:
+        with self._error_lock:
+            error, self.error = self.error, None
+        return error
+
+    def raise_error(self):
+        error = self.pop_error()
+        if error is not None:
+            raise error
+
+    def _run(self):
+        while True:
+            try:
+                entry = self.queue.get(timeout=self.seconds_to_next_flush())
+            except queue.Empty:
+                entry = None
+            if entry is _CLOSE_WRITER:
+                self._write(None, force=True)
+                return
+            if isinstance(entry, Future):
+                self._write(None, force=True)
+                error = self.pop_error()
+                if error is None:
+                    entry.set_result(None)
+                else:
+                    entry.set_exception(error)
+                continue
+            self._write(entry, force=False)
+
+    def _write(self, batch, force: bool):
+        try:
+            self.write(batch, force)
+        except Exception as e:
+            logger.exception('%s failed to write buffered batches', self.name)
+            with self._error_lock:
+                if self.error is None:
+                    self.error = e
@@ -1,14 +1,21 @@
 import collections
+import hashlib
 import json
 import logging
-from dataclasses import dataclass
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 
 import clickhouse_connect
 import clickhouse_connect.datatypes.numeric as types
+from clickhouse_connect.datatypes.base import ClickHouseType
 from clickhouse_connect.driver.exceptions import DatabaseError
 from clickhouse_connect.driver.models import ColumnDef
+from retry import retry
 
 from blockchainetl.exporters import BaseItemExporter
+from blockchainetl.jobs.exporters.buffered_writer import BufferedWriter
 from ethereumetl.clickhouse import ITEM_TYPE_TO_TABLE_MAPPING
 from ethereumetl.config.envs import envs
 from ethereumetl.utils import parse_clickhouse_url
@@ -19,10 +26,30 @@ logger = logging.getLogger(__name__)
 @dataclass
 class Table:
     column_names: list[str]
-    column_types: list[str]
+    column_types: list[ClickHouseType]
 
 
+@dataclass
+class TableBuffer:
+    items: list[dict] = field(default_factory=list)
+    size_bytes: int = 0
+    first_buffered_at: float | None = None
+
+
+# column-oriented insert data, one list of values per column of the table
+Columns = list[list]
+
 MIN_INSERT_BATCH_SIZE = envs.MIN_INSERT_BATCH_SIZE
+INSERT_MAX_BYTES = envs.CLICKHOUSE_INSERT_MAX_BYTES
+INSERT_MAX_AGE_SECONDS = envs.CLICKHOUSE_INSERT_MAX_AGE_SECONDS
+
+# columns holding the block number of a row, first found is used for deduplication tokens
+BLOCK_NUMBER_COLUMNS = ('block_number', 'number')
+
+# inserts are sent in chunks of this many rows, each with its own deduplication token
+INSERT_CHUNK_ROWS = envs.CLICKHOUSE_INSERT_CHUNK_ROWS
+# blocks rewritten after a reorg, remembered to give their inserts a token of the rewrite
+REWRITTEN_BLOCKS_MAX = 10_000
 
 NUMERIC_TYPE_MAX_VALUES = {
     types.UInt8: 2**8 - 1,
@@ -51,9 +78,25 @@ class ClickHouseItemExporter(BaseItemExporter):
         self.database = parsed['database']
         self.settings = parsed['settings']
         self.connection: clickhouse_connect.driver.HttpClient | None = None
-        self.tables = {}
-        self.cached_batches = {}
+        self.tables: dict[str, Table] = {}
+        self.buffers: dict[str, TableBuffer] = {}
         self.item_type_to_table_mapping = ITEM_TYPE_TO_TABLE_MAPPING
+        self.insert_max_workers = envs.CLICKHOUSE_INSERT_MAX_WORKERS
+        self.insert_executor: ThreadPoolExecutor | None = None
+        # concurrent queries can't share a client, its session is locked by the running one
+        self._thread_local = threading.local()
+        # block number -> time of its latest rewrite in nanoseconds
+        self.rewritten_blocks: dict[int, int] = {}
+        self._rewritten_blocks_lock = threading.Lock()
+        self._insert_connections: list[clickhouse_connect.driver.HttpClient] = []
+        self._insert_connections_lock = threading.Lock()
+        # batches are inserted by a background writer, a full queue blocks the exporting thread
+        self.writer = BufferedWriter(
+            'clickhouse-writer',
+            self._insert_batches,
+            self._seconds_to_next_flush,
+            envs.CLICKHOUSE_INSERT_QUEUE_SIZE,
+        )
 
     def open(self):
         if self.connection:
@@ -72,7 +115,7 @@ class ClickHouseItemExporter(BaseItemExporter):
                 column_names = [cd.name for cd in column_defs]
                 column_types = [cd.ch_type for cd in column_defs]
                 self.tables[table] = Table(column_names, column_types)
-                self.cached_batches[table] = []
+                self.buffers[table] = TableBuffer()
             except DatabaseError as de:
                 # this may not be critical since the user may not be exporting the type and hence the table likely
                 # won't exist
@@ -82,46 +125,163 @@ class ClickHouseItemExporter(BaseItemExporter):
                 logger.debug(de)
                 pass
 
+        self._start_writer()
+
+    def _start_writer(self):
+        self.insert_executor = ThreadPoolExecutor(
+            self.insert_max_workers, thread_name_prefix='clickhouse-insert'
+        )
+        self.writer.start()
+
     def export_item(self, item):
         self.export_items([item])
 
     def export_items(self, items):
+        """Queues the items for the writer, `flush` waits until they are inserted."""
         items_grouped_by_table = self.group_items_by_table(items)
-        for item_type, table in self.item_type_to_table_mapping.items():
-            table_data = items_grouped_by_table.get(table)
-            if table_data:
-                cached = self.cached_batches[table]
-                batch = cached + table_data
-                if len(batch) >= MIN_INSERT_BATCH_SIZE:
-                    logger.info(f'Flushing batch for "{item_type}" with {len(batch)} items.')
-                    column_names = self.tables[table].column_names
-                    column_types = self.tables[table].column_types
-                    self._insert(column_names, column_types, table, batch)
-                    self.cached_batches[table] = []
-                else:
-                    # insufficient size, so cache
-                    logger.debug(
-                        f'Batch for "{item_type}" is too small to be flushed'
-                        f' ({len(batch)}<{MIN_INSERT_BATCH_SIZE}), caching.'
-                    )
-                    self.cached_batches[table] = batch
+        if items_grouped_by_table:
+            self.writer.put(items_grouped_by_table)
+        else:
+            self.writer.raise_error()
+
+    def flush(self):
+        """
+        Inserts everything exported so far and raises the first insert error since the last call.
+
+        Rows of a failed insert are dropped, the caller exports them again.
+        """
+        self.writer.flush()
+
+    def _insert_batches(self, items_by_table: dict[str, list[dict]] | None, force: bool):
+        """Buffers the items and inserts the tables due for a flush."""
+        for table, items in (items_by_table or {}).items():
+            self._buffer_items(table, items)
+        self.insert_tables(self._pop_batches(force))
+
+    def _buffer_items(self, table: str, items: list[dict]):
+        buffer = self.buffers[table]
+        if buffer.first_buffered_at is None:
+            buffer.first_buffered_at = time.monotonic()
+        buffer.items.extend(items)
+        buffer.size_bytes += sum(map(estimate_item_size, items))
 
-    def _insert(self, column_names, column_types, table, table_data):
-        if self.connection is None:
+    def _seconds_to_next_flush(self) -> float | None:
+        first_buffered_at = [
+            buffer.first_buffered_at
+            for buffer in self.buffers.values()
+            if buffer.first_buffered_at is not None
+        ]
+        if not first_buffered_at:
+            return None
+        return max(0.0, min(first_buffered_at) + INSERT_MAX_AGE_SECONDS - time.monotonic())
+
+    def _pop_batches(self, force=False) -> dict[str, list[dict]]:
+        """Takes the buffered items of tables due for a flush by row count, size or age."""
+        now = time.monotonic()
+        batches = {}
+        for table, buffer in self.buffers.items():
+            if buffer.first_buffered_at is None:
+                continue
+            if (
+                force
+                or len(buffer.items) >= MIN_INSERT_BATCH_SIZE
+                or buffer.size_bytes >= INSERT_MAX_BYTES
+                or now - buffer.first_buffered_at >= INSERT_MAX_AGE_SECONDS
+            ):
+                logger.info(
+                    f'Flushing batch for "{table}" with {len(buffer.items)} items'
+                    f' of ~{buffer.size_bytes} bytes.'
+                )
+                batches[table] = buffer.items
+                self.buffers[table] = TableBuffer()
+            else:
+                logger.debug(
+                    f'Batch for "{table}" is too small to be flushed'
+                    f' ({len(buffer.items)}<{MIN_INSERT_BATCH_SIZE}), caching.'
+                )
+        return batches
+
+    def insert_tables(self, items_by_table: dict[str, list[dict]]):
+        """Inserts the items of every table, tables are inserted concurrently."""
+        items_by_table = {table: items for table, items in items_by_table.items() if items}
+        if not items_by_table:
+            return
+        if self.insert_executor is None:
             raise RuntimeError('Connection is not open.')
+        futures = [
+            self.insert_executor.submit(
+                self._insert,
+                self.tables[table].column_names,
+                self.tables[table].column_types,
+                table,
+                self.items_to_columns(table, items),
+            )
+            for table, items in items_by_table.items()
+        ]
+        # wait for every insert before raising, so no insert outlives the batch
+        errors = [future.exception() for future in futures]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def rewrite_blocks(self, block_numbers):
+        """
+        Gives the next inserts of these blocks deduplication tokens of their own.
+
+        Blocks exported again after a reorg may have the same rows as an insert ClickHouse
+        still remembers, e.g. when the chain switched back, those must not be dropped.
+        Retries of these inserts keep their token.
+        """
+        rewrite = time.time_ns()
+        with self._rewritten_blocks_lock:
+            for block_number in block_numbers:
+                self.rewritten_blocks.pop(block_number, None)
+                self.rewritten_blocks[block_number] = rewrite
+            while len(self.rewritten_blocks) > REWRITTEN_BLOCKS_MAX:
+                del self.rewritten_blocks[next(iter(self.rewritten_blocks))]
+
+    def _insert(self, column_names, column_types, table, columns: Columns):
+        """Inserts the rows in chunks split the same way every time the same rows are inserted."""
+        row_count = len(columns[0]) if columns else 0
+        if row_count <= INSERT_CHUNK_ROWS:
+            self._insert_chunk(column_names, column_types, table, columns, '0')
+            return
+        for chunk, start in enumerate(range(0, row_count, INSERT_CHUNK_ROWS)):
+            chunk_columns = [values[start : start + INSERT_CHUNK_ROWS] for values in columns]
+            self._insert_chunk(column_names, column_types, table, chunk_columns, str(chunk))
+
+    @retry(
+        clickhouse_connect.driver.exceptions.OperationalError,
+        tries=envs.CLICKHOUSE_INSERT_TIMEOUT_RETRIES + 1,
+        delay=1,
+        backoff=2,
+        logger=logger,
+    )
+    def _insert_chunk(self, column_names, column_types, table, columns: Columns, chunk: str):
+        """
+        A chunk timing out is sent again unchanged, with the same deduplication token, so the
+        retry is dropped when the server committed the first attempt.
+        """
+        token = insert_deduplication_token(table, column_names, columns, chunk)
+        rewrite = self._latest_rewrite(column_names, columns)
+        if rewrite:
+            token = f'{token}:{rewrite}'
         try:
-            self.connection.insert(
+            self._get_insert_connection().insert(
                 table,
-                data=table_data,
+                data=columns,
                 column_names=column_names,
                 column_types=column_types,
                 database=self.database,
+                column_oriented=True,
+                settings={'insert_deduplication_token': token},
             )
         except clickhouse_connect.driver.exceptions.ProgrammingError as e:
-            for row in table_data:
-                for i, column_value in enumerate(row):
-                    column_type = column_types[i]
-                    column_name = column_names[i]
+            rows = list(zip(*columns))
+            for i, column_values in enumerate(columns):
+                column_type = column_types[i]
+                column_name = column_names[i]
+                for row, column_value in zip(rows, column_values):
                     if isinstance(column_value, int):
                         max_value = NUMERIC_TYPE_MAX_VALUES.get(type(column_type))
                         if max_value is None:
@@ -154,17 +314,27 @@ class ClickHouseItemExporter(BaseItemExporter):
                             f" table={table} column={column_name}"
                         ) from e
             raise
-        except clickhouse_connect.driver.exceptions.OperationalError as e:
-            logger.warning(
-                f'Insert timeout error: table={table} row_count={len(table_data)} error={e}'
+
+    def _latest_rewrite(self, column_names, columns: Columns) -> int:
+        if not self.rewritten_blocks:
+            return 0
+        with self._rewritten_blocks_lock:
+            return max(
+                (
+                    self.rewritten_blocks.get(block_number, 0)
+                    for block_number in set(block_numbers_of_rows(column_names, columns))
+                ),
+                default=0,
             )
-            # insert items by batches
-            batch_size = len(table_data) // 2
-            if batch_size < MIN_INSERT_BATCH_SIZE:
-                batch_size = MIN_INSERT_BATCH_SIZE
-            for i in range(0, len(table_data), batch_size):
-                batch = table_data[i : i + batch_size]
-                self._insert(column_names, column_types, table, batch)
+
+    def _get_insert_connection(self):
+        connection = getattr(self._thread_local, 'connection', None)
+        if connection is None:
+            connection = self.create_connection()
+            self._thread_local.connection = connection
+            with self._insert_connections_lock:
+                self._insert_connections.append(connection)
+        return connection
 
     def create_connection(self):
         return clickhouse_connect.create_client(
@@ -174,24 +344,26 @@ class ClickHouseItemExporter(BaseItemExporter):
             password=self.password,
             database=self.database,
             settings=self.settings,
-            compress=False,
+            compress='gzip' if envs.CLICKHOUSE_COMPRESS else False,
             send_receive_timeout=600,
         )
 
     def close(self):
         try:
-            # clear the cache
             logger.info("Flushing remaining batches")
-            for table, batch in self.cached_batches.items():
-                self._insert(
-                    self.tables[table].column_names, self.tables[table].column_types, table, batch
-                )
+            self.writer.close()
         finally:
-            self.cached_batches.clear()
+            self.buffers.clear()
+            if self.insert_executor is not None:
+                self.insert_executor.shutdown()
+                self.insert_executor = None
+            for connection in self._insert_connections:
+                connection.close()
+            self._insert_connections.clear()
             if self.connection:
                 self.connection.close()
 
-    def group_items_by_table(self, items):
+    def group_items_by_table(self, items) -> dict[str, list[dict]]:
         results = collections.defaultdict(list)
         for item in items:
             type_ = item.get('type')
@@ -201,14 +373,54 @@ class ClickHouseItemExporter(BaseItemExporter):
                     logger.error(
                         f'Table "{table}" does not exist. Type "{type_}" cannot be exported.'
                     )
-                result = []
-                # only insert the columns which we have in the database
-                for column in self.tables[table].column_names:
-                    if column == 'is_reorged':
-                        result.append(item.get(column, False))
-                    else:
-                        result.append(item.get(column))
-                results[table].append(result)
+                    continue
+                results[table].append(item)
             else:
                 continue
         return results
+
+    def items_to_columns(self, table, items: list[dict]) -> Columns:
+        # only insert the columns which we have in the database
+        return [
+            (
+                [item.get(column, False) for item in items]
+                if column == 'is_reorged'
+                else [item.get(column) for item in items]
+            )
+            for column in self.tables[table].column_names
+        ]
+
+
+def estimate_item_size(item: dict) -> int:
+    """Rough size of an item in an insert, strings dominate the rows of every table."""
+    return sum(len(value) if isinstance(value, str) else 8 for value in item.values())
+
+
+def block_numbers_of_rows(column_names: list[str], columns: Columns) -> list[int]:
+    for block_number_column in BLOCK_NUMBER_COLUMNS:
+        if block_number_column in column_names:
+            return [
+                block_number
+                for block_number in columns[column_names.index(block_number_column)]
+                if block_number is not None
+            ]
+    return []
+
+
+def insert_deduplication_token(
+    table: str, column_names: list[str], columns: Columns, chunk: str
+) -> str:
+    """
+    Token of an insert, the same for the same rows of the same blocks.
+
+    ClickHouse drops an insert whose token it has already seen, so retried inserts and batches
+    replayed after a restart don't leave duplicate parts behind. The digest of the rows keeps
+    re-exported blocks with new data, e.g. rewritten items, from being dropped as well.
+    """
+    block_numbers = block_numbers_of_rows(column_names, columns)
+    block_range = f'{min(block_numbers)}-{max(block_numbers)}' if block_numbers else ''
+    # column by column, without building the text of the whole chunk at once
+    digest = hashlib.blake2b(digest_size=16)
+    for column_values in columns:
+        digest.update(repr(column_values).encode())
+    return f'{table}:{block_range}:{chunk}:{digest.hexdigest()}'
@@ -23,16 +23,24 @@ import logging
 
 from blockchainetl.atomic_counter import AtomicCounter
 from blockchainetl.exporters import BaseItemExporter, CsvItemExporter, JsonLinesItemExporter
-from blockchainetl.file_utils import close_silently, get_file_handle
+from blockchainetl.file_utils import (
+    close_silently,
+    get_file_handle,
+    strip_compression_extension,
+)
 from blockchainetl.jobs.exporters.converters.composite_item_converter import CompositeItemConverter
 from ethereumetl.enumeration.entity_type import EntityType
 
 
 class CompositeItemExporter(BaseItemExporter):
-    def __init__(self, filename_mapping, field_mapping=None, converters=(), **kwargs):
+    def __init__(
+        self, filename_mapping, field_mapping=None, converters=(), compression=None, **kwargs
+    ):
         super().__init__(**kwargs)
         self.filename_mapping = filename_mapping
         self.field_mapping = field_mapping or {}
+        # gzip, zstd or lz4, by default chosen by the file extension e.g. blocks.csv.gz
+        self.compression = compression
 
         self.file_mapping = {}
         self.exporter_mapping: dict[EntityType, BaseItemExporter] = {}
@@ -44,13 +52,20 @@ class CompositeItemExporter(BaseItemExporter):
 
     def open(self):
         for item_type, filename in self.filename_mapping.items():
-            file = get_file_handle(filename, binary=True)
+            file = get_file_handle(filename, binary=True, compression=self.compression)
             fields = self.field_mapping.get(item_type)
             self.file_mapping[item_type] = file
-            if str(filename).endswith('.json'):
+            file_format = strip_compression_extension(filename)
+            if file_format.endswith('.json'):
                 item_exporter: BaseItemExporter = JsonLinesItemExporter(
                     file, fields_to_export=fields
                 )
+            elif file_format.endswith('.parquet'):
+                from blockchainetl.jobs.exporters.parquet_item_exporter import (
+                    ParquetItemExporter,
+                )
+
+                item_exporter = ParquetItemExporter(file, fields_to_export=fields)
             else:
                 item_exporter = CsvItemExporter(file, fields_to_export=fields)
             self.exporter_mapping[item_type] = item_exporter
@@ -77,6 +92,8 @@ class CompositeItemExporter(BaseItemExporter):
 
     def close(self):
         for item_type, file in self.file_mapping.items():
+            # Parquet exporters write their last row group and footer
+            self.exporter_mapping[item_type].close()
             close_silently(file)
             counter = self.counter_mapping[item_type]
             if counter is not None:
@@ -1,50 +1,137 @@
+import json
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 
 from elasticsearch import Elasticsearch
-from elasticsearch.exceptions import TransportError
-from elasticsearch.helpers import BulkIndexError, parallel_bulk
+from elasticsearch.exceptions import ApiError, TransportError
 from retry import retry
 
 from blockchainetl.exporters import BaseItemExporter
+from blockchainetl.jobs.exporters.buffered_writer import BufferedWriter
+from ethereumetl.config.envs import envs
 
 logger = logging.getLogger(__name__)
 
+BUFFER_MAX_DOCS = envs.ELASTIC_BUFFER_MAX_DOCS
+BUFFER_MAX_BYTES = envs.ELASTIC_BUFFER_MAX_BYTES
+BUFFER_MAX_AGE_SECONDS = envs.ELASTIC_BUFFER_MAX_AGE_SECONDS
+
+# HTTP status of documents and requests rejected by a full indexing queue of the cluster
+TOO_MANY_REQUESTS = 429
+
+
+@dataclass
+class BulkBuffer:
+    actions: list[dict] = field(default_factory=list)
+    size_bytes: int = 0
+    first_buffered_at: float | None = None
+
+
+class AdaptiveChunkSize:
+    """
+    Number of documents per bulk request.
+
+    Grows while requests finish under the target latency, halves when a request is slower or
+    the cluster rejects documents.
+    """
+
+    def __init__(
+        self,
+        initial: int = envs.ELASTIC_BULK_CHUNK_SIZE,
+        minimum: int = envs.ELASTIC_BULK_MIN_CHUNK_SIZE,
+        maximum: int = envs.ELASTIC_BULK_MAX_CHUNK_SIZE,
+        target_latency_seconds: float = envs.ELASTIC_BULK_TARGET_LATENCY_SECONDS,
+    ):
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency_seconds = target_latency_seconds
+
+    def split(self, actions: list[dict]) -> list[list[dict]]:
+        return [actions[i : i + self.size] for i in range(0, len(actions), self.size)]
+
+    def observe(self, latency_seconds: float, rejected: bool):
+        if rejected or latency_seconds > self.target_latency_seconds:
+            self.size = max(self.minimum, self.size // 2)
+        else:
+            self.size = min(self.maximum, self.size + max(1, self.size // 4))
+
 
 class ElasticsearchItemExporter(BaseItemExporter):
+    """
+    Buffers documents across batches and indexes them with bulk requests from a writer thread.
+
+    The buffer is flushed by document count, size or age, a full queue blocks the exporting
+    thread. Documents rejected by the cluster are retried alone, with backoff. `flush` waits
+    until everything exported so far is indexed.
+    """
+
     def __init__(self, elasticsearch_url, item_type_to_index_mapping, chain_id=1):
         super().__init__()
         self.item_type_to_index_mapping = item_type_to_index_mapping
         self.chain_id = chain_id
         self.connection_url = elasticsearch_url
         self.client: None | Elasticsearch = None
-        self.bulk_data = []
+        self.buffer = BulkBuffer()
+        self.chunk_size = AdaptiveChunkSize()
+        self.bulk_executor: ThreadPoolExecutor | None = None
+        self.writer = BufferedWriter(
+            'elasticsearch-writer',
+            self._index_buffer,
+            self._seconds_to_next_flush,
+            envs.ELASTIC_BULK_QUEUE_SIZE,
+        )
 
     def close(self):
         assert (
             self.client is not None
         ), 'Cannot close ElasticsearchItemExporter, it has not been opened'
-        self._flush_bulk_data()
-        self.client.close()
-        self.client = None
+        try:
+            self.writer.close()
+        finally:
+            if self.bulk_executor is not None:
+                self.bulk_executor.shutdown()
+                self.bulk_executor = None
+            self.client.close()
+            self.client = None
 
     def open(self):
         assert self.client is None, 'Cannot open ElasticsearchItemExporter, it is already opened'
         self.client = Elasticsearch(self.connection_url)
         assert self.client.ping(), 'Cannot connect to Elasticsearch'
+        self.bulk_executor = ThreadPoolExecutor(
+            envs.ELASTIC_BULK_MAX_WORKERS, thread_name_prefix='elasticsearch-bulk'
+        )
+        self.writer.start()
 
     def export_item(self, item):
         self.export_items([item])
 
     def export_items(self, items):
+        """Queues the documents for the writer, `flush` waits until they are indexed."""
+        actions = []
         for item in items:
             item_type = item.get('type')
             index = self.item_type_to_index_mapping.get(item_type)
             if index:
                 converted_item = self._convert_to_bulk_data(item)
-                self.bulk_data.append(
+                actions.append(
                     {'_index': index, '_source': converted_item, '_id': converted_item['id']}
                 )
-        self._flush_bulk_data()
+        if actions:
+            self.writer.put(actions)
+        else:
+            self.writer.raise_error()
+
+    def flush(self):
+        """
+        Indexes everything exported so far and raises the first error since the last call.
+
+        Documents of a failed flush are dropped, the caller exports them again.
+        """
+        self.writer.flush()
 
     @staticmethod
     def _convert_to_bulk_data(item):
@@ -57,21 +144,88 @@ class ElasticsearchItemExporter(BaseItemExporter):
             item.pop('transfer_type')
         return item
 
-    @retry(TransportError, tries=5, delay=1, logger=logger)
+    def _index_buffer(self, actions: list[dict] | None, force: bool):
+        """Buffers the documents and indexes the buffer when due."""
+        self._buffer_actions(actions or [])
+        if force or self._is_flush_due():
+            self._flush_bulk_data()
+
+    def _buffer_actions(self, actions: list[dict]):
+        if not actions:
+            return
+        if self.buffer.first_buffered_at is None:
+            self.buffer.first_buffered_at = time.monotonic()
+        self.buffer.actions.extend(actions)
+        self.buffer.size_bytes += sum(
+            len(json.dumps(action['_source'], default=str)) for action in actions
+        )
+
+    def _seconds_to_next_flush(self) -> float | None:
+        if self.buffer.first_buffered_at is None:
+            return None
+        return max(0.0, self.buffer.first_buffered_at + BUFFER_MAX_AGE_SECONDS - time.monotonic())
+
+    def _is_flush_due(self) -> bool:
+        if self.buffer.first_buffered_at is None:
+            return False
+        return (
+            len(self.buffer.actions) >= BUFFER_MAX_DOCS
+            or self.buffer.size_bytes >= BUFFER_MAX_BYTES
+            or time.monotonic() - self.buffer.first_buffered_at >= BUFFER_MAX_AGE_SECONDS
+        )
+
     def _flush_bulk_data(self):
         assert (
-            self.client is not None
+            self.client is not None and self.bulk_executor is not None
         ), 'Cannot flush bulk data, ElasticsearchItemExporter is not opened'
-        if not self.bulk_data:
+        actions, self.buffer = self.buffer.actions, BulkBuffer()
+        if not actions:
             return
-        logger.info('Flushing %s items to Elasticsearch', len(self.bulk_data))
+        logger.info('Flushing %s items to Elasticsearch', len(actions))
+        for attempt in range(envs.ELASTIC_BULK_MAX_RETRIES + 1):
+            if attempt:
+                backoff_seconds = min(2 ** (attempt - 1), 30)
+                logger.warning(
+                    'Elasticsearch rejected %s documents, retrying in %s seconds',
+                    len(actions),
+                    backoff_seconds,
+                )
+                time.sleep(backoff_seconds)
+            results = list(
+                self.bulk_executor.map(self._send_chunk, self.chunk_size.split(actions))
+            )
+            actions = []
+            for rejected_actions, latency_seconds in results:
+                self.chunk_size.observe(latency_seconds, rejected=bool(rejected_actions))
+                actions.extend(rejected_actions)
+            if not actions:
+                return
+        raise RuntimeError(f'Elasticsearch rejected {len(actions)} documents after retries')
+
+    @retry(TransportError, tries=5, delay=1, logger=logger)
+    def _send_chunk(self, actions: list[dict]) -> tuple[list[dict], float]:
+        """Indexes the documents, returns the ones rejected by the cluster and the latency."""
+        assert self.client is not None
+        operations: list[dict] = []
+        for action in actions:
+            operations.append({'index': {'_index': action['_index'], '_id': action['_id']}})
+            operations.append(action['_source'])
+
+        started_at = time.monotonic()
         try:
-            for success, info in parallel_bulk(
-                client=self.client, actions=self.bulk_data, thread_count=8
-            ):
-                if not success:
+            response = self.client.bulk(operations=operations)
+        except ApiError as e:
+            if e.meta.status == TOO_MANY_REQUESTS:
+                return actions, time.monotonic() - started_at
+            raise
+        latency_seconds = time.monotonic() - started_at
+
+        rejected_actions = []
+        if response['errors']:
+            for action, result in zip(actions, response['items']):
+                info = result['index']
+                if info['status'] == TOO_MANY_REQUESTS:
+                    rejected_actions.append(action)
+                elif info.get('error'):
                     logger.error('Failed to flush bulk data to Elasticsearch: %s', info)
-        except BulkIndexError as e:
-            logger.exception('Error while flushing bulk data to Elasticsearch: %s', e)
-        finally:
-            self.bulk_data = []
+        return rejected_actions, latency_seconds
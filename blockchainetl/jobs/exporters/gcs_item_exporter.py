@@ -20,13 +20,16 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import gzip
 import json
 import logging
 from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from google.cloud import storage  # type: ignore[attr-defined]
 
 from blockchainetl.exporters import BaseItemExporter
+from ethereumetl.config.envs import envs
 
 
 def build_block_bundles(items) -> list[dict]:
@@ -70,12 +73,49 @@ def build_block_bundles(items) -> list[dict]:
 
 
 class GcsItemExporter(BaseItemExporter):
-    def __init__(self, bucket, path='blocks', build_block_bundles_func=build_block_bundles):
+    """
+    Uploads a JSON block bundle per block, named `{path}/{block_number}.json`.
+
+    With `bundle_blocks` above 1, blocks are bundled in objects of fixed windows of that many
+    blocks, named after the window, e.g. `000000000100-000000000199.json`, one JSON block
+    bundle per line, gzipped when `compress` is set. Objects are uploaded concurrently. When an
+    object is uploaded, the manifest entry of its window is written under `manifest/`, so
+    consumers list the manifest instead of the objects, which may still be uploading.
+
+    Exporting blocks again overwrites the objects of their windows, so objects never overlap.
+    A window flushed before it is complete is uploaded again with the rest of its blocks, blocks
+    of the window already uploaded and not exported again are kept.
+    """
+
+    def __init__(
+        self,
+        bucket,
+        path='blocks',
+        build_block_bundles_func=build_block_bundles,
+        bundle_blocks: int = envs.GCS_BUNDLE_BLOCKS,
+        compress: bool = envs.GCS_COMPRESS,
+        max_workers: int = envs.GCS_UPLOAD_MAX_WORKERS,
+    ):
         super().__init__()
         self.bucket = bucket
         self.path = normalize_path(path)
         self.build_block_bundles_func = build_block_bundles_func
+        self.bundle_blocks = bundle_blocks
+        self.compress = compress
+        self.max_workers = max_workers
         self.storage_client = storage.Client()
+        self.storage_bucket = self.storage_client.bucket(self.bucket)
+
+        # serialized block bundles by block number, of the windows not complete yet
+        self.windows: dict[int, dict[int, bytes]] = {}
+
+        self.upload_executor: ThreadPoolExecutor | None = None
+        self.uploads: list[Future] = []
+
+    def open(self):
+        self.upload_executor = ThreadPoolExecutor(
+            self.max_workers, thread_name_prefix='gcs-upload'
+        )
 
     def export_item(self, item):
         self.export_items([item])
@@ -91,12 +131,100 @@ class GcsItemExporter(BaseItemExporter):
             if block_number is None:
                 raise ValueError('block_bundle must include the block.number field')
 
-            destination_blob_name = f'{self.path}/{block_number}.json'
+            window_start = block_number - block_number % self.bundle_blocks
+            window = self.windows.setdefault(window_start, {})
+            window[block_number] = json.dumps(block_bundle).encode('utf-8')
+            if len(window) == self.bundle_blocks:
+                self._upload_window(window_start, complete=True)
+
+    def _upload_window(self, window_start: int, complete: bool):
+        if self.upload_executor is None:
+            self.open()
+        assert self.upload_executor is not None
+        if complete:
+            lines = self.windows.pop(window_start)
+        else:
+            # kept for the upload of the complete window
+            lines = dict(self.windows[window_start])
+
+        # waiting for the oldest uploads bounds the memory held by windows in flight
+        while len(self.uploads) >= self.max_workers * 2:
+            self.uploads.pop(0).result()
+        self.uploads.append(
+            self.upload_executor.submit(self._upload, window_start, lines, complete)
+        )
+
+    def _upload(self, window_start: int, lines: dict[int, bytes], complete: bool):
+        window_end = window_start + self.bundle_blocks - 1
+        if self.bundle_blocks == 1:
+            name = f'{window_start}.json'
+        else:
+            name = f'{window_start:012d}-{window_end:012d}.json'
+        if self.compress:
+            name += '.gz'
+        destination_blob_name = f'{self.path}/{name}' if self.path else name
+        blob = self.storage_bucket.blob(destination_blob_name)
+
+        if not complete:
+            # blocks of the window uploaded before, e.g. by a run which was restarted
+            for block_number, line in self._read_window(blob).items():
+                lines.setdefault(block_number, line)
+
+        if self.bundle_blocks == 1:
+            data = lines[window_start]
+            content_type = 'application/json'
+        else:
+            data = b''.join(lines[block_number] + b'\n' for block_number in sorted(lines))
+            content_type = 'application/x-ndjson'
+        if self.compress:
+            data = gzip.compress(data, compresslevel=6)
+            content_type = 'application/gzip'
+        blob.upload_from_string(data, content_type=content_type)
+        logging.info(f'Uploaded file gs://{self.bucket}/{destination_blob_name}')
+
+        if self.bundle_blocks == 1:
+            return
+        manifest_entry = {
+            'object': destination_blob_name,
+            'first_block_number': min(lines),
+            'last_block_number': max(lines),
+            'blocks': len(lines),
+            'size_bytes': len(data),
+            'format': 'ndjson',
+            'compression': 'gzip' if self.compress else None,
+        }
+        manifest_blob_name = f'{self.path}/manifest/{name}' if self.path else f'manifest/{name}'
+        self.storage_bucket.blob(manifest_blob_name.removesuffix('.gz')).upload_from_string(
+            json.dumps(manifest_entry), content_type='application/json'
+        )
 
-            bucket = self.storage_client.bucket(self.bucket)
-            blob = bucket.blob(destination_blob_name)
-            blob.upload_from_string(json.dumps(block_bundle))
-            logging.info(f'Uploaded file gs://{self.bucket}/{destination_blob_name}')
+    def _read_window(self, blob) -> dict[int, bytes]:
+        if not blob.exists():
+            return {}
+        data = blob.download_as_bytes()
+        if self.compress:
+            data = gzip.decompress(data)
+        return {json.loads(line)['block']['number']: line for line in data.splitlines() if line}
+
+    def flush(self):
+        """Uploads the blocks exported so far and raises the first failed upload."""
+        for window_start in sorted(self.windows):
+            self._upload_window(window_start, complete=False)
+        uploads, self.uploads = self.uploads, []
+        # wait for every upload before raising, so no upload outlives the flush
+        errors = [upload.exception() for upload in uploads]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.windows.clear()
+            if self.upload_executor is not None:
+                self.upload_executor.shutdown()
+                self.upload_executor = None
 
 
 def normalize_path(p):
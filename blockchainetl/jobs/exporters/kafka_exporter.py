@@ -1,21 +1,66 @@
 import collections
 import json
 import logging
+import threading
+from collections.abc import Callable, Iterable
 
 from kafka import KafkaProducer
 
 from blockchainetl.exporters import BaseItemExporter
 from blockchainetl.jobs.exporters.converters.composite_item_converter import CompositeItemConverter
+from ethereumetl.config.envs import envs
+
+
+def block_number_partition_key(item: dict) -> bytes | None:
+    """Keeps the records of a block in one partition, so consumers read a block in order."""
+    block_number = item.get('block_number')
+    if block_number is None and item.get('type') == 'block':
+        block_number = item.get('number')
+    if block_number is None:
+        return None
+    return str(block_number).encode()
+
+
+def address_partition_key(item: dict) -> bytes | None:
+    """Keeps the records of a contract or token in one partition, falls back to the block."""
+    address = item.get('address') or item.get('token_address')
+    if address is None:
+        return block_number_partition_key(item)
+    return address.lower().encode()
+
+
+PARTITION_KEY_CALLABLES: dict[str, Callable[[dict], bytes | None]] = {
+    'block_number': block_number_partition_key,
+    'address': address_partition_key,
+}
 
 
 class KafkaItemExporter(BaseItemExporter):
-    def __init__(self, output, item_type_to_topic_mapping, converters=()):
+    def __init__(
+        self,
+        output,
+        item_type_to_topic_mapping,
+        converters=(),
+        partition_key_callable: Callable[[dict], bytes | None] | None = None,
+    ):
         super().__init__()
         self.item_type_to_topic_mapping = item_type_to_topic_mapping
         self.converter = CompositeItemConverter(converters)
         self.connection_url = self.get_connection_url(output)
-        print(self.connection_url)
-        self.producer = KafkaProducer(bootstrap_servers=self.connection_url)
+        self.partition_key_callable = partition_key_callable or PARTITION_KEY_CALLABLES.get(
+            envs.KAFKA_PARTITION_KEY
+        )
+        logging.info('Kafka bootstrap servers: %s', self.connection_url)
+        self.producer = KafkaProducer(
+            bootstrap_servers=self.connection_url,
+            linger_ms=envs.KAFKA_LINGER_MS,
+            batch_size=envs.KAFKA_BATCH_SIZE,
+            compression_type=envs.KAFKA_COMPRESSION_TYPE or None,
+        )
+        # delivery reports come from the producer's I/O thread
+        self.delivery_errors_lock = threading.Lock()
+        self.delivery_errors_count = 0
+        self.last_delivery_error: Exception | None = None
 
     @staticmethod
     def get_connection_url(output):
@@ -26,16 +71,48 @@ class KafkaItemExporter(BaseItemExporter):
                 'Invalid kafka output param, It should be in format of "kafka/127.0.0.1:9092"'
             )
 
+    def export_items(self, items: Iterable[dict]):
+        """Sends the items as one batch and waits until the broker acknowledged all of them."""
+        for item in items:
+            self.export_item(item)
+        self.flush()
+
     def export_item(self, item):
         item_type = item.get('type')
         if item_type is not None and item_type in self.item_type_to_topic_mapping:
             data = json.dumps(item).encode('utf-8')
             logging.debug(data)
-            return self.producer.send(self.item_type_to_topic_mapping[item_type], value=data)
+            key = self.partition_key_callable(item) if self.partition_key_callable else None
+            future = self.producer.send(
+                self.item_type_to_topic_mapping[item_type], value=data, key=key
+            )
+            future.add_errback(self._on_delivery_error)
+            return future
         else:
             logging.warning(f'Topic for item type "{item_type}" is not configured.')
             return None
 
+    def _on_delivery_error(self, error: Exception):
+        logging.error('Kafka record was not delivered: %s', error)
+        with self.delivery_errors_lock:
+            self.delivery_errors_count += 1
+            self.last_delivery_error = error
+
+    def flush(self):
+        """Waits for the records sent so far and raises if any of them was not delivered."""
+        self.producer.flush()
+        with self.delivery_errors_lock:
+            errors_count, self.delivery_errors_count = self.delivery_errors_count, 0
+            last_error, self.last_delivery_error = self.last_delivery_error, None
+        if errors_count:
+            raise RuntimeError(f'{errors_count} Kafka records were not delivered') from last_error
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.producer.close()
+
     def convert_items(self, items):
         for item in items:
             yield self.converter.convert_item(item)
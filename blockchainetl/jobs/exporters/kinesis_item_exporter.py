@@ -20,68 +20,244 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import hashlib
 import json
+import logging
+import time
 import uuid
+import zlib
 from collections.abc import Callable, Iterable
-from itertools import zip_longest
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
 import boto3
 
 from blockchainetl.exporters import BaseItemExporter
+from ethereumetl.config.envs import envs
 
 _KINESIS_BATCH_LIMIT = 500
+_KINESIS_BATCH_MAX_BYTES = 5 * 1024 * 1024
+# a record, its data and partition key, may be up to 1 MiB
+_KINESIS_RECORD_MAX_BYTES = 1024 * 1024
+
+# https://github.com/awslabs/amazon-kinesis-producer/blob/master/aggregation-format.md
+_KPL_AGGREGATION_MAGIC = b'\xf3\x89\x9a\xc2'
+_KPL_AGGREGATION_OVERHEAD = len(_KPL_AGGREGATION_MAGIC) + hashlib.md5().digest_size
 
 
 def _uuid_partition_key(_: dict) -> str:
     return uuid.uuid4().hex
 
 
+def _block_number_partition_key(item: dict) -> str:
+    """Keeps the records of a block on one shard, in order."""
+    block_number = item.get('block_number')
+    if block_number is None and item.get('type') == 'block':
+        block_number = item.get('number')
+    if block_number is None:
+        return _uuid_partition_key(item)
+    return str(block_number)
+
+
+_PARTITION_KEY_CALLABLES: dict[str, Callable[[dict], str]] = {
+    '': _uuid_partition_key,
+    'block_number': _block_number_partition_key,
+}
+
+
 class KinesisItemExporter(BaseItemExporter):
+    """
+    Puts items into a Kinesis stream, a JSON record per item or KPL aggregated records.
+
+    With `aggregate`, the items of a partition key are packed into aggregated records of up to
+    `aggregation_max_bytes`, which KCL consumers and the aws-kinesis-agg libraries de-aggregate.
+
+    Records are sent by `max_workers` lanes, a partition key always by the same one, and a lane
+    sends its requests one after another. When the stream fails a record, it and the later
+    records of its partition key in the request are resent before the lane moves on, so the
+    records of a key keep their order; the later ones may be delivered twice.
+    """
+
     def __init__(
         self,
         stream_name: str,
-        partition_key_callable: Callable[[dict], str] = _uuid_partition_key,
+        partition_key_callable: Callable[[dict], str] | None = None,
+        partition_key: str = envs.KINESIS_PARTITION_KEY,
+        aggregate: bool = envs.KINESIS_AGGREGATE,
+        aggregation_max_bytes: int = envs.KINESIS_AGGREGATION_MAX_BYTES,
+        max_workers: int = envs.KINESIS_MAX_WORKERS,
+        max_retries: int = envs.KINESIS_MAX_RETRIES,
     ):
         super().__init__()
+        if partition_key_callable is None:
+            if partition_key not in _PARTITION_KEY_CALLABLES:
+                raise ValueError(
+                    f'Unknown Kinesis partition key {partition_key!r}, '
+                    f'expected one of {list(_PARTITION_KEY_CALLABLES)}'
+                )
+            partition_key_callable = _PARTITION_KEY_CALLABLES[partition_key]
         self._stream_name = stream_name
         self._partition_key_callable = partition_key_callable
+        self._aggregate = aggregate
+        self._aggregation_max_bytes = min(aggregation_max_bytes, _KINESIS_RECORD_MAX_BYTES)
+        self._max_workers = max_workers
+        self._max_retries = max_retries
         self._kinesis_client: Any | None = None  # initialized in .open
+        self._executor: ThreadPoolExecutor | None = None
 
     def open(self) -> None:
         self._kinesis_client = boto3.client('kinesis')
+        self._executor = ThreadPoolExecutor(self._max_workers, thread_name_prefix='kinesis')
 
     def export_items(self, items: Iterable[dict]) -> None:
-        assert self._kinesis_client is not None
-        sentinel = object()
-        chunks = zip_longest(
-            *(iter(items),) * _KINESIS_BATCH_LIMIT,
-            fillvalue=sentinel,
+        assert self._kinesis_client is not None and self._executor is not None
+        keyed_data = (
+            (self._partition_key_callable(item), _serialize_item(item)) for item in items
         )
-        for chunk in chunks:
-            self._kinesis_client.put_records(
-                StreamName=self._stream_name,
-                Records=[
-                    {
-                        'Data': _serialize_item(item),
-                        'PartitionKey': self._partition_key_callable(item),
-                    }
-                    for item in chunk
-                    if item is not sentinel
-                ],
-            )
+        if self._aggregate:
+            records = aggregate_records(keyed_data, self._aggregation_max_bytes)
+        else:
+            records = [{'Data': data, 'PartitionKey': key} for key, data in keyed_data]
+
+        lanes: dict[int, list[dict]] = {}
+        for record in records:
+            lane = zlib.crc32(record['PartitionKey'].encode()) % self._max_workers
+            lanes.setdefault(lane, []).append(record)
+        # wait for every lane before raising, so no request outlives the batch
+        futures = [self._executor.submit(self._put_lane, lane) for lane in lanes.values()]
+        errors = [future.exception() for future in futures]
+        for error in errors:
+            if error is not None:
+                raise error
 
     def export_item(self, item: dict) -> None:
+        self.export_items([item])
+
+    def _put_lane(self, records: list[dict]) -> None:
+        """Puts the records in order, a request at a time, retrying failed ones with backoff."""
         assert self._kinesis_client is not None
-        self._kinesis_client.put_record(
-            StreamName=self._stream_name,
-            Data=_serialize_item(item),
-            PartitionKey=self._partition_key_callable(item),
-        )
+        attempt = 0
+        while records:
+            chunk = records[: _chunk_length(records)]
+            response = self._kinesis_client.put_records(
+                StreamName=self._stream_name, Records=chunk
+            )
+            retry_records = (
+                _records_to_retry(chunk, response['Records'])
+                if response.get('FailedRecordCount')
+                else []
+            )
+            records = retry_records + records[len(chunk) :]
+            if not retry_records:
+                attempt = 0
+                continue
+
+            attempt += 1
+            logging.warning(
+                'Kinesis failed %s of %s records: %s',
+                response['FailedRecordCount'],
+                len(chunk),
+                next(r['ErrorMessage'] for r in response['Records'] if r.get('ErrorCode')),
+            )
+            if attempt > self._max_retries:
+                raise RuntimeError(
+                    f'Kinesis failed {response["FailedRecordCount"]} records after retries'
+                )
+            time.sleep(min(0.1 * 2**attempt, 5.0))
 
     def close(self):
-        pass
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def _records_to_retry(records: list[dict], results: list[dict]) -> list[dict]:
+    """The failed records and the records after them with the same partition key."""
+    failed_keys = set()
+    retry_records = []
+    for record, result in zip(records, results):
+        if result.get('ErrorCode') or record['PartitionKey'] in failed_keys:
+            failed_keys.add(record['PartitionKey'])
+            retry_records.append(record)
+    return retry_records
 
 
 def _serialize_item(item: dict) -> bytes:
     return json.dumps(item).encode()
+
+
+def aggregate_records(
+    records: Iterable[tuple[str, bytes]], max_bytes: int = _KINESIS_RECORD_MAX_BYTES
+) -> list[dict]:
+    """
+    Packs (partition key, data) pairs sharing a partition key into KPL aggregated records.
+
+    A pair larger than an aggregated record is put as a plain record.
+    """
+    data_by_key: dict[str, list[bytes]] = {}
+    for partition_key, data in records:
+        data_by_key.setdefault(partition_key, []).append(data)
+
+    aggregated_records = []
+    for partition_key, data_list in data_by_key.items():
+        encoded_key = _encode_bytes_field(1, partition_key.encode())
+        max_records_size = (
+            max_bytes - len(partition_key.encode()) - _KPL_AGGREGATION_OVERHEAD - len(encoded_key)
+        )
+        encoded_records: list[bytes] = []
+        size = 0
+        for data in data_list:
+            encoded_record = _encode_bytes_field(
+                3, _encode_varint_field(1, 0) + _encode_bytes_field(3, data)
+            )
+            if len(encoded_record) > max_records_size:
+                aggregated_records.append({'Data': data, 'PartitionKey': partition_key})
+                continue
+            if encoded_records and size + len(encoded_record) > max_records_size:
+                aggregated_records.append(
+                    _aggregated_record(partition_key, encoded_key, encoded_records)
+                )
+                encoded_records, size = [], 0
+            encoded_records.append(encoded_record)
+            size += len(encoded_record)
+        if encoded_records:
+            aggregated_records.append(
+                _aggregated_record(partition_key, encoded_key, encoded_records)
+            )
+    return aggregated_records
+
+
+def _aggregated_record(partition_key: str, encoded_key: bytes, encoded_records: list[bytes]):
+    message = encoded_key + b''.join(encoded_records)
+    data = _KPL_AGGREGATION_MAGIC + message + hashlib.md5(message).digest()
+    return {'Data': data, 'PartitionKey': partition_key}
+
+
+def _chunk_length(records: list[dict]) -> int:
+    """The number of leading records in a put_records request of up to 500 records and 5 MiB."""
+    size = 0
+    for length, record in enumerate(records[:_KINESIS_BATCH_LIMIT]):
+        size += len(record['Data']) + len(record['PartitionKey'].encode())
+        if length and size > _KINESIS_BATCH_MAX_BYTES:
+            return length
+    return min(len(records), _KINESIS_BATCH_LIMIT)
+
+
+def _encode_varint(value: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def _encode_varint_field(field_number: int, value: int) -> bytes:
+    return _encode_varint(field_number << 3) + _encode_varint(value)
+
+
+def _encode_bytes_field(field_number: int, value: bytes) -> bytes:
+    return _encode_varint(field_number << 3 | 2) + _encode_varint(len(value)) + value
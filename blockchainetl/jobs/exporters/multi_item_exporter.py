@@ -19,26 +19,150 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import queue
+import threading
+from concurrent.futures import Future
+
 from blockchainetl.exporters import BaseItemExporter
+from ethereumetl.config.envs import envs
+
+# tells a sink worker to stop after the items queued before it
+_STOP = object()
+# tells a sink worker to flush its exporter after the items queued before it
+_FLUSH = object()
+
+
+class SinkWorker:
+    """Exports the batches queued for one exporter, in order, from its own thread."""
+
+    def __init__(self, exporter: BaseItemExporter, queue_size: int):
+        self.exporter = exporter
+        # a full queue blocks the exporting thread until the sink catches up
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.thread: threading.Thread | None = None
+        # first error of the batches exported without waiting, raised by the next call or flush
+        self.error: BaseException | None = None
+        self.error_lock = threading.Lock()
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self._run, name=f'export-{type(self.exporter).__name__}', daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, items: list[dict]):
+        """Queues the items, an error exporting them is raised by the next call or flush."""
+        self.raise_error()
+        self.queue.put((items, None))
+
+    def submit_flush(self) -> Future:
+        """
+        The future is done when the items queued so far are written by the exporter.
+
+        It fails with the first error exporting them, if any.
+        """
+        done: Future = Future()
+        self.queue.put((_FLUSH, done))
+        return done
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put((_STOP, None))
+            self.thread.join()
+            self.thread = None
+
+    def pop_error(self) -> BaseException | None:
+        with self.error_lock:
+            error, self.error = self.error, None
+        return error
+
+    def raise_error(self):
+        error = self.pop_error()
+        if error is not None:
+            raise error
+
+    def _run(self):
+        while True:
+            items, done = self.queue.get()
+            if items is _STOP:
+                return
+            try:
+                if items is _FLUSH:
+                    self.raise_error()
+                    self.exporter.flush()
+                else:
+                    self.exporter.export_items(items)
+            except BaseException as e:
+                if done is None:
+                    with self.error_lock:
+                        if self.error is None:
+                            self.error = e
+                else:
+                    done.set_exception(e)
+            else:
+                if done is not None:
+                    done.set_result(None)
 
 
 class MultiItemExporter(BaseItemExporter):
-    def __init__(self, item_exporters):
+    """
+    Exports the items to every exporter, each from its own thread and queue.
+
+    export_items and export_item return once the items are queued for every exporter, up to
+    `queue_size` batches ahead of the slowest one. flush returns once every exporter exported and
+    wrote everything queued, and raises the first error of any of them, so whatever is done after
+    flush, like saving the last synced block, happens after all of them.
+    """
+
+    def __init__(self, item_exporters, queue_size: int = envs.MULTI_EXPORTER_QUEUE_SIZE):
         super().__init__()
         self.item_exporters = item_exporters
+        self.queue_size = queue_size
+        self.sink_workers: list[SinkWorker] = []
 
     def open(self):
         for exporter in self.item_exporters:
             exporter.open()
+        # a single exporter is called directly, there is nothing to export concurrently with
+        if len(self.item_exporters) > 1:
+            self.sink_workers = [
+                SinkWorker(exporter, self.queue_size) for exporter in self.item_exporters
+            ]
+            for worker in self.sink_workers:
+                worker.start()
 
     def export_items(self, items):
-        for exporter in self.item_exporters:
-            exporter.export_items(items)
+        if not self.sink_workers:
+            for exporter in self.item_exporters:
+                exporter.export_items(items)
+            return
+        items = list(items)
+        # exporters run at the same time and some of them change the items they export
+        for i, worker in enumerate(self.sink_workers):
+            worker.submit(items if i == 0 else [dict(item) for item in items])
 
     def export_item(self, item):
-        for exporter in self.item_exporters:
-            exporter.export_item(item)
+        self.export_items([item])
+
+    def flush(self):
+        if not self.sink_workers:
+            for exporter in self.item_exporters:
+                exporter.flush()
+            return
+        futures = [worker.submit_flush() for worker in self.sink_workers]
+        # wait for every exporter before raising, so no export outlives the flush
+        errors = [future.exception() for future in futures]
+        for error in errors:
+            if error is not None:
+                raise error
 
     def close(self):
-        for exporter in self.item_exporters:
-            exporter.close()
+        try:
+            for worker in self.sink_workers:
+                worker.stop()
+            for worker in self.sink_workers:
+                worker.raise_error()
+        finally:
+            self.sink_workers = []
+            for exporter in self.item_exporters:
+                exporter.close()
@@ -0,0 +1,129 @@
+import json
+import threading
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from blockchainetl.exporters import BaseItemExporter
+from ethereumetl.config.envs import envs
+
+# Columns of the exported entities that are not strings. Amounts in wei, difficulties and token
+# ids may not fit 64 bits and are written as decimal strings, like in CSV output.
+PARQUET_FIELD_TYPES: dict[str, pa.DataType] = {
+    **dict.fromkeys(
+        [
+            'number',
+            'block_number',
+            'timestamp',
+            'block_timestamp',
+            'transaction_index',
+            'log_index',
+            'transaction_count',
+            'size',
+            'gas',
+            'gas_limit',
+            'gas_used',
+            'cumulative_gas_used',
+            'transaction_type',
+            'status',
+            'subtraces',
+            'decimals',
+            'fee_tier',
+            'creation_block_number',
+            'creation_timestamp',
+        ],
+        pa.int64(),
+    ),
+    'is_erc20': pa.bool_(),
+    'is_erc721': pa.bool_(),
+    'topics': pa.list_(pa.string()),
+    'function_sighashes': pa.list_(pa.string()),
+    'token_addresses': pa.list_(pa.string()),
+    'lp_token_addresses': pa.list_(pa.string()),
+    'trace_address': pa.list_(pa.int64()),
+}
+
+
+def parquet_schema(fields_to_export, field_types=None) -> pa.Schema:
+    field_types = PARQUET_FIELD_TYPES if field_types is None else field_types
+    return pa.schema([(name, field_types.get(name, pa.string())) for name in fields_to_export])
+
+
+def to_parquet_value(value, data_type: pa.DataType):
+    if value is None or value == '':
+        return None
+    if pa.types.is_list(data_type):
+        return [to_parquet_value(x, data_type.value_type) for x in value]
+    if pa.types.is_integer(data_type):
+        return int(value)
+    if pa.types.is_boolean(data_type):
+        return bool(value)
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, separators=(',', ':'), default=str)
+    return str(value)
+
+
+class ParquetItemExporter(BaseItemExporter):
+    """
+    Writes items to a Parquet file, a row group per `row_group_size` items.
+
+    The schema follows `fields_to_export` or the keys of the first item. The file footer is
+    written on close, the file itself is left open for the caller.
+    """
+
+    def __init__(
+        self,
+        file,
+        compression=envs.PARQUET_COMPRESSION,
+        row_group_size=envs.PARQUET_ROW_GROUP_SIZE,
+        field_types=None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self._configure(kwargs, dont_fail=True)
+        self.file = file
+        self.compression = compression or 'none'
+        self.row_group_size = row_group_size
+        self.field_types = field_types
+        self.schema: pa.Schema | None = None
+        self.writer: pq.ParquetWriter | None = None
+        self.rows: list[dict] = []
+        self._lock = threading.Lock()
+
+    def export_item(self, item):
+        with self._lock:
+            if self.schema is None:
+                if not self.fields_to_export:
+                    self.fields_to_export = list(item.keys())
+                self.schema = parquet_schema(self.fields_to_export, self.field_types)
+            self.rows.append(item)
+            if len(self.rows) >= self.row_group_size:
+                self._write_row_group()
+
+    def close(self):
+        with self._lock:
+            if self.schema is None:
+                # no items, the file still gets a valid footer when the fields are known
+                if not self.fields_to_export:
+                    return
+                self.schema = parquet_schema(self.fields_to_export, self.field_types)
+            self._write_row_group()
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+
+    def _write_row_group(self):
+        assert self.schema is not None
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.file, self.schema, compression=self.compression)
+        rows, self.rows = self.rows, []
+        if not rows:
+            return
+        columns = [
+            pa.array(
+                [to_parquet_value(row.get(field.name), field.type) for row in rows],
+                type=field.type,
+            )
+            for field in self.schema
+        ]
+        self.writer.write_table(pa.Table.from_arrays(columns, schema=self.schema))
@@ -21,20 +21,36 @@
 # SOFTWARE.
 
 import collections
+import io
+import json
+from collections.abc import Iterable
 
 from sqlalchemy import create_engine
+from sqlalchemy.schema import CreateTable
 
 from blockchainetl.exporters import BaseItemExporter
 from blockchainetl.jobs.exporters.converters.composite_item_converter import CompositeItemConverter
+from blockchainetl.streaming.postgres_utils import (
+    create_merge_statement_for_table,
+    create_staging_table,
+)
+from ethereumetl.config.envs import envs
 
 
 class PostgresItemExporter(BaseItemExporter):
-    def __init__(
-        self, connection_url, item_type_to_insert_stmt_mapping, converters=(), print_sql=True
-    ):
+    """
+    Loads every item type with COPY into a temporary staging table, then merges the staging
+    table into the target table with INSERT ... ON CONFLICT DO UPDATE of the non primary key
+    columns, both in one transaction.
+
+    The exporter builds its statements from `item_type_to_table_mapping`, tables instead of
+    insert statements, so a custom ON CONFLICT clause is not supported.
+    """
+
+    def __init__(self, connection_url, item_type_to_table_mapping, converters=(), print_sql=True):
         super().__init__()
         self.connection_url = connection_url
-        self.item_type_to_insert_stmt_mapping = item_type_to_insert_stmt_mapping
+        self.item_type_to_table_mapping = item_type_to_table_mapping
         self.converter = CompositeItemConverter(converters)
         self.print_sql = print_sql
 
@@ -46,21 +62,83 @@ class PostgresItemExporter(BaseItemExporter):
     def export_items(self, items):
         items_grouped_by_type = group_by_item_type(items)
 
-        for item_type, insert_stmt in self.item_type_to_insert_stmt_mapping.items():
+        for item_type, table in self.item_type_to_table_mapping.items():
             item_group = items_grouped_by_type.get(item_type)
             if item_group:
-                connection = self.engine.connect()
-                converted_items = list(self.convert_items(item_group))
-                connection.execute(insert_stmt, converted_items)
+                self.copy_items(table, self.convert_items(item_group))
+
+    def copy_items(self, table, items: Iterable[dict]):
+        staging_table_name = f'staging_{table.name}'
+        columns = [column.name for column in table.columns]
+        with self.engine.begin() as connection:
+            connection.execute(CreateTable(create_staging_table(table, staging_table_name)))
+            cursor = connection.connection.cursor()
+            try:
+                copy_from_stdin(
+                    cursor,
+                    f'COPY {staging_table_name} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)',
+                    io.BytesIO(items_to_csv(items, columns).encode('utf-8')),
+                )
+            finally:
+                cursor.close()
+            connection.execute(create_merge_statement_for_table(table, staging_table_name))
 
     def convert_items(self, items):
         for item in items:
             yield self.converter.convert_item(item)
 
     def create_engine(self):
-        engine = create_engine(self.connection_url, echo=self.print_sql, pool_recycle=3600)
+        engine = create_engine(
+            self.connection_url,
+            echo=self.print_sql,
+            pool_recycle=3600,
+            pool_size=envs.POSTGRES_POOL_SIZE,
+            max_overflow=0,
+            pool_pre_ping=True,
+        )
         return engine
 
+    def close(self):
+        self.engine.dispose()
+
+
+def copy_from_stdin(cursor, statement: str, stream: io.BytesIO):
+    if hasattr(cursor, 'copy_expert'):
+        # psycopg2
+        cursor.copy_expert(statement, stream)
+    else:
+        # pg8000
+        cursor.execute(statement, stream=stream)
+
+
+def items_to_csv(items: Iterable[dict], columns: list[str]) -> str:
+    """CSV rows for COPY, where an unquoted empty value is NULL and a quoted one is ''."""
+    return ''.join(
+        ','.join(csv_value(item.get(column)) for column in columns) + '\n' for item in items
+    )
+
+
+def csv_value(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, list | tuple):
+        value = array_literal(value)
+    elif isinstance(value, dict):
+        value = json.dumps(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def array_literal(values: Iterable) -> str:
+    elements = []
+    for value in values:
+        if value is None:
+            elements.append('NULL')
+        else:
+            elements.append('"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"')
+    return '{' + ','.join(elements) + '}'
+
 
 def group_by_item_type(items):
     result = collections.defaultdict(list)
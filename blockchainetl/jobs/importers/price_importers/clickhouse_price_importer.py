@@ -5,11 +5,10 @@ from clickhouse_connect.driver.client import Client
 from blockchainetl.jobs.importers.price_importers.base_price_importer import BasePriceImporter
 from ethereumetl.config.envs import envs
 from ethereumetl.domain.price import Price
-from ethereumetl.utils import clickhouse_client_from_url
+from ethereumetl.utils import clickhouse_client_from_url, clickhouse_query_with_keys
 
 
 class ClickhousePriceImporter(BasePriceImporter):
-
     def __init__(self, chain_id: int, clickhouse_url: str):
         super().__init__(chain_id)
         self.clickhouse_url = clickhouse_url
@@ -119,16 +118,19 @@ class ClickhousePriceImporter(BasePriceImporter):
                            max(c_n).2 AS latest_price_native,
                            token_address
                     FROM candles_5m
-                    WHERE {block_number_condition} token_address IN {tuple(base_tokens_addresses)}
+                    WHERE {block_number_condition} token_address IN {{tokens}}
                     GROUP BY token_address
                 """
+        results = clickhouse_query_with_keys(
+            self.clickhouse, query, {'tokens': base_tokens_addresses}
+        )
         return {
             d['token_address']: {
                 'token_address': d['token_address'],
                 'price_stable': d['latest_price_stable'],
                 'price_native': d['latest_price_native'],
             }
-            for d in self.clickhouse.query(query).named_results()
+            for d in results
         }
 
     def _calculate_pools_count_for_tokens(self, tokens) -> dict:
@@ -139,15 +141,15 @@ class ClickhousePriceImporter(BasePriceImporter):
         assert self.clickhouse, 'Clickhouse client is not initialized'
         if not tokens:
             return {}
-        query = f"""
-            SELECT 
-                token_address, 
+        query = """
+            SELECT
+                token_address,
                 uniqMerge(pools_count) as pool_count
             FROM pools_counts
-            WHERE token_address IN {tuple(tokens)}
+            WHERE token_address IN {tokens}
             GROUP BY token_address
         """
         return {
             d['token_address']: d['pool_count']
-            for d in self.clickhouse.query(query).named_results()
+            for d in clickhouse_query_with_keys(self.clickhouse, query, {'tokens': tokens})
         }
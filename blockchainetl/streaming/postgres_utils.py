@@ -1,9 +1,47 @@
+from sqlalchemy import BigInteger, Column, Identity, MetaData, Table, select
 from sqlalchemy.dialects.postgresql import insert
 
 
 def create_insert_statement_for_table(table):
     insert_stmt = insert(table)
+    return _on_conflict_do_update(insert_stmt, table)
 
+
+# numbers the staging rows in the order they were copied
+STAGING_ORDINAL_COLUMN = 'staging_ordinal'
+
+
+def create_merge_statement_for_table(table, staging_table_name):
+    """
+    Inserts the rows of the staging table, which has the columns of `table` and the ordinal.
+
+    Of the rows repeating a primary key within the staging table, the last copied one is merged.
+    """
+    staging_table = create_staging_table(table, staging_table_name)
+    primary_key_fields = [column.name for column in table.columns if column.primary_key]
+    select_stmt = select(*(staging_table.c[column.name] for column in table.columns))
+    if primary_key_fields:
+        primary_key_columns = [staging_table.c[name] for name in primary_key_fields]
+        select_stmt = select_stmt.distinct(*primary_key_columns).order_by(
+            *primary_key_columns, staging_table.c[STAGING_ORDINAL_COLUMN].desc()
+        )
+
+    insert_stmt = insert(table).from_select([column.name for column in table.columns], select_stmt)
+    return _on_conflict_do_update(insert_stmt, table)
+
+
+def create_staging_table(table, staging_table_name):
+    return Table(
+        staging_table_name,
+        MetaData(),
+        *(Column(column.name, column.type) for column in table.columns),
+        Column(STAGING_ORDINAL_COLUMN, BigInteger, Identity()),
+        prefixes=['TEMPORARY'],
+        postgresql_on_commit='DROP',
+    )
+
+
+def _on_conflict_do_update(insert_stmt, table):
     primary_key_fields = [column.name for column in table.columns if column.primary_key]
     if primary_key_fields:
         insert_stmt = insert_stmt.on_conflict_do_update(
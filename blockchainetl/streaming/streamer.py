@@ -24,6 +24,7 @@
 import contextlib
 import logging
 import os
+import threading
 import time
 from abc import ABC, abstractmethod
 from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
@@ -32,6 +33,7 @@ from clickhouse_sqlalchemy.types import UInt32
 
 from blockchainetl.file_utils import smart_open
 from blockchainetl.streaming.streamer_adapter_stub import StreamerAdapterStub
+from ethereumetl.config.envs import envs
 from ethereumetl.utils import timestamp_now
 
 
@@ -82,7 +84,11 @@ class Streamer:
             self.blockchain_streamer_adapter.open()
             self._do_stream()
         finally:
-            self.blockchain_streamer_adapter.close()
+            try:
+                self.blockchain_streamer_adapter.close()
+            finally:
+                # after the exporters are flushed, so only exported blocks are acknowledged
+                self.last_synced_block_provider.close()
             if self.pid_file is not None:
                 logging.info(f'Deleting pid file {self.pid_file}')
                 delete_file(self.pid_file)
@@ -127,6 +133,8 @@ class Streamer:
 
         if blocks_to_sync != 0:
             self.blockchain_streamer_adapter.export_all(self.last_synced_block + 1, target_block)
+            # waits for exporters writing in the background, so only written blocks are acknowledged
+            self.blockchain_streamer_adapter.flush()
             logging.info(f'Writing last synced block {target_block}')
             self.last_synced_block_provider.set_last_synced_block(target_block)
             self.last_synced_block = target_block
@@ -201,6 +209,8 @@ class LastSyncedBlockProvider(ABC):
     @abstractmethod
     def set_last_synced_block(self, last_synced_block): ...
 
+    def close(self): ...
+
     @classmethod
     def from_uri(cls, uri, chain_id):
         if uri.startswith('file://'):
@@ -218,7 +228,12 @@ class LastSyncedBlockProvider(ABC):
             # 'redis://localhost:6379/0?key=last_synced_block'
             return LastSyncedBlockProviderRedis(uri, f'{redis_key}:{chain_id}')
 
-        return LastSyncedBlockProviderSQL(uri, chain_id, table_name=table_name)
+        provider = LastSyncedBlockProviderSQL(uri, chain_id, table_name=table_name)
+        if envs.LAST_SYNCED_BLOCK_WRITE_INTERVAL_SECONDS > 0:
+            return WriteBehindLastSyncedBlockProvider(
+                provider, envs.LAST_SYNCED_BLOCK_WRITE_INTERVAL_SECONDS
+            )
+        return provider
 
 
 class LastSyncedBlockProviderSQL(LastSyncedBlockProvider):
@@ -231,6 +246,7 @@ class LastSyncedBlockProviderSQL(LastSyncedBlockProvider):
         self.session = sessionmaker(bind=self.engine)
         self.table_name = table_name
         self.chain_id = chain_id
+        self.is_clickhouse = 'clickhouse' in connection_string
 
         Base = declarative_base()
 
@@ -243,8 +259,9 @@ class LastSyncedBlockProviderSQL(LastSyncedBlockProvider):
             if 'clickhouse' in connection_string:
                 from clickhouse_sqlalchemy import engines
 
+                # a row per chain once merged, the one with the highest block
                 __table_args__ = (
-                    engines.ReplacingMergeTree(order_by=['chain_id', 'block_number']),
+                    engines.ReplacingMergeTree(version='block_number', order_by=['chain_id']),
                 )
 
         self.LastSyncedBlock = LastSyncedBlock
@@ -267,12 +284,72 @@ class LastSyncedBlockProviderSQL(LastSyncedBlockProvider):
         last_synced_block_record = self.LastSyncedBlock(
             chain_id=self.chain_id, block_number=last_synced_block, indexed_ts=timestamp_now()
         )
-        last_synced_block_record.block_number = last_synced_block
         with self.session() as session:
-            session.add(last_synced_block_record)
+            if self.is_clickhouse:
+                # ClickHouse can't update rows, ReplacingMergeTree replaces them instead
+                session.add(last_synced_block_record)
+            else:
+                session.merge(last_synced_block_record)
             session.commit()
 
 
+class WriteBehindLastSyncedBlockProvider(LastSyncedBlockProvider):
+    """
+    Keeps the last synced block in memory and writes it to `provider` from a background thread
+    every `write_interval` seconds and on close, skipping the blocks synced in between.
+    """
+
+    def __init__(self, provider: LastSyncedBlockProvider, write_interval: float):
+        self.provider = provider
+        self.write_interval = write_interval
+        self.last_synced_block = None
+        self.written_block = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._writer: threading.Thread | None = None
+
+    def get_last_synced_block(self):
+        with self._lock:
+            if self.last_synced_block is not None:
+                return self.last_synced_block
+        return self.provider.get_last_synced_block()
+
+    def set_last_synced_block(self, last_synced_block):
+        with self._lock:
+            self.last_synced_block = last_synced_block
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_loop, name='last-synced-block-writer', daemon=True
+                )
+                self._writer.start()
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                last_synced_block = self.last_synced_block
+            if last_synced_block is None or last_synced_block == self.written_block:
+                return
+            self.provider.set_last_synced_block(last_synced_block)
+            self.written_block = last_synced_block
+
+    def _write_loop(self):
+        while not self._closed.wait(self.write_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.warning('Failed to write last synced block, retrying later: %s', e)
+
+    def close(self):
+        self._closed.set()
+        if self._writer is not None:
+            self._writer.join()
+        try:
+            self.flush()
+        finally:
+            self.provider.close()
+
+
 class LastSyncedBlockProviderRedis(LastSyncedBlockProvider):
     def __init__(self, redis_url, key):
         import redis
@@ -11,5 +11,9 @@ class StreamerAdapterStub(Protocol):
     def export_all(self, start_block, end_block):
         pass
 
+    def flush(self):
+        """Waits until everything exported so far is written, before it is acknowledged."""
+        pass
+
     def close(self):
         pass
@@ -33,7 +33,7 @@ CREATE TABLE blocks
 )
 ENGINE = ReplacingMergeTree
 ORDER BY (number, hash)
-SETTINGS index_granularity = 8192;
+SETTINGS index_granularity = 8192, non_replicated_deduplication_window = 1000;
 
 CREATE TABLE candles_1d
 (
@@ -86,7 +86,7 @@ CREATE TABLE dex_trades
 )
 ENGINE = ReplacingMergeTree
 ORDER BY (block_number, transaction_hash, log_index)
-SETTINGS index_granularity = 8192;
+SETTINGS index_granularity = 8192, non_replicated_deduplication_window = 1000;
 
 CREATE MATERIALIZED VIEW candles_1d_mv TO candles_1d
 (
@@ -437,7 +437,7 @@ CREATE TABLE transactions
 )
 ENGINE = ReplacingMergeTree
 ORDER BY (block_number, hash, block_hash)
-SETTINGS index_granularity = 8192;
+SETTINGS index_granularity = 8192, non_replicated_deduplication_window = 1000;
 
 CREATE MATERIALIZED VIEW count_active_addresses_mv TO chain_counts
 (
@@ -461,7 +461,7 @@ CREATE TABLE logs
 )
 ENGINE = ReplacingMergeTree
 ORDER BY (block_number, transaction_hash, log_index, block_hash)
-SETTINGS index_granularity = 8192;
+SETTINGS index_granularity = 8192, non_replicated_deduplication_window = 1000;
 
 CREATE MATERIALIZED VIEW count_uniq_contracts_mv TO chain_counts
 (
@@ -653,7 +653,7 @@ CREATE TABLE dex_trades_token_wallet_pool_factory_hash
 )
 ENGINE = ReplacingMergeTree
 ORDER BY (filter_column, block_timestamp, transaction_hash, log_index, block_hash)
-SETTINGS index_granularity = 8192;
+SETTINGS index_granularity = 8192, non_replicated_deduplication_window = 1000;
 
 CREATE MATERIALIZED VIEW dex_trades_transaction_hash_mv TO dex_trades_token_wallet_pool_factory_hash
 (
@@ -764,7 +764,7 @@ CREATE TABLE errors
 ENGINE = MergeTree
 PARTITION BY toYYYYMM(fromUnixTimestamp(timestamp))
 ORDER BY timestamp
-SETTINGS index_granularity = 8192;
+SETTINGS index_granularity = 8192, non_replicated_deduplication_window = 1000;
 
 CREATE TABLE etl_delay
 (
@@ -810,7 +810,7 @@ CREATE TABLE geth_traces
 )
 ENGINE = ReplacingMergeTree
 ORDER BY (block_number, transaction_hash, block_hash)
-SETTINGS index_granularity = 8192;
+SETTINGS index_granularity = 8192, non_replicated_deduplication_window = 1000;
 
 CREATE MATERIALIZED VIEW etl_delay_geth_traces_mv TO etl_delay
 (
@@ -846,7 +846,7 @@ CREATE TABLE internal_transfers
 )
 ENGINE = ReplacingMergeTree
 ORDER BY (block_number, transaction_hash, id, block_hash)
-SETTINGS index_granularity = 8192;
+SETTINGS index_granularity = 8192, non_replicated_deduplication_window = 1000;
 
 CREATE MATERIALIZED VIEW etl_delay_internal_transfers_mv TO etl_delay
 (
@@ -1188,7 +1188,7 @@ CREATE TABLE native_balances
 )
 ENGINE = ReplacingMergeTree
 ORDER BY (block_number, address, block_hash)
-SETTINGS allow_nullable_key = 1, index_granularity = 8192;
+SETTINGS allow_nullable_key = 1, index_granularity = 8192, non_replicated_deduplication_window = 1000;
 
 CREATE TABLE pools_counts
 (
@@ -1245,7 +1245,7 @@ CREATE TABLE token_balances
 )
 ENGINE = ReplacingMergeTree
 ORDER BY (block_number, token_address, holder_address, token_id, block_hash)
-SETTINGS allow_nullable_key = 1, index_granularity = 8192;
+SETTINGS allow_nullable_key = 1, index_granularity = 8192, non_replicated_deduplication_window = 1000;
 
 CREATE TABLE token_transfers
 (
@@ -1267,7 +1267,7 @@ CREATE TABLE token_transfers
 )
 ENGINE = ReplacingMergeTree
 ORDER BY (block_number, transaction_hash, log_index, token_id, block_hash)
-SETTINGS allow_nullable_key = 1, index_granularity = 8192;
+SETTINGS allow_nullable_key = 1, index_granularity = 8192, non_replicated_deduplication_window = 1000;
 
 CREATE TABLE token_transfers_address
 (
@@ -1484,7 +1484,7 @@ CREATE TABLE traces
 ENGINE = ReplacingMergeTree
 PARTITION BY toYYYYMMDD(FROM_UNIXTIME(block_timestamp))
 ORDER BY trace_id
-SETTINGS index_granularity = 8192;
+SETTINGS index_granularity = 8192, non_replicated_deduplication_window = 1000;
 
 CREATE TABLE traders_categories
 (
@@ -0,0 +1,62 @@
+"""
+deduplicate non replicated inserts.
+
+Revision ID: 5bde8b9c8e4b
+Revises: e4c59630a7af
+Create Date: 2026-10-19 12:15:14.374151
+"""
+import os
+from functools import cache
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '5bde8b9c8e4b'
+down_revision = 'e4c59630a7af'
+branch_labels = None
+depends_on = None
+
+# tables ClickHouseItemExporter inserts into with insert_deduplication_token
+DEDUPLICATED_TABLES = (
+    'blocks',
+    'transactions',
+    'logs',
+    'token_transfers',
+    'traces',
+    'geth_traces',
+    'internal_transfers',
+    'token_balances',
+    'errors',
+    'native_balances',
+    'dex_trades',
+    'dex_trades_token_wallet_pool_factory_hash',
+)
+
+
+@cache
+def is_clickhouse_replicated():
+    if os.getenv('CLICKHOUSE_REPLICATED', '').lower() in ('true', '1'):
+        return True
+
+    result = op.get_bind().execute("SELECT count() FROM system.replicas")
+    if result:
+        return result.one()[0] > 0
+
+    return False
+
+
+def upgrade() -> None:
+    # replicated tables deduplicate inserts by replicated_deduplication_window already
+    if is_clickhouse_replicated():
+        return
+
+    for table in DEDUPLICATED_TABLES:
+        op.execute(f"ALTER TABLE {table} MODIFY SETTING non_replicated_deduplication_window = 1000")
+
+
+def downgrade() -> None:
+    if is_clickhouse_replicated():
+        return
+
+    for table in DEDUPLICATED_TABLES:
+        op.execute(f"ALTER TABLE {table} RESET SETTING non_replicated_deduplication_window")
@@ -165,6 +165,21 @@ def get_partitions(start, end, partition_batch_size, provider_uri):
     type=str,
     help='The chain network to connect to.',
 )
+@click.option(
+    '-f',
+    '--file-format',
+    default='csv',
+    show_default=True,
+    type=click.Choice(['csv', 'parquet']),
+    help='The format of the exported files, parquet requires pyarrow.',
+)
+@click.option(
+    '-z',
+    '--compression',
+    default=None,
+    type=click.Choice(['gzip', 'zstd', 'lz4']),
+    help='Compress the exported csv files, zstd requires zstandard.',
+)
 def export_all(
     start,
     end,
@@ -174,8 +189,14 @@ def export_all(
     max_workers,
     export_batch_size,
     chain='ethereum',
+    file_format='csv',
+    compression=None,
 ):
     """Exports all data for a range of blocks."""
+    if compression and file_format == 'parquet':
+        raise click.BadParameter(
+            'Parquet files are compressed with PARQUET_COMPRESSION', param_hint='--compression'
+        )
     provider_uri = check_classic_provider_uri(chain, provider_uri)
     export_all_common(
         get_partitions(start, end, partition_batch_size, provider_uri),
@@ -183,4 +204,6 @@ def export_all(
         provider_uri,
         max_workers,
         export_batch_size,
+        file_format,
+        compression,
     )
@@ -196,6 +196,22 @@ def validate_start_block(_ctx, _param, value):
     type=str,
     help='URL to get prices from',
 )
+@click.option(
+    '--selective-receipts',
+    default=envs.SELECTIVE_RECEIPTS,
+    show_default=True,
+    type=bool,
+    help='Fetch receipts only for blocks whose logs bloom may contain the needed events. '
+    'Ignored when transactions, receipts or logs are exported.',
+)
+@click.option(
+    '--logs-by-range',
+    default=envs.LOGS_BY_RANGE,
+    show_default=True,
+    type=bool,
+    help='Fetch the needed logs with ranged eth_getLogs instead of receipts. '
+    'Ignored when transactions, receipts or logs are exported.',
+)
 def stream(
     chain_id,
     last_synced_block_provider_uri,
@@ -216,6 +232,8 @@ def stream(
     is_skip_cycle=False,
     elastic_url=None,
     price_importer_url='',
+    selective_receipts=False,
+    logs_by_range=False,
 ):
     """Streams all data types to console or Google Pub/Sub."""
     # we need to increase recursion limit for traces
@@ -247,6 +265,8 @@ def stream(
         chain_id=chain_id,
         elastic_client=Elasticsearch(elastic_url) if elastic_url else None,
         price_importer=create_price_importers(sources=price_importer_url, chain_id=chain_id),
+        selective_receipts=selective_receipts,
+        logs_by_range=logs_by_range,
     )
     if export_from_clickhouse:
         rewrite_entity_types = [EntityType(x) for x in envs.REWRITE_CLICKHOUSE.split(',') if x]
@@ -0,0 +1,49 @@
+import logging
+import re
+from collections.abc import Callable
+from typing import TypeVar
+
+from requests.exceptions import Timeout as RequestsTimeout
+from web3._utils.threads import Timeout as Web3Timeout
+
+T = TypeVar('T')
+
+# Messages nodes and providers return when an eth_getLogs range is too expensive to serve:
+# geth/infura "query returned more than 10000 results", alchemy "Log response size exceeded",
+# erigon/nethermind "block range too large", "query timeout exceeded", etc.
+RANGE_TOO_LARGE_ERROR_PATTERN = re.compile(
+    r'more than \d+ results|too many|too large|size exceeded|limit exceeded|'
+    r'exceeds? (?:the )?(?:max|limit)|timeout|timed out',
+    re.IGNORECASE,
+)
+
+GET_LOGS_TIMEOUT_EXCEPTIONS = (RequestsTimeout, Web3Timeout)
+
+
+def is_range_too_large_error(error: Exception) -> bool:
+    if isinstance(error, GET_LOGS_TIMEOUT_EXCEPTIONS):
+        return True
+    return isinstance(error, ValueError) and bool(RANGE_TOO_LARGE_ERROR_PATTERN.search(str(error)))
+
+
+def get_logs_in_range(
+    get_logs: Callable[[int, int], list[T]], from_block: int, to_block: int
+) -> list[T]:
+    """
+    Calls `get_logs(from_block, to_block)`, both inclusive, for the whole range.
+
+    When the node refuses the range as too large or times out, the range is split in halves
+    which are fetched the same way, so dense ranges cost a few extra requests
+    while sparse ranges stay at one.
+    """
+    try:
+        return get_logs(from_block, to_block)
+    except (ValueError, *GET_LOGS_TIMEOUT_EXCEPTIONS) as e:
+        if from_block >= to_block or not is_range_too_large_error(e):
+            raise
+        logging.debug('Splitting eth_getLogs range %i-%i: %s', from_block, to_block, e)
+
+    middle_block = (from_block + to_block) // 2
+    return get_logs_in_range(get_logs, from_block, middle_block) + get_logs_in_range(
+        get_logs, middle_block + 1, to_block
+    )
@@ -21,13 +21,15 @@
 # SOFTWARE.
 
 
+import contextlib
 import csv
 import logging
 import os
 import shutil
+from collections.abc import Iterator
 from time import time
 
-from blockchainetl.file_utils import smart_open
+from blockchainetl.file_utils import COMPRESSION_EXTENSIONS, smart_open
 from blockchainetl.jobs.base_job import BaseJob
 from ethereumetl.csv_utils import set_max_field_size_limit
 from ethereumetl.jobs.export_blocks_job import ExportBlocksJob
@@ -55,20 +57,48 @@ def is_log_filter_supported(provider_uri):
     return 'infura' not in provider_uri
 
 
-def extract_csv_column_unique(input, output, column):
-    set_max_field_size_limit()
+@contextlib.contextmanager
+def read_rows(filename) -> Iterator[Iterator[dict]]:
+    """Rows of a CSV or Parquet file as dicts, Parquet is read a row group at a time."""
+    if str(filename).endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(filename)
+        try:
+            yield (row for batch in parquet_file.iter_batches() for row in batch.to_pylist())
+        finally:
+            parquet_file.close()
+    else:
+        set_max_field_size_limit()
+        with smart_open(filename, 'r') as input_file:
+            yield csv.DictReader(input_file)
+
 
-    with smart_open(input, 'r') as input_file, smart_open(output, 'w') as output_file:
-        reader = csv.DictReader(input_file)
+def extract_csv_column_unique(input, output, column):
+    with read_rows(input) as reader, smart_open(output, 'w') as output_file:
         seen = set()  # set for fast O(1) amortized lookup
         for row in reader:
-            if row[column] in seen:
+            value = row[column] or ''
+            if value in seen:
                 continue
-            seen.add(row[column])
-            output_file.write(row[column] + '\n')
-
+            seen.add(value)
+            output_file.write(value + '\n')
+
+
+def export_all_common(
+    partitions,
+    output_dir,
+    provider_uri,
+    max_workers,
+    batch_size,
+    file_format='csv',
+    compression=None,
+):
+    # compressed files are written and read back by their extension e.g. blocks_0_99.csv.gz
+    file_extension = file_format
+    if compression:
+        file_extension += {name: ext for ext, name in COMPRESSION_EXTENSIONS.items()}[compression]
 
-def export_all_common(partitions, output_dir, provider_uri, max_workers, batch_size):
     for batch_start_block, batch_end_block, partition_dir in partitions:
         # # # start # # #
 
@@ -87,8 +117,10 @@ def export_all_common(partitions, output_dir, provider_uri, max_workers, batch_s
         transactions_output_dir = f'{output_dir}/transactions{partition_dir}'
         os.makedirs(os.path.dirname(transactions_output_dir), exist_ok=True)
 
-        blocks_file = f'{blocks_output_dir}/blocks_{file_name_suffix}.csv'
-        transactions_file = f'{transactions_output_dir}/transactions_{file_name_suffix}.csv'
+        blocks_file = f'{blocks_output_dir}/blocks_{file_name_suffix}.{file_extension}'
+        transactions_file = (
+            f'{transactions_output_dir}/transactions_{file_name_suffix}.{file_extension}'
+        )
         logger.info(f'Exporting blocks {block_range} to {blocks_file}')
         logger.info(f'Exporting transactions from blocks {block_range} to {transactions_file}')
 
@@ -114,7 +146,7 @@ def export_all_common(partitions, output_dir, provider_uri, max_workers, batch_s
             os.makedirs(os.path.dirname(token_transfers_output_dir), exist_ok=True)
 
             token_transfers_file = (
-                f'{token_transfers_output_dir}/token_transfers_{file_name_suffix}.csv'
+                f'{token_transfers_output_dir}/token_transfers_{file_name_suffix}.{file_extension}'
             )
             logger.info(
                 f'Exporting ERC20 transfers from blocks {block_range} to {token_transfers_file}'
@@ -141,15 +173,15 @@ def export_all_common(partitions, output_dir, provider_uri, max_workers, batch_s
         logs_output_dir = f'{output_dir}/logs{partition_dir}'
         os.makedirs(os.path.dirname(logs_output_dir), exist_ok=True)
 
-        receipts_file = f'{receipts_output_dir}/receipts_{file_name_suffix}.csv'
-        logs_file = f'{logs_output_dir}/logs_{file_name_suffix}.csv'
+        receipts_file = f'{receipts_output_dir}/receipts_{file_name_suffix}.{file_extension}'
+        logs_file = f'{logs_output_dir}/logs_{file_name_suffix}.{file_extension}'
         logger.info(
             f'Exporting receipts and logs from blocks {block_range} to {receipts_file} and {logs_file}'
         )
 
-        with smart_open(transactions_file, 'r') as f:
+        with read_rows(transactions_file) as transactions:
             job = ExportReceiptsJob(
-                transactions=csv.DictReader(f),
+                transactions=transactions,
                 batch_size=batch_size,
                 batch_web3_provider=ThreadLocalProxy(
                     lambda: get_provider_from_uri(provider_uri, batch=True)
@@ -170,7 +202,7 @@ def export_all_common(partitions, output_dir, provider_uri, max_workers, batch_s
         contracts_output_dir = f'{output_dir}/contracts{partition_dir}'
         os.makedirs(os.path.dirname(contracts_output_dir), exist_ok=True)
 
-        contracts_file = f'{contracts_output_dir}/contracts_{file_name_suffix}.csv'
+        contracts_file = f'{contracts_output_dir}/contracts_{file_name_suffix}.{file_extension}'
         logger.info(f'Exporting contracts from blocks {block_range} to {contracts_file}')
 
         with smart_open(contract_addresses_file, 'r') as contract_addresses_file:
@@ -202,7 +234,7 @@ def export_all_common(partitions, output_dir, provider_uri, max_workers, batch_s
             tokens_output_dir = f'{output_dir}/tokens{partition_dir}'
             os.makedirs(os.path.dirname(tokens_output_dir), exist_ok=True)
 
-            tokens_file = f'{tokens_output_dir}/tokens_{file_name_suffix}.csv'
+            tokens_file = f'{tokens_output_dir}/tokens_{file_name_suffix}.{file_extension}'
             logger.info(f'Exporting tokens from blocks {block_range} to {tokens_file}')
 
             with smart_open(token_addresses_file, 'r') as token_addresses:
@@ -0,0 +1,74 @@
+import json
+from collections.abc import Collection
+
+from blockchainetl.jobs.base_job import BaseJob
+from ethereumetl.executors.batch_work_executor import BatchWorkExecutor
+from ethereumetl.get_logs import get_logs_in_range
+from ethereumetl.json_rpc_requests import generate_get_logs_json_rpc
+from ethereumetl.mappers.receipt_log_mapper import EthReceiptLogMapper
+from ethereumetl.utils import rpc_response_batch_to_results, validate_range
+
+
+# Exports logs with ranged eth_getLogs, without fetching transaction receipts
+class ExportLogsJob(BaseJob):
+    def __init__(
+        self,
+        start_block,
+        end_block,
+        batch_size,
+        batch_web3_provider,
+        max_workers,
+        item_exporter,
+        topics: Collection[str] | None = None,
+        addresses: Collection[str] | None = None,
+    ):
+        validate_range(start_block, end_block)
+        self.start_block = start_block
+        self.end_block = end_block
+
+        self.batch_web3_provider = batch_web3_provider
+        self.topics = topics
+        self.addresses = addresses
+        self.item_exporter = item_exporter
+
+        self.batch_work_executor = BatchWorkExecutor(
+            batch_size, max_workers, job_name='Export Logs Job'
+        )
+
+        self.receipt_log_mapper = EthReceiptLogMapper()
+
+    def _start(self):
+        self.item_exporter.open()
+
+    def _export(self):
+        if self.topics is not None and not self.topics:
+            return
+        if self.addresses is not None and not self.addresses:
+            return
+        self.batch_work_executor.execute(
+            range(self.start_block, self.end_block + 1),
+            self._export_batch,
+            total_items=self.end_block - self.start_block + 1,
+        )
+
+    def _export_batch(self, block_number_batch):
+        assert len(block_number_batch) > 0
+        logs = get_logs_in_range(self._get_logs, block_number_batch[0], block_number_batch[-1])
+        for log in logs:
+            # logs of blocks reorged while the request was served
+            if log.get('removed'):
+                continue
+            receipt_log = self.receipt_log_mapper.json_dict_to_receipt_log(log)
+            self.item_exporter.export_item(
+                self.receipt_log_mapper.receipt_log_to_dict(receipt_log)
+            )
+
+    def _get_logs(self, from_block: int, to_block: int) -> list[dict]:
+        logs_rpc = generate_get_logs_json_rpc(from_block, to_block, self.topics, self.addresses)
+        response = self.batch_web3_provider.make_batch_request(json.dumps([logs_rpc]))
+        (logs,) = rpc_response_batch_to_results(response)
+        return logs
+
+    def _end(self):
+        self.batch_work_executor.shutdown()
+        self.item_exporter.close()
@@ -22,6 +22,7 @@
 
 from blockchainetl.jobs.base_job import BaseJob
 from ethereumetl.executors.batch_work_executor import BatchWorkExecutor
+from ethereumetl.get_logs import get_logs_in_range
 from ethereumetl.mappers.receipt_log_mapper import EthReceiptLogMapper
 from ethereumetl.mappers.token_transfer_mapper import EthTokenTransferMapper
 from ethereumetl.service.token_transfer_extractor import (
@@ -50,7 +51,6 @@ class ExportTokenTransfersJob(BaseJob):
         self.receipt_log_mapper = EthReceiptLogMapper()
         self.token_transfer_mapper = EthTokenTransferMapper()
         self.token_transfer_extractor = EthTokenTransferExtractor()
-        self._supports_eth_newFilter = True
 
     def _start(self):
         self.item_exporter.open()
@@ -64,41 +64,25 @@ class ExportTokenTransfersJob(BaseJob):
 
     def _export_batch(self, block_number_batch):
         assert len(block_number_batch) > 0
-        # https://github.com/ethereum/wiki/wiki/JSON-RPC#eth_getfilterlogs
-        for topic in ALL_TRANSFER_EVENT_TOPICS:
-            filter_params = {
-                'fromBlock': block_number_batch[0],
-                'toBlock': block_number_batch[-1],
-                'topics': [topic],
-            }
+        # https://ethereum.org/en/developers/docs/apis/json-rpc/#eth_getlogs
+        events = get_logs_in_range(self._get_logs, block_number_batch[0], block_number_batch[-1])
+        for event in events:
+            log = self.receipt_log_mapper.web3_dict_to_receipt_log(event)
+            for token_transfer in self.token_transfer_extractor.extract_transfers_from_log(log):
+                self.item_exporter.export_item(
+                    self.token_transfer_mapper.token_transfer_to_dict(token_transfer)
+                )
 
-            if self.tokens is not None and len(self.tokens) > 0:
-                filter_params['address'] = self.tokens
-
-            event_filter = None
-            try:
-                event_filter = self.web3.eth.filter(filter_params)
-                events = event_filter.get_all_entries()
-            except ValueError as e:
-                if (
-                    str(e)
-                    == "{'code': -32000, 'message': 'the method is currently not implemented: eth_newFilter'}"
-                ):
-                    self._supports_eth_newFilter = False
-                    events = self.web3.eth.getLogs(filter_params)
-                else:
-                    raise e
-            for event in events:
-                log = self.receipt_log_mapper.web3_dict_to_receipt_log(event)
-                for token_transfer in self.token_transfer_extractor.extract_transfers_from_log(
-                    log
-                ):
-                    self.item_exporter.export_item(
-                        self.token_transfer_mapper.token_transfer_to_dict(token_transfer)
-                    )
-
-            if self._supports_eth_newFilter and event_filter is not None:
-                self.web3.eth.uninstallFilter(event_filter.filter_id)
+    def _get_logs(self, from_block: int, to_block: int) -> list:
+        filter_params: dict = {
+            'fromBlock': from_block,
+            'toBlock': to_block,
+            # a single topic0 OR-array matches every kind of transfer in one request
+            'topics': [sorted(ALL_TRANSFER_EVENT_TOPICS)],
+        }
+        if self.tokens is not None and len(self.tokens) > 0:
+            filter_params['address'] = self.tokens
+        return list(self.web3.eth.getLogs(filter_params))
 
     def _end(self):
         self.batch_work_executor.shutdown()
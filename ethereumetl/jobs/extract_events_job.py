@@ -1,3 +1,4 @@
+from collections import defaultdict
 from collections.abc import Iterable
 
 from blockchainetl.jobs.base_job import BaseJob
@@ -15,8 +16,8 @@ class PrepareForEventsJob(BaseJob):
         max_workers,
         item_exporter,
     ):
-        self.logs = logs
-        self.token_transfers = token_transfers
+        self.logs_by_block_number = group_by_block_number(logs)
+        self.token_transfers_by_block_number = group_by_block_number(token_transfers)
         self.transactions = sorted(transactions, key=lambda x: x['block_number'])
         self.item_exporter = item_exporter
 
@@ -58,16 +59,18 @@ class PrepareForEventsJob(BaseJob):
             self.item_exporter.export_item(item)
 
     def _make_item(self, transactions):
+        block_number = transactions[0]['block_number']
         return {
-            'logs': [
-                log for log in self.logs if log['block_number'] == transactions[0]['block_number']
-            ],
-            'transfers': [
-                transfer
-                for transfer in self.token_transfers
-                if transfer['block_number'] == transactions[0]['block_number']
-            ],
+            'logs': self.logs_by_block_number.get(block_number, []),
+            'transfers': self.token_transfers_by_block_number.get(block_number, []),
             'transactions': transactions,
             'type': 'pre_event',
-            'id': f'event_{transactions[0]["block_number"]}',
+            'id': f'event_{block_number}',
         }
+
+
+def group_by_block_number(items: Iterable[dict]) -> dict[int, list[dict]]:
+    items_by_block_number: dict[int, list[dict]] = defaultdict(list)
+    for item in items:
+        items_by_block_number[item['block_number']].append(item)
+    return items_by_block_number
@@ -21,6 +21,7 @@
 # SOFTWARE.
 
 from blockchainetl.jobs.base_job import BaseJob
+from ethereumetl.domain.receipt_log import EthReceiptLog
 from ethereumetl.executors.batch_work_executor import BatchWorkExecutor
 from ethereumetl.mappers.receipt_log_mapper import EthReceiptLogMapper
 from ethereumetl.mappers.token_transfer_mapper import EthTokenTransferMapper
@@ -51,7 +52,11 @@ class ExtractTokenTransfersJob(BaseJob):
             self._extract_transfer(log_dict)
 
     def _extract_transfer(self, log_dict):
-        log = self.receipt_log_mapper.dict_to_receipt_log(log_dict)
+        # logs routed by LogDemultiplexer are already mapped
+        if isinstance(log_dict, EthReceiptLog):
+            log = log_dict
+        else:
+            log = self.receipt_log_mapper.dict_to_receipt_log(log_dict)
         for token_transfer in self.token_transfer_extractor.extract_transfers_from_log(log):
             self.item_exporter.export_item(
                 self.token_transfer_mapper.token_transfer_to_dict(token_transfer)
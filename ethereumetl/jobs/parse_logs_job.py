@@ -1,4 +1,5 @@
 from blockchainetl.jobs.base_job import BaseJob
+from ethereumetl.domain.receipt_log import EthReceiptLog
 from ethereumetl.executors.batch_work_executor import BatchWorkExecutor
 from ethereumetl.mappers.parsed_log_mapper import EthParsedReceiptLogMapper
 from ethereumetl.mappers.receipt_log_mapper import EthReceiptLogMapper
@@ -38,7 +39,9 @@ class ParseLogsJob(BaseJob):
 
     def _parse_logs(self, logs):
         for log in logs:
-            log = self.receipt_log_mapper.dict_to_receipt_log(log)
+            # logs routed by LogDemultiplexer are already mapped
+            if not isinstance(log, EthReceiptLog):
+                log = self.receipt_log_mapper.dict_to_receipt_log(log)
             parsed_log = self.resolve_logs_service.parse_log(
                 log, filter_for_events=PARSABLE_TRADE_EVENTS
             )
@@ -19,6 +19,7 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+from collections.abc import Iterable
 from typing import Literal
 
 import eth_abi
@@ -60,6 +61,26 @@ def generate_get_receipt_json_rpc(transaction_hashes):
         )
 
 
+def generate_get_logs_json_rpc(
+    from_block: int,
+    to_block: int,
+    topics: Iterable[str] | None = None,
+    addresses: Iterable[str] | None = None,
+    request_id: int = 1,
+) -> dict:
+    """
+    Logs matching any of `topics` as topic0 and emitted by any of `addresses`.
+
+    None means no filter, both ends of the block range are inclusive.
+    """
+    filter_params: dict = {'fromBlock': hex(from_block), 'toBlock': hex(to_block)}
+    if addresses is not None:
+        filter_params['address'] = sorted(addresses)
+    if topics is not None:
+        filter_params['topics'] = [sorted(topics)]
+    return generate_json_rpc(method='eth_getLogs', params=[filter_params], request_id=request_id)
+
+
 def generate_get_code_json_rpc(contract_addresses, block='latest'):
     for idx, contract_address in enumerate(contract_addresses):
         yield generate_json_rpc(
@@ -0,0 +1,36 @@
+from collections.abc import Iterable
+
+from eth_utils import keccak, to_bytes
+
+LOGS_BLOOM_BITS = 2048
+
+
+def logs_bloom_mask(value: bytes) -> int:
+    """
+    Bits set in a logs bloom for a log address or topic.
+
+    The low 11 bits of the first three 16-bit words of keccak(value) select the bits.
+    """
+    value_hash = keccak(value)
+    mask = 0
+    for i in (0, 2, 4):
+        mask |= 1 << (int.from_bytes(value_hash[i : i + 2], 'big') % LOGS_BLOOM_BITS)
+    return mask
+
+
+class LogsBloomFilter:
+    """
+    Tests block logs blooms for any of the given topics.
+
+    Blooms have no false negatives, so `False` is a definite "no match",
+    while `True` means the block may contain a matching log.
+    """
+
+    def __init__(self, topics: Iterable[str]):
+        self._masks = frozenset(logs_bloom_mask(to_bytes(hexstr=topic)) for topic in topics)
+
+    def may_match(self, logs_bloom: str | None) -> bool:
+        if not logs_bloom:
+            return True
+        bloom = int(logs_bloom, 16)
+        return any(bloom & mask == mask for mask in self._masks)
@@ -27,7 +27,7 @@ from collections.abc import Iterable
 
 import six
 
-from blockchainetl.file_utils import get_file_handle, smart_open
+from blockchainetl.file_utils import get_file_handle, smart_open, strip_compression_extension
 from ethereumetl.csv_utils import set_max_field_size_limit
 
 
@@ -35,7 +35,7 @@ from ethereumetl.csv_utils import set_max_field_size_limit
 def get_item_iterable(input_file):
     fh = get_file_handle(input_file, 'r')
 
-    if input_file.endswith('.csv'):
+    if strip_compression_extension(input_file).endswith('.csv'):
         set_max_field_size_limit()
         reader: Iterable[dict] = csv.DictReader(fh)
     else:
@@ -51,7 +51,7 @@ def get_item_iterable(input_file):
 def get_item_sink(output_file):
     fh = get_file_handle(output_file, 'w')
 
-    if output_file.endswith('.csv'):
+    if strip_compression_extension(output_file).endswith('.csv'):
         set_max_field_size_limit()
 
         writer = None
@@ -1,4 +1,6 @@
-from collections import deque
+import threading
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import parse_qs, urlparse
 
 from clickhouse_driver import Client
@@ -6,9 +8,14 @@ from clickhouse_driver import Client
 from ethereumetl.config.envs import envs
 from ethereumetl.enumeration.entity_type import EntityType
 from ethereumetl.scripts.optimize_tables import optimize_tables_service
+from ethereumetl.utils import consecutive_ranges, split_to_batches
 
 SUPPORTED_CHAINS = [1, 250, 42161, 10, 100, 42170, 7700, 7701, 84531]
 
+# blocks checked by a single set of queries
+BLOCK_RANGE_CHUNK_SIZE = 1_000_000
+MAX_WORKERS = 8
+
 
 def clickhouse_client_from_url(url) -> tuple[Client, str]:
     parsed = urlparse(url)
@@ -29,81 +36,6 @@ def clickhouse_client_from_url(url) -> tuple[Client, str]:
     return Client(**connect_kwargs), connect_kwargs['database']
 
 
-def get_blocks_missing_transactions(chain_id: int, client: Client):
-    # Determine the max block number in the blocks table
-    max_block_number = client.execute(f'SELECT max(number) FROM dex_etl.{chain_id}_blocks')[0][0]
-
-    # Initialize the starting block number
-    start_block_number = 0
-
-    # Define the chunk size
-    chunk_size = 1000
-
-    # Continue until all blocks have been checked
-    while start_block_number <= max_block_number:
-        # Query to compare the transaction sums
-        print(f'Checking blocks {start_block_number} to {start_block_number + chunk_size - 1}')
-
-        query = f"""
-            SELECT
-                b.number AS block_number,
-                b.transaction_count AS expected_transaction_sum,
-                SUM(t.value) AS actual_transaction_sum
-            FROM
-                dex_etl.{chain_id}_blocks AS b
-                LEFT JOIN dex_etl.{chain_id}_transactions AS t ON b.number = t.block_number
-            WHERE
-                b.number BETWEEN {start_block_number} AND {start_block_number + chunk_size - 1}
-            GROUP BY
-                b.number,
-                b.transaction_count
-            HAVING
-                expected_transaction_sum != actual_transaction_sum
-        """
-
-        # Execute the query and print the results
-        results = client.execute(query)
-        blocks_to_fetch = []
-        for result in results:
-            print(
-                f'Block number: {result[0]}, Expected transaction sum: {result[1]}, Actual transaction sum: {result[2]}'
-            )
-            # Dig deeper to find the missing transactions
-            missing_blocks = get_missing_transaction_blocks(
-                chain_id, client, result[0], result[0] + chunk_size - 1
-            )
-            blocks_to_fetch.extend(missing_blocks)
-            print(f'Missing transactions in blocks: {missing_blocks}')
-
-        # Move to the next chunk
-        start_block_number += chunk_size
-        return blocks_to_fetch
-    return None
-
-
-def get_missing_transaction_blocks(
-    chain_id: int, client: Client, start_block_number: int, end_block_number: int
-):
-    query = f"""
-        SELECT
-            b.number AS block_number,
-            b.transaction_count AS expected_transaction_sum,
-            SUM(t.value) AS actual_transaction_sum
-        FROM
-            dex_etl.{chain_id}_blocks AS b
-            LEFT JOIN dex_etl.{chain_id}_transactions AS t ON b.number = t.block_number
-        WHERE
-            b.number BETWEEN {start_block_number} AND {end_block_number}
-        GROUP BY
-            b.number,
-            b.transaction_count
-        HAVING
-            expected_transaction_sum != actual_transaction_sum
-    """
-    results = client.execute(query)
-    return [result[0] for result in results]
-
-
 def get_blocks_count_difference_last_block(client: Client, chain_id: int):
     last_block_number_statement = f"""
     SELECT
@@ -127,196 +59,205 @@ def get_blocks_count_difference_last_block(client: Client, chain_id: int):
 
 
 def find_blocks_gaps(
-    client: Client, chain_id: int, max_number: int, chunk_size: int = 100000
+    client: Client, chain_id: int, start_block: int, end_block: int
 ) -> list[tuple[int, int]]:
-    # Initialize variables to keep track of missing blocks and gaps
-    gaps = []
-    expected_number = 1
-
-    # Define a query to get block numbers in chunks
-    query = """
-        SELECT number
-        FROM dex_etl.%(chain_id)s_blocks
-        WHERE number >= %(start)s AND number <= %(end)s
-        ORDER BY number
+    """Ranges of the block numbers missing between `start_block` and `end_block`, inclusive."""
+    # end_block + 1 closes the range, so the gap at its end is found too, signed numbers keep
+    # start_block - 1 of the genesis block from wrapping around
+    query = f"""
+        SELECT previous_number + 1, number - 1
+        FROM (
+            SELECT
+                number,
+                lagInFrame(number, 1, toInt64(%(start)s) - 1) OVER (
+                    ORDER BY number ROWS BETWEEN 1 PRECEDING AND CURRENT ROW
+                ) AS previous_number
+            FROM (
+                SELECT DISTINCT number
+                FROM (
+                    SELECT toInt64(number) AS number
+                    FROM dex_etl.{chain_id}_blocks
+                    WHERE number >= %(start)s AND number <= %(end)s
+                    UNION ALL
+                    SELECT toInt64(%(end)s) + 1
+                )
+            )
+        )
+        WHERE number - previous_number > 1
     """
+    return [
+        (gap_start, gap_end)
+        for gap_start, gap_end in client.execute(query, {'start': start_block, 'end': end_block})
+    ]
 
-    # Process data in chunks
-    for start in range(1, max_number + 1, chunk_size):
-        end = min(start + chunk_size - 1, max_number)
-        query_result = client.execute(query, {'chain_id': chain_id, 'start': start, 'end': end})
-
-        # Extract block numbers from the query result
-        block_numbers = [row[0] for row in query_result]
-
-        # Find gaps in the block numbers
-        for number in block_numbers:
-            if number > expected_number:
-                gap_start = expected_number
-                gap_end = number - 1
-                gaps.append((gap_start, gap_end))
-            expected_number = number + 1
-
-    # Check for a gap between the last block number and the max_number
-    if expected_number <= max_number:
-        gaps.append((expected_number, max_number))
-    return gaps
 
+def find_inconsistent_blocks(
+    client: Client, chain_id: int, start_block: int, end_block: int, check_logs: bool
+) -> list[int]:
+    """
+    Numbers of the blocks whose transactions, or logs, don't add up to the block.
 
-def find_missing_transactions(
-    client: Client,
-    chain_id: int,
-    start_block_number: int,
-    end_block_number: int,
-    min_range_size: int = 10000,
-):
-    missing_block_ranges = []
-
-    # Initialize a queue with the initial range
-    queue = deque([(start_block_number, end_block_number)])
-
-    while queue:
-        start, end = queue.popleft()
-
-        # Get the difference in transactions count
-        difference = get_transactions_count_difference(client, chain_id, start, end)
-
-        # If there's no difference or the difference is negative, continue with the next range
-        if difference is None or difference <= 0:
-            if difference is not None and difference < 0:
-                print(f"Duplicates between blocks {start} and {end}")
-                optimize_tables_service(chain_id, by_partition=True)
-            continue
-        # If the difference is positive, and the range is less than or equal to the minimum size, then this range is missing transactions
-        elif end - start <= min_range_size:
-            missing_block_ranges.append((start, end))
-        else:
-            print(
-                f"Checking blocks {start} and {end} total {end - start} with difference {difference}"
+    Transactions and logs are matched to the block by its hash, so rows of a block from another
+    fork count as missing. Besides the counts, the logs of a block are checked to belong to the
+    transactions which have logs, by comparing XORs of the hashes of those transactions.
+    """
+    logs_join = ''
+    logs_condition = ''
+    if check_logs:
+        logs_join = f"""
+            LEFT JOIN (
+                SELECT
+                    block_hash,
+                    count() AS log_count,
+                    groupBitXorDistinct(cityHash64(transaction_hash)) AS logged_transactions_hash
+                FROM (
+                    SELECT DISTINCT block_hash, transaction_hash, log_index
+                    FROM dex_etl.{chain_id}_logs
+                    WHERE block_number >= %(start)s AND block_number <= %(end)s
+                )
+                GROUP BY block_hash
+            ) AS l ON l.block_hash = b.hash
+        """
+        logs_condition = """
+            OR (
+                t.unknown_log_counts = 0
+                AND (
+                    l.log_count != t.log_count
+                    OR l.logged_transactions_hash != t.logged_transactions_hash
+                )
             )
-            # If the difference is positive, and the range is larger than the minimum size, then split the range and
-            # add the subranges to the queue.
-            mid = (start + end) // 2
-            queue.append((start, mid))
-            queue.append((mid + 1, end))
-
-    # Merge overlapping or adjacent ranges
-    missing_block_ranges.sort()
-    merged_ranges = []
-    current_start, current_end = missing_block_ranges[0]
-
-    for start, end in missing_block_ranges[1:]:
-        if start <= current_end + 1:  # adjacent ranges are considered overlapping
-            current_end = max(current_end, end)
-        else:
-            merged_ranges.append((current_start, current_end))
-            current_start, current_end = start, end
+        """
+    query = f"""
+        SELECT DISTINCT b.number
+        FROM (
+            SELECT DISTINCT number, hash, transaction_count
+            FROM dex_etl.{chain_id}_blocks
+            WHERE number >= %(start)s AND number <= %(end)s
+        ) AS b
+        LEFT JOIN (
+            SELECT
+                block_hash,
+                count() AS transaction_count,
+                sum(receipt_logs_count) AS log_count,
+                countIf(receipt_logs_count IS NULL) AS unknown_log_counts,
+                groupBitXorIf(cityHash64(hash), receipt_logs_count > 0) AS logged_transactions_hash
+            FROM (
+                SELECT DISTINCT block_hash, hash, receipt_logs_count
+                FROM dex_etl.{chain_id}_transactions
+                WHERE block_number >= %(start)s AND block_number <= %(end)s
+            )
+            GROUP BY block_hash
+        ) AS t ON t.block_hash = b.hash
+        {logs_join}
+        WHERE t.transaction_count != b.transaction_count {logs_condition}
+    """
+    return [
+        number for (number,) in client.execute(query, {'start': start_block, 'end': end_block})
+    ]
 
-    merged_ranges.append((current_start, current_end))
 
+def merge_block_ranges(ranges: Iterable[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Merges overlapping or adjacent inclusive ranges."""
+    merged_ranges: list[tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged_ranges and start <= merged_ranges[-1][1] + 1:
+            merged_ranges[-1] = (merged_ranges[-1][0], max(merged_ranges[-1][1], end))
+        else:
+            merged_ranges.append((start, end))
     return merged_ranges
 
 
-def get_transactions_count_difference(
-    client: Client,
+def find_repair_ranges(
     chain_id: int,
-    start_block_number: int | None = None,
-    end_block_number: int | None = None,
-) -> int | None:
-    hashes_count_statement = f"""
-    SELECT count(hash)
-    FROM dex_etl.{chain_id}_transactions
+    last_block: int,
+    chunk_size: int = BLOCK_RANGE_CHUNK_SIZE,
+    max_workers: int = MAX_WORKERS,
+) -> list[tuple[int, int]]:
     """
-    if start_block_number and end_block_number:
-        hashes_count_statement += f"""
-        WHERE block_number BETWEEN {start_block_number} AND {end_block_number}
-        """
+    Block ranges to export again: the gaps in the blocks and the blocks missing some of their
+    transactions or logs.
 
-    total_transactions_from_blocks = f"""
-    SELECT SUM(transaction_count) AS total_transaction_count
-    FROM dex_etl.{chain_id}_blocks
-    WHERE transaction_count > 0
+    Each chunk of blocks is checked by ClickHouse with a few queries, chunks are checked
+    concurrently.
     """
-    if start_block_number and end_block_number:
-        total_transactions_from_blocks += f"""
-        AND number BETWEEN {start_block_number} AND {end_block_number}
-        """
-
-    hashes_count_results = client.execute(hashes_count_statement)
-    total_transactions_from_blocks_results = client.execute(total_transactions_from_blocks)
+    thread_local = threading.local()
+
+    def get_client() -> Client:
+        if not hasattr(thread_local, 'client'):
+            thread_local.client, _ = clickhouse_client_from_url(envs.OUTPUT)
+        return thread_local.client
+
+    client, _ = clickhouse_client_from_url(envs.OUTPUT)
+    check_logs = bool(client.execute(f'EXISTS TABLE dex_etl.{chain_id}_logs')[0][0])
+
+    def check_chunk(chunk: tuple[int, int]) -> list[tuple[int, int]]:
+        start, end = chunk
+        print(f'Checking blocks {start} to {end}')
+        chunk_client = get_client()
+        gaps = find_blocks_gaps(chunk_client, chain_id, start, end)
+        inconsistent_blocks = find_inconsistent_blocks(
+            chunk_client, chain_id, start, end, check_logs
+        )
+        if gaps or inconsistent_blocks:
+            print(
+                f'Blocks {start} to {end}: {len(gaps)} gaps,'
+                f' {len(inconsistent_blocks)} blocks missing transactions or logs'
+            )
+        return gaps + consecutive_ranges(inconsistent_blocks)
 
-    if total_transactions_from_blocks_results and hashes_count_results:
-        total_transactions_from_blocks_results = total_transactions_from_blocks_results[0][0]
-        hashes_count_results = hashes_count_results[0][0]
-        diff = total_transactions_from_blocks_results - hashes_count_results
-        return diff
-    else:
-        return None
+    with ThreadPoolExecutor(max_workers) as executor:
+        chunk_ranges = executor.map(check_chunk, split_to_batches(0, last_block, chunk_size))
+        return merge_block_ranges(r for ranges in chunk_ranges for r in ranges)
 
 
-def get_missing_blocks_ranges(client: Client, chain_id: int):
-    blocks_gaps = []
-    blocks_diff, last_block = get_blocks_count_difference_last_block(client, chain_id)
-    if blocks_diff is not None and blocks_diff > 0:
-        blocks_gaps = find_blocks_gaps(client, chain_id, last_block)
-    return blocks_gaps, last_block, blocks_diff
-
-
-def get_missing_transactions_blocks_ranges(client: Client, chain_id: int, last_block: int):
-    txns_diff = get_transactions_count_difference(client, chain_id)
-    transactions_blocks_gaps = []
-    if txns_diff is not None and txns_diff > 0:
-        print(f"There are {txns_diff} missing transactions on chain_id: {chain_id}")
-        transactions_blocks_gaps = find_missing_transactions(
-            client, chain_id, start_block_number=1, end_block_number=last_block
-        )
-    return transactions_blocks_gaps, txns_diff
+def find_duplicated_blocks(client: Client, chain_id: int) -> list[tuple[int, int]]:
+    """Ranges of the blocks stored more than once."""
+    duplicated_blocks = client.execute(
+        f"""
+        SELECT number
+        FROM dex_etl.{chain_id}_blocks
+        GROUP BY number
+        HAVING count() > 1
+        """
+    )
+    return consecutive_ranges(number for (number,) in duplicated_blocks)
 
 
-def parse_consistency_results(data_diff: int | None, entity_type: EntityType, chain_id: int):
+def parse_consistency_results(
+    client: Client, data_diff: int | None, entity_type: EntityType, chain_id: int
+):
     if data_diff is None:
         print(f"No {entity_type} results found on chain_id: {chain_id}")
     elif data_diff > 0:
         print(f"There are {data_diff} missing {entity_type} on chain_id: {chain_id}")
     elif data_diff < 0:
         print(f"There are {data_diff} duplicated {entity_type} on chain_id: {chain_id}")
-        optimize_tables_service(chain_id, by_partition=True)
+        optimize_tables_service(
+            chain_id, by_partition=True, block_ranges=find_duplicated_blocks(client, chain_id)
+        )
     else:
         print(f"{entity_type} are consistent on chain_id: {chain_id}")
 
 
 def resolve_data_consistency_service(chain_id: int):
     client, database = clickhouse_client_from_url(envs.OUTPUT)
-    blocks_gaps, last_block, blocks_diff = get_missing_blocks_ranges(
-        client=client, chain_id=chain_id
-    )
-    parse_consistency_results(blocks_diff, EntityType.BLOCK, chain_id)
-    if blocks_gaps:
-        return blocks_gaps
+    blocks_diff, last_block = get_blocks_count_difference_last_block(client, chain_id)
+    parse_consistency_results(client, blocks_diff, EntityType.BLOCK, chain_id)
+    if not last_block:
+        return None
 
-    transactions_blocks_gaps, txns_diff = get_missing_transactions_blocks_ranges(
-        client=client, chain_id=chain_id, last_block=last_block
-    )
-    parse_consistency_results(txns_diff, EntityType.TRANSACTION, chain_id)
-    if transactions_blocks_gaps:
-        return transactions_blocks_gaps
-    return None
+    repair_ranges = find_repair_ranges(chain_id, last_block)
+    print(f"There are {len(repair_ranges)} block ranges to repair on chain_id: {chain_id}")
+    return repair_ranges or None
 
 
 if __name__ == "__main__":
     chain_id = 7700
-    client, database = clickhouse_client_from_url(envs.OUTPUT)
 
     if not chain_id:
         chains = SUPPORTED_CHAINS
     else:
         chains = [chain_id]
     for chain_id in chains:
-        blocks_gaps, last_block, blocks_diff = get_missing_blocks_ranges(
-            client=client, chain_id=chain_id
-        )
-        parse_consistency_results(blocks_diff, EntityType.BLOCK, chain_id)
-        transactions_blocks_gaps, txns_diff = get_missing_transactions_blocks_ranges(
-            client=client, chain_id=chain_id, last_block=last_block
-        )
-        parse_consistency_results(txns_diff, EntityType.TRANSACTION, chain_id)
+        for start_block, end_block in resolve_data_consistency_service(chain_id) or ():
+            print(f"Repair blocks {start_block} to {end_block}")
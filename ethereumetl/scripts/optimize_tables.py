@@ -1,9 +1,23 @@
+import os
+import tempfile
+import threading
+import time
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
 from clickhouse_driver import Client
 
 from ethereumetl.config.envs import envs
 from ethereumetl.utils import parse_clickhouse_url
 
 
+class PartitionToOptimize(NamedTuple):
+    table: str
+    partition_id: str
+    parts: int
+
+
 def clickhouse_client_from_url(url) -> tuple[Client, str]:
     connect_kwargs = parse_clickhouse_url(url)
     return (
@@ -12,36 +26,190 @@ def clickhouse_client_from_url(url) -> tuple[Client, str]:
     )
 
 
-def optimize_tables_service(chain_id: int, by_partition: bool = True):
-    client, database = clickhouse_client_from_url(envs.OUTPUT)
-
-    # Get the list of all tables
+def get_tables_to_optimize(client: Client, database: str, chain_id: int) -> list[str]:
     tables = client.execute(
-        f"SELECT name, engine FROM system.tables WHERE database = '{database}'"
+        'SELECT name, engine FROM system.tables WHERE database = %(database)s',
+        {'database': database},
+    )
+    tables_to_optimize = []
+    for table_name, engine in tables:
+        table_prefix = table_name.split('_')[1] if '_' in table_name else ''
+        if "ReplacingMergeTree" in engine and f'{chain_id}_{table_prefix}' == table_name:
+            tables_to_optimize.append(table_name)
+    return tables_to_optimize
+
+
+def get_partitions_to_optimize(
+    client: Client, database: str, tables: list[str]
+) -> list[PartitionToOptimize]:
+    """
+    Partitions with more than one active part, the most fragmented and recently written first.
+
+    Inserts, duplicates and reorg marks all land in new parts, so a partition merged into a single
+    part has nothing left to deduplicate.
+    """
+    if not tables:
+        return []
+    partitions = client.execute(
+        """
+        SELECT table, partition_id, count() AS parts
+        FROM system.parts
+        WHERE database = %(database)s AND table IN %(tables)s AND active
+        GROUP BY table, partition_id
+        HAVING parts > 1
+        ORDER BY parts DESC, max(modification_time) DESC
+        """,
+        {'database': database, 'tables': tuple(tables)},
+    )
+    return [PartitionToOptimize(*partition) for partition in partitions]
+
+
+def get_partitions_of_blocks(
+    client: Client, database: str, tables: list[str], block_ranges: Iterable[tuple[int, int]]
+) -> list[PartitionToOptimize]:
+    """
+    Partitions holding the blocks, with the number of their parts holding them.
+
+    A single part written by one insert may hold duplicates or reorged records too, so blocks
+    known to have them are optimized whatever the number of parts.
+    """
+    block_ranges = list(block_ranges)
+    if not tables or not block_ranges:
+        return []
+    columns = client.execute(
+        """
+        SELECT table, name
+        FROM system.columns
+        WHERE database = %(database)s AND table IN %(tables)s AND name IN ('block_number', 'number')
+        ORDER BY name
+        """,
+        {'database': database, 'tables': tuple(tables)},
     )
+    # tables with both columns are filtered by block_number, which sorts first
+    block_number_columns: dict[str, str] = {}
+    for table, column in columns:
+        block_number_columns.setdefault(table, column)
 
+    partitions = []
     for table in tables:
-        # If the table is a ReplacingMergeTree table
-        table_name = table[0]
-        table_prefix = table_name.split('_')[1]
-        if "ReplacingMergeTree" in table[1] and f'{chain_id}_{table_prefix}' == table[0]:
-            print(f"Optimizing table {table[0]}")
-            if by_partition:
-                # Get the list of all partitions for the current table
-                partitions: list[tuple] = client.execute(
-                    f"SELECT DISTINCT partition FROM system.parts WHERE table = '{table_name}' AND active = 1"
-                )
-                # Execute the OPTIMIZE command for each partition
-                for partition in partitions:
-                    if partition[0] == '0x4':
-                        print(f"Skip as  {partition[0]} in table {table_name} is a projection")
-                        continue
-                    print(f"Optimizing partition {partition[0]} in table {table_name}")
-                    client.execute(f"OPTIMIZE TABLE {table_name} PARTITION {partition[0]} FINAL")
-            else:
-                # Execute the OPTIMIZE command for the entire table
-                client.execute(f"OPTIMIZE TABLE {table_name} FINAL")
+        column = block_number_columns.get(table)
+        if column is None:
+            continue
+        condition = ' OR '.join(
+            f'{column} BETWEEN {int(start)} AND {int(end)}' for start, end in block_ranges
+        )
+        rows = client.execute(
+            f'SELECT _partition_id, uniqExact(_part) FROM `{database}`.`{table}`'
+            f' WHERE {condition} GROUP BY _partition_id'
+        )
+        partitions.extend(PartitionToOptimize(table, *row) for row in rows)
+    return partitions
+
+
+def wait_for_merge_pressure(client: Client, database: str, max_merges: int):
+    """Blocks while ClickHouse runs `max_merges` or more merges in the database."""
+    while True:
+        ((merges,),) = client.execute(
+            'SELECT count() FROM system.merges WHERE database = %(database)s',
+            {'database': database},
+        )
+        if merges < max_merges:
+            return
+        print(f"Waiting for {merges} running merges to finish")
+        time.sleep(5)
+
+
+class OptimizeProgress:
+    """Partitions optimized by an unfinished run, kept in a file so the next run resumes it."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done: set[tuple[str, str]] = set()
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    table, partition_id = line.split()
+                    self.done.add((table, partition_id))
+
+    def is_done(self, table: str, partition_id: str) -> bool:
+        return (table, partition_id) in self.done
+
+    def mark_done(self, table: str, partition_id: str):
+        with self.lock:
+            self.done.add((table, partition_id))
+            with open(self.path, 'a') as file:
+                file.write(f'{table} {partition_id}\n')
+
+    def finish(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def default_progress_file(database: str, chain_id: int) -> str:
+    return os.path.join(tempfile.gettempdir(), f'optimize_tables_{database}_{chain_id}.txt')
+
+
+def optimize_tables_service(
+    chain_id: int,
+    by_partition: bool = True,
+    max_workers: int = envs.OPTIMIZE_TABLES_MAX_WORKERS,
+    max_merges: int = envs.OPTIMIZE_TABLES_MAX_MERGES,
+    progress_file: str = envs.OPTIMIZE_TABLES_PROGRESS_FILE,
+    block_ranges: Iterable[tuple[int, int]] = (),
+):
+    """
+    Merges the partitions with several parts, and the partitions holding `block_ranges`, blocks
+    with known duplicates or reorgs, whatever their parts. Without `by_partition` every table
+    is optimized whole.
+    """
+    client, database = clickhouse_client_from_url(envs.OUTPUT)
+    tables = get_tables_to_optimize(client, database, chain_id)
+
+    if not by_partition:
+        for table_name in tables:
+            print(f"Optimizing table {table_name}")
+            client.execute(f"OPTIMIZE TABLE {table_name} FINAL")
+        print("Done")
+        return
+
+    # partitions holding the known blocks first, each partition once
+    partitions: dict[tuple[str, str], PartitionToOptimize] = {}
+    for partition in get_partitions_of_blocks(
+        client, database, tables, block_ranges
+    ) + get_partitions_to_optimize(client, database, tables):
+        partitions.setdefault((partition.table, partition.partition_id), partition)
+
+    progress = OptimizeProgress(progress_file or default_progress_file(database, chain_id))
+    partitions_to_optimize = [
+        p for p in partitions.values() if not progress.is_done(p.table, p.partition_id)
+    ]
+    print(f"{len(partitions_to_optimize)} partitions to optimize in {len(tables)} tables")
+
+    thread_local = threading.local()
+    # merge pressure is checked and the OPTIMIZE started one at a time
+    schedule_lock = threading.Lock()
+
+    def optimize_partition(partition: PartitionToOptimize):
+        if not hasattr(thread_local, 'client'):
+            thread_local.client, _ = clickhouse_client_from_url(envs.OUTPUT)
+        with schedule_lock:
+            wait_for_merge_pressure(thread_local.client, database, max_merges)
+            print(
+                f"Optimizing partition {partition.partition_id} in table {partition.table}"
+                f" with {partition.parts} parts"
+            )
+        thread_local.client.execute(
+            f"OPTIMIZE TABLE {partition.table} PARTITION ID %(partition_id)s FINAL",
+            {'partition_id': partition.partition_id},
+        )
+        progress.mark_done(partition.table, partition.partition_id)
+
+    with ThreadPoolExecutor(max_workers) as executor:
+        for _ in executor.map(optimize_partition, partitions_to_optimize):
+            pass
 
+    progress.finish()
     print("Done")
 
 
@@ -22,7 +22,7 @@
 import json
 import logging
 from collections import OrderedDict, defaultdict
-from collections.abc import Mapping, Sequence
+from collections.abc import Iterable, Mapping, Sequence
 from pathlib import Path
 from typing import Any, cast
 
@@ -110,6 +110,14 @@ class EthResolveLogService(metaclass=Singleton):
             }
         self.events_inventory = events_inventory
 
+    def get_topics_for_events(self, event_names: Iterable[str]) -> frozenset[str]:
+        event_names = set(event_names)
+        return frozenset(
+            event_signature_hash
+            for (event_signature_hash, _topic_count), event in self.events_inventory.items()
+            if event['event_name'] in event_names
+        )
+
     def _get_event_inventory_for_log(self, log: EthReceiptLog) -> dict | None:
         if not log.topics:
             return None
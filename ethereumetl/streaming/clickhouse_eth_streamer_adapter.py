@@ -1,20 +1,34 @@
 import logging
-from collections.abc import Iterable, Sequence
+import threading
+from collections import Counter, deque
+from collections.abc import Collection, Iterable, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import cache, cached_property
 from itertools import groupby
 from time import sleep
-from typing import Any
+from typing import Any, NamedTuple
 
 from clickhouse_connect.driver import Client
 from clickhouse_connect.driver.exceptions import DatabaseError
+from clickhouse_connect.driver.query import format_query_value
 from eth_utils import is_address
 
 from blockchainetl.jobs.exporters.clickhouse_exporter import ClickHouseItemExporter
 from blockchainetl.jobs.exporters.multi_item_exporter import MultiItemExporter
 from ethereumetl.clickhouse import ITEM_TYPE_TO_TABLE_MAPPING
+from ethereumetl.config.envs import envs
 from ethereumetl.enumeration.entity_type import ALL, ALL_STATIC, EntityType
+from ethereumetl.service.token_transfer_extractor import ALL_TRANSFER_EVENT_TOPICS
+from ethereumetl.streaming.enrich import EnrichIndex
 from ethereumetl.streaming.eth_streamer_adapter import EthStreamerAdapter, sort_by
-from ethereumetl.utils import clickhouse_client_from_url, parse_clickhouse_url
+from ethereumetl.streaming.log_demultiplexer import LogDemultiplexer
+from ethereumetl.utils import (
+    clickhouse_client_from_url,
+    clickhouse_query_with_keys,
+    consecutive_ranges,
+    create_clickhouse_client,
+    parse_clickhouse_url,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +57,24 @@ ENRICHED_TRANSFER = EntityType.ENRICHED_TRANSFER
 
 # noinspection PyProtectedMember
 class ClickhouseEthStreamerAdapter:
+    # keys of the items read from ClickHouse by block range
+    DISTINCT_ON = {
+        BLOCK: 'number',
+        TRANSACTION: 'hash',
+        LOG: 'transaction_hash,log_index',
+        TOKEN_TRANSFER: 'transaction_hash,log_index',
+        TOKEN_BALANCE: 'token_address,holder_address,block_number',
+        TRACE: 'trace_id',
+        GETH_TRACE: 'transaction_hash',
+        INTERNAL_TRANSFER: 'transaction_hash',
+        NATIVE_BALANCE: 'address,block_number',
+    }
+
+    # columns read when only the number of items in ClickHouse is checked
+    COUNTED_COLUMNS = {
+        TOKEN_TRANSFER: ('transaction_hash', 'log_index'),
+    }
+
     def __init__(
         self,
         eth_streamer: EthStreamerAdapter,
@@ -57,6 +89,11 @@ class ClickhouseEthStreamerAdapter:
         self.item_type_to_table_mapping = ITEM_TYPE_TO_TABLE_MAPPING
         self.chain_id = chain_id
         self.entity_types = frozenset(eth_streamer.entity_types)
+        self.read_executor: ThreadPoolExecutor | None = None
+        # concurrent queries can't share a client, its session is locked by the running one
+        self._thread_local = threading.local()
+        self._read_clients: list[Client] = []
+        self._read_clients_lock = threading.Lock()
 
         if RECEIPT in self.entity_types:
             raise NotImplementedError("Receipt export is not implemented for ClickHouse")
@@ -64,13 +101,27 @@ class ClickhouseEthStreamerAdapter:
     def open(self):
         self.eth_streamer.open()
         self.clickhouse = clickhouse_client_from_url(self.clickhouse_url)
+        self.read_executor = ThreadPoolExecutor(
+            envs.CLICKHOUSE_READ_MAX_WORKERS, thread_name_prefix='clickhouse-read'
+        )
 
     def get_current_block_number(self) -> int:
         return self.eth_streamer.get_current_block_number()
 
     def select_distinct(
-        self, entity_type: EntityType, start_block: int, end_block: int, distinct_on: str
+        self,
+        entity_type: EntityType,
+        start_block: int,
+        end_block: int,
+        distinct_on: str,
+        columns: Sequence[str] | None = None,
     ) -> tuple[dict[str, Any], ...]:
+        """
+        Items of the block range which are not marked as reorged.
+
+        FINAL keeps the last inserted copy of each row, so rewritten rows and rows exported
+        again after being marked as reorged are read as they were inserted last.
+        """
         assert self.clickhouse, "Clickhouse client is not initialized"
 
         table_name = self.item_type_to_table_mapping[entity_type]
@@ -78,14 +129,15 @@ class ClickhouseEthStreamerAdapter:
             block_number_column = 'number'
         else:
             block_number_column = 'block_number'
+        projection = ', '.join(f'`{column}`' for column in columns) if columns else '*'
         query = (
-            f"select distinct on ({distinct_on}) * from `{table_name}` final"
+            f"select distinct on ({distinct_on}) {projection} from `{table_name}` final"
             f" where {block_number_column} >= {start_block}"
             f"   and {block_number_column} <= {end_block}"
             f"   and not is_reorged"
         )
         try:
-            res = tuple(self.clickhouse.query(query).named_results())
+            res = tuple(self._get_read_client().query(query).named_results())
             for item in res:
                 item['type'] = entity_type
             return res
@@ -95,6 +147,33 @@ class ClickhouseEthStreamerAdapter:
                 return ()
             raise
 
+    def select_distinct_async(
+        self,
+        entity_type: EntityType,
+        start_block: int,
+        end_block: int,
+        columns: Sequence[str] | None = None,
+    ) -> Future:
+        """Runs `select_distinct` on the read executor, so reads of many entities overlap."""
+        assert self.read_executor, "Clickhouse client is not initialized"
+        return self.read_executor.submit(
+            self.select_distinct,
+            entity_type,
+            start_block,
+            end_block,
+            self.DISTINCT_ON[entity_type],
+            columns,
+        )
+
+    def _get_read_client(self) -> Client:
+        client = getattr(self._thread_local, 'clickhouse', None)
+        if client is None:
+            client = create_clickhouse_client(self.clickhouse_url)
+            self._thread_local.clickhouse = client
+            with self._read_clients_lock:
+                self._read_clients.append(client)
+        return client
+
     def select_where(self, entity_type: EntityType, distinct_on: str, **kwargs):
         """
         Select items from ClickHouse.
@@ -111,10 +190,12 @@ class ClickhouseEthStreamerAdapter:
             where_clause = []
             for key, value in kwargs.items():
                 if isinstance(value, str):
-                    where_clause.append(f"{key} = '{value}'")
+                    literal = format_query_value(value).replace('{', '{{').replace('}', '}}')
+                    where_clause.append(f"{key} = {literal}")
                 elif isinstance(value, Iterable):
                     assert value, f"Empty iterable for key {key}"
-                    where_clause.append(f"{key} in {tuple(value)}")
+                    where_clause.append(f"{key} in {{{key}}}")
+                    keys[key] = value
                 elif value is None:
                     where_clause.append(f"{key} is NULL")
                 elif isinstance(value, bool):
@@ -132,6 +213,7 @@ class ClickhouseEthStreamerAdapter:
         if distinct_on is not None:
             distinct_clause = f"distinct on ({distinct_on})"
 
+        keys: dict[str, Iterable] = {}
         try:
             where_clause = _get_where_clause(kwargs)
         except AssertionError as e:
@@ -141,7 +223,7 @@ class ClickhouseEthStreamerAdapter:
             return ()
         query = f"select {distinct_clause} * from `{table_name}`" f" where {where_clause}"
         try:
-            return tuple(self.clickhouse.query(query).named_results())
+            return tuple(clickhouse_query_with_keys(self.clickhouse, query, keys))
         except DatabaseError as e:
             if 'UNKNOWN_TABLE' in str(e):  # The error code is not exposed by the driver
                 logger.warning("Cannot export %s items from clickhouse: %s", entity_type, e)
@@ -156,6 +238,57 @@ class ClickhouseEthStreamerAdapter:
             item['type'] = entity_type
         return items
 
+    def blocks_to_fetch_from_node(
+        self,
+        start_block: int,
+        end_block: int,
+        blocks: Sequence[dict],
+        transactions: Sequence[dict],
+    ) -> set[int]:
+        """Numbers of the blocks missing in ClickHouse or missing some of their transactions."""
+        should_export = self.eth_streamer.should_export
+        blocks_to_fetch = set()
+        if BLOCK in should_export:
+            blocks_to_fetch.update(range(start_block, end_block + 1))
+            blocks_to_fetch.difference_update(b['number'] for b in blocks)
+        # Polygon's block.transaction_count doesn't match the number of transactions in the db
+        if TRANSACTION in should_export and self.chain_id != 137:
+            transaction_counts = Counter(t['block_number'] for t in transactions)
+            blocks_to_fetch.update(
+                b['number']
+                for b in blocks
+                if transaction_counts[b['number']] < b['transaction_count']
+            )
+        return blocks_to_fetch
+
+    def fill_blocks_and_transactions_from_node(
+        self, block_numbers: Collection[int], blocks: Sequence[dict], transactions: Sequence[dict]
+    ) -> tuple[list[dict], list[dict]]:
+        """
+        Replaces the given blocks and their transactions with the ones exported from the node.
+
+        Only consecutive runs of `block_numbers` are exported, the rest is kept as read
+        from ClickHouse.
+        """
+        node_blocks: list[dict] = []
+        node_transactions: list[dict] = []
+        for from_block, to_block in consecutive_ranges(block_numbers):
+            range_blocks, range_transactions = self.eth_streamer.export_blocks_and_transactions(
+                from_block, to_block
+            )
+            node_blocks.extend(range_blocks)
+            node_transactions.extend(range_transactions)
+
+        node_block_numbers = {b['number'] for b in node_blocks}
+        blocks = [b for b in blocks if b['number'] not in node_block_numbers] + node_blocks
+        transactions = [
+            t for t in transactions if t['block_number'] not in block_numbers
+        ] + node_transactions
+        return (
+            sort_by(blocks, self.eth_streamer.SORT_BY_FIELDS[BLOCK]),
+            sort_by(transactions, self.eth_streamer.SORT_BY_FIELDS[TRANSACTION]),
+        )
+
     @staticmethod
     def get_logs_count_from_transactions(transactions: tuple) -> int:
         none_value_receipt_logs_count = any(
@@ -174,22 +307,33 @@ class ClickhouseEthStreamerAdapter:
         assert self.clickhouse, "Clickhouse client is not initialized"
         if not tokens:
             return {}
-        query = f"""
-            SELECT 
-                token_address, 
+        query = """
+            SELECT
+                token_address,
                 uniqMerge(pools_count) as pool_count
             FROM pools_counts
-            WHERE token_address IN {tuple(tokens)}
+            WHERE token_address IN {tokens}
             GROUP BY token_address
         """
         return {
             d['token_address']: d['pool_count']
-            for d in self.clickhouse.query(query).named_results()
+            for d in clickhouse_query_with_keys(self.clickhouse, query, {'tokens': tokens})
         }
 
     def export_all(self, start_block, end_block):
         want_block_count = end_block - start_block + 1
+        all_blocks = frozenset(range(start_block, end_block + 1))
         should_export = self.eth_streamer.should_export
+        reads_from_ch: dict[EntityType, Future] = {}
+        # blocks read completely from ClickHouse, the entities of the others come from the node
+        blocks_in_ch: set[int] = set()
+
+        def read_from_ch(entity_type: EntityType) -> Future:
+            if entity_type not in reads_from_ch:
+                reads_from_ch[entity_type] = self.select_distinct_async(
+                    entity_type, start_block, end_block, self.COUNTED_COLUMNS.get(entity_type)
+                )
+            return reads_from_ch[entity_type]
 
         def get_transaction_count_from_blocks(blocks: tuple) -> int | float:
             if self.chain_id == 137:
@@ -201,23 +345,32 @@ class ClickhouseEthStreamerAdapter:
         @cache
         def export_blocks_and_transactions():
             logger.info("exporting BLOCKS and TRANSACTIONS...")
-            blocks = self.select_distinct(BLOCK, start_block, end_block, 'number')
-            transactions = self.select_distinct(TRANSACTION, start_block, end_block, 'hash')
+            blocks_read, transactions_read = read_from_ch(BLOCK), read_from_ch(TRANSACTION)
+            blocks, transactions = blocks_read.result(), transactions_read.result()
 
-            want_transaction_count = get_transaction_count_from_blocks(blocks)
-
-            transaction_count = len(transactions)
-            block_count = len(blocks)
+            for t in transactions:
+                t['type'] = TRANSACTION
+            for b in blocks:
+                b['type'] = BLOCK
 
-            if (BLOCK in should_export and block_count < want_block_count) or (
-                TRANSACTION in should_export and transaction_count < want_transaction_count
-            ):
+            blocks_to_fetch = self.blocks_to_fetch_from_node(
+                start_block, end_block, blocks, transactions
+            )
+            blocks_in_ch.update(b['number'] for b in blocks)
+            blocks_in_ch.difference_update(blocks_to_fetch)
+            if blocks_in_ch:
+                # the blocks were exported before, read the other entities of the range at once
+                for entity_type in should_export & self.DISTINCT_ON.keys():
+                    read_from_ch(entity_type)
+
+            if blocks_to_fetch:
                 logger.info(
                     f"Block/Transactions. Not enough data found in clickhouse: falling back to Eth node:"
                     f" entity_types=block,transaction block_range={start_block}-{end_block}"
+                    f" block_count={len(blocks_to_fetch)}"
                 )
-                blocks, transactions = self.eth_streamer.export_blocks_and_transactions(
-                    start_block, end_block
+                blocks, transactions = self.fill_blocks_and_transactions_from_node(
+                    blocks_to_fetch, blocks, transactions
                 )
 
                 if BLOCK in should_export:
@@ -233,75 +386,106 @@ class ClickhouseEthStreamerAdapter:
                 return blocks, transactions, from_ch
 
             from_ch = True
-
-            for t in transactions:
-                t['type'] = TRANSACTION
-            for b in blocks:
-                b['type'] = BLOCK
-
             return blocks, transactions, from_ch
 
         def blocks_previously_exported():
             blocks, _, from_ch = export_blocks_and_transactions()
             return from_ch and len(blocks) == want_block_count
 
+        def blocks_from_node() -> frozenset[int]:
+            export_blocks_and_transactions()
+            return all_blocks - blocks_in_ch
+
+        def transactions_in_ch() -> list[dict]:
+            transactions = export_blocks_and_transactions()[1]
+            return [t for t in transactions if t['block_number'] in blocks_in_ch]
+
         @cache
-        def export_receipts_and_logs():
+        def export_receipts_and_logs(block_numbers: frozenset[int]):
+            range_log_topics = self.eth_streamer.range_log_topics
+            if range_log_topics is not None:
+                logger.info("exporting LOGS by range...")
+                logs = [
+                    log
+                    for from_block, to_block in consecutive_ranges(block_numbers)
+                    for log in self.eth_streamer.export_logs(
+                        from_block, to_block, range_log_topics
+                    )
+                ]
+                return [], logs, [], False
+
             logger.info("exporting RECEIPTS and LOGS...")
             blocks, transactions, _ = export_blocks_and_transactions()
-            receipts, logs, errors = self.eth_streamer.export_receipts_and_logs(transactions)
+            if block_numbers != all_blocks:
+                blocks = [b for b in blocks if b['number'] in block_numbers]
+                transactions = [t for t in transactions if t['block_number'] in block_numbers]
+            receipts, logs, errors = self.eth_streamer.export_receipts_and_logs(
+                self.eth_streamer.filter_transactions_by_logs_bloom(blocks, transactions)
+            )
             from_ch = False
             return receipts, logs, errors, from_ch
 
         @cache
         def export_receipts():
             logger.info("exporting RECEIPTS...")
+            receipt_items = [
+                self._receipt_item_from_ch_transaction(transaction)
+                for transaction in transactions_in_ch()
+            ]
+            node_blocks = blocks_from_node()
+            if not node_blocks:
+                from_ch = True
+                return receipt_items, (), from_ch
 
-            blocks, transactions, from_ch = export_blocks_and_transactions()
-            if from_ch:
-                receipt_items = [
-                    self._receipt_item_from_ch_transaction(transaction)
-                    for transaction in transactions
-                ]
-                return receipt_items, from_ch
-
-            receipt_items, _logs, errors, from_ch = export_receipts_and_logs()
-            return receipt_items, errors, from_ch
+            receipts, _logs, errors, from_ch = export_receipts_and_logs(node_blocks)
+            return receipt_items + list(receipts), errors, from_ch
 
         @cache
         def export_logs():
             logger.info("exporting LOGS...")
-            if blocks_previously_exported():
-                blocks, transactions, from_ch = export_blocks_and_transactions()
-                want_transaction_count = get_transaction_count_from_blocks(blocks)
-                if want_transaction_count == 0:
-                    return (), from_ch
-                logs = self.select_distinct(
-                    LOG, start_block, end_block, 'transaction_hash,log_index'
-                )
-                want_logs_count = self.get_logs_count_from_transactions(transactions)
+            node_blocks = blocks_from_node()
+            if blocks_in_ch:
+                want_logs_count = self.get_logs_count_from_transactions(transactions_in_ch())
+                logs = [l for l in read_from_ch(LOG).result() if l['block_number'] in blocks_in_ch]
                 if len(logs) == want_logs_count:
                     for l in logs:
                         l['type'] = LOG
-                    from_ch = True
-                    return logs, (), from_ch
+                    if not node_blocks:
+                        from_ch = True
+                        return logs, (), from_ch
+                    logger.info(
+                        f"Logs. Blocks missing in clickhouse: falling back to Eth node:"
+                        f" entity_types=receipt,log block_range={start_block}-{end_block}"
+                        f" block_count={len(node_blocks)}"
+                    )
+                    _receipts, node_logs, errors, from_ch = export_receipts_and_logs(node_blocks)
+                    return logs + list(node_logs), errors, from_ch
 
             logger.info(
                 f"Logs. Not enough data found in clickhouse: falling back to Eth node:"
                 f" entity_types=receipt,log block_range={start_block}-{end_block}"
             )
-            _receipts, logs, errors, from_ch = export_receipts_and_logs()
+            _receipts, logs, errors, from_ch = export_receipts_and_logs(all_blocks)
             return logs, errors, from_ch
 
+        @cache
+        def route_logs() -> LogDemultiplexer:
+            return LogDemultiplexer(export_logs()[0])
+
         @cache
         def export_traces():
             logger.info("exporting TRACES...")
-            if blocks_previously_exported():
-                traces = self.select_distinct(TRACE, start_block, end_block, 'trace_id')
+            node_blocks = blocks_from_node()
+            if blocks_in_ch:
+                traces = [
+                    t for t in read_from_ch(TRACE).result() if t['block_number'] in blocks_in_ch
+                ]
                 if len(traces) > 0:
                     for t in traces:
                         t['type'] = TRACE
-                    from_ch = True
+                    from_ch = not node_blocks
+                    for from_block, to_block in consecutive_ranges(node_blocks):
+                        traces.extend(self.eth_streamer.export_traces(from_block, to_block))
                     return traces, from_ch
 
             logger.info(
@@ -315,18 +499,30 @@ class ClickhouseEthStreamerAdapter:
         @cache
         def export_geth_traces():
             logger.info("exporting GETH_TRACES...")
-            if blocks_previously_exported():
-                geth_traces = self.select_distinct(
-                    GETH_TRACE,
-                    start_block,
-                    end_block,
-                    'transaction_hash',
-                )
-                if geth_traces or not export_blocks_and_transactions()[1]:
+            node_blocks = blocks_from_node()
+            if blocks_in_ch:
+                transaction_hashes_in_ch = {t['hash'] for t in transactions_in_ch()}
+                geth_traces = [
+                    t
+                    for t in read_from_ch(GETH_TRACE).result()
+                    if t['transaction_hash'] in transaction_hashes_in_ch
+                ]
+                if geth_traces or not transaction_hashes_in_ch:
                     for t in geth_traces:
                         t['type'] = GETH_TRACE
                         t['transaction_traces'] = t['traces_json']
-                    from_ch = True
+                    from_ch = not node_blocks
+                    if node_blocks:
+                        geth_traces.extend(
+                            self.eth_streamer.export_geth_traces(
+                                [
+                                    t['hash']
+                                    for t in export_blocks_and_transactions()[1]
+                                    if t['block_number'] in node_blocks
+                                    and t.get('receipt_status') != 0
+                                ]
+                            )
+                        )
                     return geth_traces, from_ch
 
             logging.info(
@@ -346,12 +542,12 @@ class ClickhouseEthStreamerAdapter:
         def extract_token_transfers():
             logger.info("extracting TOKEN_TRANSFERS...")
             if blocks_previously_exported():
-                token_transfers_ch = self.select_distinct(
-                    TOKEN_TRANSFER, start_block, end_block, 'transaction_hash,log_index'
-                )
+                token_transfers_ch = read_from_ch(TOKEN_TRANSFER).result()
             else:
                 token_transfers_ch = ()
-            token_transfers = self.eth_streamer.extract_token_transfers(export_logs()[0])
+            token_transfers = self.eth_streamer.extract_token_transfers(
+                route_logs().receipt_logs_with_topics(ALL_TRANSFER_EVENT_TOPICS)
+            )
             from_ch = len(token_transfers_ch) == len(token_transfers)
             return token_transfers, from_ch
 
@@ -395,12 +591,7 @@ class ClickhouseEthStreamerAdapter:
         def export_token_balances():
             logger.info("exporting TOKEN_BALANCES...")
             if blocks_previously_exported():
-                balances = self.select_distinct(
-                    TOKEN_BALANCE,
-                    start_block,
-                    end_block,
-                    'token_address,holder_address,block_number',
-                )
+                balances = read_from_ch(TOKEN_BALANCE).result()
                 if len(balances) > 0:
                     for b in balances:
                         b['type'] = TOKEN_BALANCE
@@ -418,9 +609,7 @@ class ClickhouseEthStreamerAdapter:
         def extract_internal_transfers():
             logger.info("extracting INTERNAL_TRANSFERS...")
             if blocks_previously_exported():
-                internal_transfers_ch = self.select_distinct(
-                    INTERNAL_TRANSFER, start_block, end_block, 'transaction_hash'
-                )
+                internal_transfers_ch = read_from_ch(INTERNAL_TRANSFER).result()
                 if internal_transfers_ch:
                     return internal_transfers_ch, True
             else:
@@ -434,9 +623,7 @@ class ClickhouseEthStreamerAdapter:
         def export_native_balances():
             logger.info("exporting NATIVE_BALANCES...")
             if blocks_previously_exported():
-                native_balances_ch = self.select_distinct(
-                    NATIVE_BALANCE, start_block, end_block, 'address,block_number'
-                )
+                native_balances_ch = read_from_ch(NATIVE_BALANCE).result()
             else:
                 native_balances_ch = ()
             _blocks, transactions, transactions_from_ch = export_blocks_and_transactions()
@@ -496,7 +683,7 @@ class ClickhouseEthStreamerAdapter:
         @cache
         def parse_logs():
             logger.info("parsing LOGS...")
-            logs = export_logs()[0]
+            logs = route_logs().receipt_logs_with_topics(self.eth_streamer.parsable_log_topics)
             parsed_logs = self.eth_streamer.parse_logs(logs)
             return parsed_logs, False
 
@@ -575,21 +762,24 @@ class ClickhouseEthStreamerAdapter:
             # along dex_trade or we would be able to calculate closest path to stable based on
             # pools route
             assert self.clickhouse, "Clickhouse client is not initialized"
-            query = f"""
+            query = """
                         SELECT max(c_s).2 AS latest_price_stable,
                                  max(c_n).2 AS latest_price_native,
                                  token_address
                         FROM candles_5m
-                        WHERE token_address IN {tuple(base_tokens_addresses)}
+                        WHERE token_address IN {tokens}
                         GROUP BY token_address
                     """
+            results = clickhouse_query_with_keys(
+                self.clickhouse, query, {'tokens': base_tokens_addresses}
+            )
             return {
                 d['token_address']: {
                     'token_address': d['token_address'],
                     'price_stable': d['latest_price_stable'],
                     'price_native': d['latest_price_native'],
                 }
-                for d in self.clickhouse.query(query).named_results()
+                for d in results
             }
 
         @cache
@@ -705,6 +895,7 @@ class ClickhouseEthStreamerAdapter:
 
         all_items = []
         items_by_type = {}
+        enrich_index = EnrichIndex()
         for entity_type in self.entity_types:
             if (
                 from_ch.get(entity_type)
@@ -714,7 +905,9 @@ class ClickhouseEthStreamerAdapter:
             ):
                 continue
             items = exported[entity_type]
-            enriched_items = self.eth_streamer.enrich(entity_type, exported.__getitem__)
+            enriched_items = self.eth_streamer.enrich(
+                entity_type, exported.__getitem__, enrich_index
+            )
             if len(enriched_items) != len(items):
                 logger.warning(
                     "'%s' item count has changed after enrichment: %i -> %i",
@@ -740,8 +933,17 @@ class ClickhouseEthStreamerAdapter:
 
         self.eth_streamer.item_exporter.export_items(all_items)
 
+    def flush(self):
+        self.eth_streamer.flush()
+
     def close(self):
         try:
+            if self.read_executor is not None:
+                self.read_executor.shutdown()
+                self.read_executor = None
+            for client in self._read_clients:
+                client.close()
+            self._read_clients.clear()
             if self.clickhouse:
                 self.clickhouse.close()
                 self.clickhouse = None
@@ -786,31 +988,204 @@ class ClickhouseEthStreamerAdapter:
         }
 
 
+class BlockHeader(NamedTuple):
+    number: int
+    hash: str
+    parent_hash: str
+
+
 class VerifyingClickhouseEthStreamerAdapter:
     def __init__(self, clickhouse_eth_streamer_adapter: ClickhouseEthStreamerAdapter):
         self.ch_streamer = clickhouse_eth_streamer_adapter
         self._validate_export_destination()
         self.skip_entity_types = [ERROR, *ALL_STATIC]
+        self.reorg_executor: ThreadPoolExecutor | None = None
+        # consecutive headers of the blocks verified last, the oldest are dropped
+        self.headers: deque[BlockHeader] = deque(maxlen=envs.VERIFIER_HEADER_BUFFER_SIZE)
 
     def _validate_export_destination(self):
         msg = 'VerifyingClickhouseEthStreamerAdapter can be used only when exporting to the same ClickHouse instance'
-        if isinstance(self.ch_streamer.eth_streamer.item_exporter, MultiItemExporter):
-            for exporter in self.ch_streamer.eth_streamer.item_exporter.item_exporters:
-                if isinstance(exporter, ClickHouseItemExporter):
-                    assert self.ch_streamer.exporting_to_the_same_clickhouse, msg
-
-        elif isinstance(self.ch_streamer.eth_streamer.item_exporter, ClickHouseItemExporter):
+        if self._clickhouse_exporters():
             assert self.ch_streamer.exporting_to_the_same_clickhouse, msg
 
+    def _clickhouse_exporters(self) -> list[ClickHouseItemExporter]:
+        item_exporter = self.ch_streamer.eth_streamer.item_exporter
+        if isinstance(item_exporter, MultiItemExporter):
+            return [
+                exporter
+                for exporter in item_exporter.item_exporters
+                if isinstance(exporter, ClickHouseItemExporter)
+            ]
+        if isinstance(item_exporter, ClickHouseItemExporter):
+            return [item_exporter]
+        return []
+
     def open(self):
         self.ch_streamer.open()
+        self.reorg_executor = ThreadPoolExecutor(
+            envs.CLICKHOUSE_REORG_MAX_WORKERS, thread_name_prefix='clickhouse-reorg'
+        )
 
     def close(self):
-        self.ch_streamer.close()
+        try:
+            if self.reorg_executor is not None:
+                self.reorg_executor.shutdown()
+                self.reorg_executor = None
+        finally:
+            self.ch_streamer.close()
 
     def get_current_block_number(self) -> int:
         return self.ch_streamer.get_current_block_number()
 
+    def flush(self):
+        self.ch_streamer.flush()
+
+    def mark_records_as_reorged(
+        self,
+        blocks: Collection[int],
+        timestamps: Collection[int],
+        hashes: Collection[str],
+    ):
+        """
+        Mark all records with the given block numbers and block hashes as reorged.
+        Timestamps are used to speed up some queries.
+
+        Only the tables having unmarked rows of these blocks are rewritten, concurrently.
+        The blocks table is marked last: if marking is interrupted, the blocks still differ from
+        the node on the next verification, and the tables left unmarked are marked then.
+        """
+        if not blocks or not timestamps or not hashes:
+            return
+        assert self.reorg_executor, "Reorg executor is not initialized"
+
+        entities = [
+            entity
+            for entity in self.ch_streamer.item_type_to_table_mapping
+            if entity not in self.skip_entity_types
+        ]
+        marks = [
+            self.reorg_executor.submit(
+                self._mark_table_records_as_reorged, entity, blocks, timestamps, hashes
+            )
+            for entity in entities
+            if entity != BLOCK
+        ]
+        for mark in marks:
+            mark.result()
+        if BLOCK in entities:
+            self._mark_table_records_as_reorged(BLOCK, blocks, timestamps, hashes)
+
+    def _mark_table_records_as_reorged(
+        self,
+        entity: EntityType,
+        blocks: Collection[int],
+        timestamps: Collection[int],
+        hashes: Collection[str],
+    ):
+        table = self.ch_streamer.item_type_to_table_mapping[entity]
+        hash_column = 'hash' if entity == BLOCK else 'block_hash'
+
+        def where_condition(hashes_):
+            if entity == BLOCK:
+                return (
+                    f"WHERE number IN {tuple(blocks)}"
+                    f" AND timestamp IN {tuple(timestamps)}"
+                    f" AND hash IN {tuple(hashes_)}"
+                )
+            elif entity == LOG:
+                return f"WHERE block_number IN {tuple(blocks)} AND block_hash IN {tuple(hashes_)}"
+            else:
+                return (
+                    f"WHERE block_number IN {tuple(blocks)}"
+                    f" AND block_timestamp IN {tuple(timestamps)}"
+                    f" AND block_hash IN {tuple(hashes_)}"
+                )
+
+        while True:
+            client = self.ch_streamer._get_read_client()
+            try:
+                # blocks of which the table has rows whose latest copy is not marked, FINAL keeps
+                # the last inserted copy, so rows exported again after being marked count too
+                unmarked_hashes = [
+                    row[0]
+                    for row in client.query(
+                        f"SELECT {hash_column} FROM {table} FINAL {where_condition(hashes)}"
+                        f" GROUP BY {hash_column} HAVING min(is_reorged) = 0"
+                    ).result_rows
+                ]
+                if not unmarked_hashes:
+                    return
+                # a block marked again, after being exported again, copies the same rows
+                query = (
+                    f"INSERT INTO {table} SETTINGS insert_deduplicate = 0"
+                    f" SELECT * EXCEPT is_reorged, 1 FROM {table} FINAL"
+                    f" {where_condition(sorted(unmarked_hashes))}"
+                )
+                logger.warning('Marking records as reorged: %s', query)
+                client.command(query)
+                return
+            except DatabaseError as e:
+                if 'UNKNOWN_TABLE' in str(e):  # The error code is not exposed by the driver
+                    logger.warning("Skip unsupported entity %s: %s", entity, e)
+                    self.skip_entity_types.append(entity)
+                    return
+                logger.warning('Error while marking records as reorged: %s', e)
+            except Exception as e:
+                logger.warning('Error while marking records as reorged: %s', e)
+            logger.warning('Retrying in 2 seconds')
+            sleep(2)
+
+    def seed_headers(self, start_block: int):
+        """Fills the header buffer with the blocks stored in ClickHouse right before `start_block`."""
+        self.headers.clear()
+        if start_block == 0:
+            return
+        blocks_ch = self.ch_streamer.select_distinct(
+            BLOCK,
+            max(start_block - envs.VERIFIER_HEADER_BUFFER_SIZE, 0),
+            start_block - 1,
+            'number',
+            columns=('number', 'hash', 'parent_hash'),
+        )
+        for block in sorted(blocks_ch, key=lambda b: b['number'], reverse=True):
+            # keep the headers consecutive up to the start block
+            if block['number'] != start_block - 1 - len(self.headers):
+                break
+            self.headers.appendleft(
+                BlockHeader(block['number'], block['hash'], block['parent_hash'])
+            )
+
+    def find_forked_blocks(self, first_block: dict) -> list[dict]:
+        """
+        Node headers of the buffered blocks which are no longer on the node's chain.
+
+        Walks back from the parent of `first_block` while its parent hash doesn't match the
+        buffered header, fetching the node's header of every block passed.
+        """
+        forked_blocks: list[dict] = []
+        parent_hash = first_block['parent_hash']
+        for header in reversed(self.headers):
+            if header.hash == parent_hash:
+                break
+            (node_block,) = self.ch_streamer.eth_streamer.export_block_headers(
+                header.number, header.number
+            )
+            forked_blocks.insert(0, node_block)
+            parent_hash = node_block['parent_hash']
+        else:
+            if forked_blocks:
+                logger.warning(
+                    "Reorg is deeper than %i buffered headers, block %i and older are not verified",
+                    len(self.headers),
+                    forked_blocks[0]['number'],
+                )
+        return forked_blocks
+
+    def remember_headers(self, blocks: Sequence[dict]):
+        while self.headers and self.headers[-1].number >= blocks[0]['number']:
+            self.headers.pop()
+        self.headers.extend(BlockHeader(b['number'], b['hash'], b['parent_hash']) for b in blocks)
+
     def export_all(self, start_block: int, end_block: int):
         def find_inconsistent_blocks(blocks_from_storage: Sequence, blocks_from_w3: Sequence):
             if len(blocks_from_storage) != len(blocks_from_w3):
@@ -836,71 +1211,30 @@ class VerifyingClickhouseEthStreamerAdapter:
             assert block_ch['number'] == block_w3['number']
             assert block_ch['hash'] == block_w3['hash']
 
-        def mark_records_as_reorged(
-            blocks: Iterable,
-            timestamps: Iterable,
-            hashes: Iterable,
-        ):
-            """
-            Mark all records with the given block numbers and block hashes as reorged.
-            Timestamps are used to speed up some queries.
-            """
-            if not blocks or not timestamps or not hashes:
-                return
-
-            def safe_execute(command):
-                assert self.ch_streamer.clickhouse
-                while True:
-                    try:
-                        self.ch_streamer.clickhouse.command(command)
-                        break
-                    except DatabaseError as e:
-                        if 'UNKNOWN_TABLE' in str(
-                            e
-                        ):  # The error code is not exposed by the driver
-                            logger.warning("Skip unsupported entity %s: %s", entity, e)
-                            self.skip_entity_types.append(entity)
-                            break
-                    except Exception as e:
-                        logger.warning('Error while executing command: %s', e)
-                        logger.warning('Retrying in 2 seconds')
-                        sleep(2)
-
-            for entity, table in self.ch_streamer.item_type_to_table_mapping.items():
-                if entity in self.skip_entity_types:
-                    continue
-                if entity == BLOCK:
-                    where_condition = (
-                        f"WHERE number IN {tuple(blocks)}"
-                        f" AND timestamp IN {tuple(timestamps)}"
-                        f" AND hash IN {tuple(hashes)}"
-                    )
-                elif entity == LOG:
-                    where_condition = (
-                        f"WHERE block_number IN {tuple(blocks)} AND block_hash IN {tuple(hashes)}"
-                    )
-                else:
-                    where_condition = (
-                        f"WHERE block_number IN {tuple(blocks)}"
-                        f" AND block_timestamp IN {tuple(timestamps)}"
-                        f" AND block_hash IN {tuple(hashes)}"
-                    )
-                query = f"INSERT INTO {table} SELECT * EXCEPT is_reorged, 1 FROM {table} {where_condition}"
-                logger.warning('Marking records as reorged: %s', query)
-                safe_execute(query.strip())
-
         inconsistent_blocks: set[int] = set()
         inconsistent_timestamps: set[int] = set()
         inconsistent_hashes: set[str] = set()
         missing_blocks: set[int] = set()
 
-        blocks_ch = self.ch_streamer.select_distinct(BLOCK, start_block, end_block, 'number')
+        if not self.headers or self.headers[-1].number != start_block - 1:
+            self.seed_headers(start_block)
 
-        (
-            blocks_w3,
-            transactions_w3,
-        ) = self.ch_streamer.eth_streamer.export_blocks_and_transactions(start_block, end_block)
+        blocks_w3 = self.ch_streamer.eth_streamer.export_block_headers(start_block, end_block)
         blocks_w3 = sorted(blocks_w3, key=lambda x: x['number'])
+        # a reorg reaching below the range shows as a parent hash mismatch with the buffer
+        forked_blocks = self.find_forked_blocks(blocks_w3[0]) if blocks_w3 else []
+        if forked_blocks:
+            logger.warning(
+                "Reorg below block %i was found, verifying from block %i",
+                start_block,
+                forked_blocks[0]['number'],
+            )
+            blocks_w3 = forked_blocks + blocks_w3
+            start_block = forked_blocks[0]['number']
+
+        blocks_ch = self.ch_streamer.select_distinct(
+            BLOCK, start_block, end_block, 'number', columns=('number', 'hash', 'timestamp')
+        )
         blocks_ch = sorted(blocks_ch, key=lambda x: x['number'])  # type: ignore
 
         find_inconsistent_blocks(blocks_ch, blocks_w3)
@@ -931,13 +1265,19 @@ class VerifyingClickhouseEthStreamerAdapter:
                 list(g) for k, g in groupby(all_blocks, key=lambda x: x - all_blocks.index(x))
             ]
             for seq in block_sequences:
-                mark_records_as_reorged(
+                self.mark_records_as_reorged(
                     inconsistent_blocks & set(seq),
                     sorted(inconsistent_timestamps),
                     sorted(inconsistent_hashes),
                 )
+                # the rows may equal an earlier insert of these blocks, e.g. after A -> B -> A
+                for exporter in self._clickhouse_exporters():
+                    exporter.rewrite_blocks(seq)
                 self.ch_streamer.eth_streamer.export_all(
                     start_block=min(seq),
                     end_block=max(seq),
                 )
             logger.info("Inconsistent records were exported to ClickHouse")
+
+        if blocks_w3:
+            self.remember_headers(blocks_w3)
@@ -20,10 +20,10 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import dataclasses
-import itertools
-from collections import defaultdict
+from collections.abc import Iterable, Sequence
 from dataclasses import fields
 from datetime import datetime
+from typing import Any
 
 from ethereumetl.domain.dex_trade import EnrichedDexTrade
 from ethereumetl.domain.internal_transfer import InternalTransfer
@@ -31,197 +31,248 @@ from ethereumetl.domain.token_balance import EthTokenBalance
 from ethereumetl.domain.token_transfer_priced import TokenTransferPriced
 from ethereumetl.mappers.error_mapper import EthErrorMapper
 from ethereumetl.mappers.native_balance_mapper import EthNativeBalanceItem
-from ethereumetl.utils import dedup_list_of_dicts
-
-
-def join(left, right, join_fields, left_fields, right_fields):
+from ethereumetl.utils import dedup_list_of_dicts_by_key
+
+FieldList = Iterable[str | tuple[str, str]]
+Projection = tuple[tuple[str, str], ...]
+
+
+def compile_projection(field_list: FieldList) -> Projection:
+    """Turn a field list like ['hash', ('timestamp', 'block_timestamp')] into (src, dst) pairs."""
+    return tuple(field if isinstance(field, tuple) else (field, field) for field in field_list)
+
+
+class EnrichIndex:
+    """
+    Lookup maps shared by all enrich functions within one batch.
+
+    Most entity types are joined against the same blocks (by number) or transactions
+    and receipts (by hash), so each map is built once and reused. The first item wins
+    when the indexed side contains duplicate keys.
+    """
+
+    def __init__(self):
+        self._maps: dict[tuple[int, str], tuple[Sequence[dict], dict[Any, dict]]] = {}
+
+    def lookup(self, items: Sequence[dict], key_field: str) -> dict[Any, dict]:
+        cache_key = (id(items), key_field)
+        cached = self._maps.get(cache_key)
+        # keep a reference to the items, so that the id can't be reused by another list
+        if cached is not None and cached[0] is items:
+            return cached[1]
+        item_by_key: dict[Any, dict] = {}
+        for item in items:
+            item_by_key.setdefault(item[key_field], item)
+        self._maps[cache_key] = (items, item_by_key)
+        return item_by_key
+
+
+def join(
+    left,
+    right,
+    join_fields,
+    left_fields: FieldList,
+    right_fields: FieldList,
+    index: EnrichIndex | None = None,
+):
+    """Inner join of left items with the right item having the same key."""
     left_join_field, right_join_field = join_fields
-
-    def field_list_to_dict(field_list):
-        result_dict = {}
-        for field in field_list:
-            if isinstance(field, tuple):
-                result_dict[field[0]] = field[1]
-            else:
-                result_dict[field] = field
-        return result_dict
-
-    left_fields_as_dict = field_list_to_dict(left_fields)
-    right_fields_as_dict = field_list_to_dict(right_fields)
-
-    left_map = defaultdict(list)
-    for item in left:
-        left_map[item[left_join_field]].append(item)
-
-    right_map = defaultdict(list)
-    for item in right:
-        right_map[item[right_join_field]].append(item)
-
-    for key in left_map:
-        for left_item, right_item in itertools.product(left_map[key], right_map[key]):
-            result_item = {}
-            for src_field, dst_field in left_fields_as_dict.items():
-                result_item[dst_field] = left_item.get(src_field)
-            for src_field, dst_field in right_fields_as_dict.items():
-                result_item[dst_field] = right_item.get(src_field)
-
-            yield result_item
-
-
-def enrich_transactions(transactions, receipts):
-    transactions = dedup_list_of_dicts(transactions)
-    receipts = dedup_list_of_dicts(receipts)
+    left_projection = compile_projection(left_fields)
+    right_projection = compile_projection(right_fields)
+    right_map = (index or EnrichIndex()).lookup(right, right_join_field)
+
+    for left_item in left:
+        right_item = right_map.get(left_item[left_join_field])
+        if right_item is None:
+            continue
+        result_item = {
+            dst_field: left_item.get(src_field) for src_field, dst_field in left_projection
+        }
+        for src_field, dst_field in right_projection:
+            result_item[dst_field] = right_item.get(src_field)
+
+        yield result_item
+
+
+BLOCK_FIELDS = compile_projection([('timestamp', 'block_timestamp'), ('hash', 'block_hash')])
+TRANSACTION_BLOCK_FIELDS = compile_projection(['block_timestamp', 'block_number', 'block_hash'])
+
+TRANSACTION_FIELDS = compile_projection(
+    [
+        'type',
+        'hash',
+        'nonce',
+        'transaction_index',
+        'from_address',
+        'to_address',
+        'value',
+        'gas',
+        'gas_price',
+        'input',
+        'block_timestamp',
+        'block_number',
+        'block_hash',
+        'max_fee_per_gas',
+        'max_priority_fee_per_gas',
+        'transaction_type',
+    ]
+)
+RECEIPT_FIELDS = compile_projection(
+    [
+        ('cumulative_gas_used', 'receipt_cumulative_gas_used'),
+        ('gas_used', 'receipt_gas_used'),
+        ('contract_address', 'receipt_contract_address'),
+        ('root', 'receipt_root'),
+        ('status', 'receipt_status'),
+        ('effective_gas_price', 'receipt_effective_gas_price'),
+        ('logs_count', 'receipt_logs_count'),
+    ]
+)
+LOG_FIELDS = compile_projection(
+    [
+        'type',
+        'log_index',
+        'transaction_hash',
+        'transaction_index',
+        'address',
+        'data',
+        'topics',
+        'block_number',
+    ]
+)
+TOKEN_TRANSFER_FIELDS = compile_projection(
+    [
+        'type',
+        'token_address',
+        'from_address',
+        'to_address',
+        'value',
+        'transaction_hash',
+        'log_index',
+        'block_number',
+        'token_standard',
+        'token_id',
+        'operator_address',
+    ]
+)
+TOKEN_BALANCE_FIELDS = compile_projection(['type', *(f.name for f in fields(EthTokenBalance))])
+TRACE_FIELDS = compile_projection(
+    [
+        'type',
+        'transaction_index',
+        'from_address',
+        'to_address',
+        'value',
+        'input',
+        'output',
+        'trace_type',
+        'call_type',
+        'reward_type',
+        'gas',
+        'gas_used',
+        'subtraces',
+        'trace_address',
+        'error',
+        'status',
+        'transaction_hash',
+        'block_number',
+        'trace_id',
+        'trace_index',
+    ]
+)
+INTERNAL_TRANSFER_FIELDS = compile_projection(
+    ['type', *(f.name for f in fields(InternalTransfer))]
+)
+GETH_TRACE_FIELDS = compile_projection(
+    ['transaction_hash', 'type', ('transaction_traces', 'traces_json')]
+)
+CONTRACT_FIELDS = compile_projection(
+    [
+        'type',
+        'address',
+        'bytecode',
+        'function_sighashes',
+        'is_erc20',
+        'is_erc721',
+        'block_number',
+    ]
+)
+TOKEN_FIELDS = compile_projection(
+    ['type', 'address', 'symbol', 'name', 'decimals', 'total_supply', 'block_number']
+)
+ERROR_FIELDS = compile_projection(EthErrorMapper.ERROR_ITEM_FIELDS)
+NATIVE_BALANCE_FIELDS = compile_projection(EthNativeBalanceItem.__required_keys__)
+TOKEN_TRANSFER_PRICED_FIELDS = compile_projection(
+    ['type'] + [f.name for f in dataclasses.fields(TokenTransferPriced)]
+)
+ENRICHED_DEX_TRADE_FIELDS = compile_projection(
+    ['type'] + [f.name for f in dataclasses.fields(EnrichedDexTrade)]
+)
+ENRICHED_TRANSFER_FIELDS = compile_projection(
+    ['type', 'filter_column', 'wallet_addresses']
+    + [f.name for f in dataclasses.fields(EnrichedDexTrade)]
+)
+
+
+def enrich_transactions(transactions, receipts, index: EnrichIndex | None = None):
+    transactions = dedup_list_of_dicts_by_key(transactions, ('hash',))
+    index = index or EnrichIndex()
+    receipt_count = len(index.lookup(receipts, 'transaction_hash'))
     result = list(
         join(
             transactions,
             receipts,
             ('hash', 'transaction_hash'),
-            left_fields=[
-                'type',
-                'hash',
-                'nonce',
-                'transaction_index',
-                'from_address',
-                'to_address',
-                'value',
-                'gas',
-                'gas_price',
-                'input',
-                'block_timestamp',
-                'block_number',
-                'block_hash',
-                'max_fee_per_gas',
-                'max_priority_fee_per_gas',
-                'transaction_type',
-            ],
-            right_fields=[
-                ('cumulative_gas_used', 'receipt_cumulative_gas_used'),
-                ('gas_used', 'receipt_gas_used'),
-                ('contract_address', 'receipt_contract_address'),
-                ('root', 'receipt_root'),
-                ('status', 'receipt_status'),
-                ('effective_gas_price', 'receipt_effective_gas_price'),
-                ('logs_count', 'receipt_logs_count'),
-            ],
+            TRANSACTION_FIELDS,
+            RECEIPT_FIELDS,
+            index,
         )
     )
 
-    if len(result) < min(len(transactions), len(receipts)):
+    if len(result) < min(len(transactions), receipt_count):
         raise ValueError(
             "transaction count is wrong after enriching with receipt:"
             f" before_transactions={len(transactions)}"
-            f", before_receipts={len(receipts)}"
+            f", before_receipts={receipt_count}"
             f", after={len(result)}"
         )
 
     return result
 
 
-def enrich_logs(blocks, logs):
-    result = list(
-        join(
-            logs,
-            blocks,
-            ('block_number', 'number'),
-            [
-                'type',
-                'log_index',
-                'transaction_hash',
-                'transaction_index',
-                'address',
-                'data',
-                'topics',
-                'block_number',
-            ],
-            [
-                ('timestamp', 'block_timestamp'),
-                ('hash', 'block_hash'),
-            ],
-        )
-    )
-
-    return result
+def enrich_logs(blocks, logs, index: EnrichIndex | None = None):
+    return list(join(logs, blocks, ('block_number', 'number'), LOG_FIELDS, BLOCK_FIELDS, index))
 
 
-def enrich_token_transfers(blocks, token_transfers):
-    result = list(
+def enrich_token_transfers(blocks, token_transfers, index: EnrichIndex | None = None):
+    return list(
         join(
             token_transfers,
             blocks,
             ('block_number', 'number'),
-            [
-                'type',
-                'token_address',
-                'from_address',
-                'to_address',
-                'value',
-                'transaction_hash',
-                'log_index',
-                'block_number',
-                'token_standard',
-                'token_id',
-                'operator_address',
-            ],
-            [
-                ('timestamp', 'block_timestamp'),
-                ('hash', 'block_hash'),
-            ],
+            TOKEN_TRANSFER_FIELDS,
+            BLOCK_FIELDS,
+            index,
         )
     )
 
-    return result
 
-
-def enrich_token_balances(blocks, token_balances):
-    result = list(
+def enrich_token_balances(blocks, token_balances, index: EnrichIndex | None = None):
+    return list(
         join(
             token_balances,
             blocks,
             ('block_number', 'number'),
-            ['type', *(f.name for f in fields(EthTokenBalance))],
-            [
-                ('timestamp', 'block_timestamp'),
-                ('hash', 'block_hash'),
-            ],
+            TOKEN_BALANCE_FIELDS,
+            BLOCK_FIELDS,
+            index,
         )
     )
 
-    return result
-
 
-def enrich_traces(blocks, traces):
+def enrich_traces(blocks, traces, index: EnrichIndex | None = None):
     result = list(
-        join(
-            traces,
-            blocks,
-            ('block_number', 'number'),
-            [
-                'type',
-                'transaction_index',
-                'from_address',
-                'to_address',
-                'value',
-                'input',
-                'output',
-                'trace_type',
-                'call_type',
-                'reward_type',
-                'gas',
-                'gas_used',
-                'subtraces',
-                'trace_address',
-                'error',
-                'status',
-                'transaction_hash',
-                'block_number',
-                'trace_id',
-                'trace_index',
-            ],
-            [
-                ('timestamp', 'block_timestamp'),
-                ('hash', 'block_hash'),
-            ],
-        )
+        join(traces, blocks, ('block_number', 'number'), TRACE_FIELDS, BLOCK_FIELDS, index)
     )
 
     if len(result) != len(traces):
@@ -230,17 +281,15 @@ def enrich_traces(blocks, traces):
     return result
 
 
-def enrich_internal_transfers(transactions, internal_transfers):
+def enrich_internal_transfers(transactions, internal_transfers, index: EnrichIndex | None = None):
     result = list(
         join(
             internal_transfers,
             transactions,
             ('transaction_hash', 'hash'),
-            (
-                'type',
-                *(f.name for f in fields(InternalTransfer)),
-            ),
-            ('block_timestamp', 'block_number', 'block_hash'),
+            INTERNAL_TRANSFER_FIELDS,
+            TRANSACTION_BLOCK_FIELDS,
+            index,
         )
     )
 
@@ -250,18 +299,15 @@ def enrich_internal_transfers(transactions, internal_transfers):
     return result
 
 
-def enrich_geth_traces(transactions, traces_for_transactions):
+def enrich_geth_traces(transactions, traces_for_transactions, index: EnrichIndex | None = None):
     result = list(
         join(
             traces_for_transactions,
             transactions,
             ('transaction_hash', 'hash'),
-            ['transaction_hash', 'type', ('transaction_traces', 'traces_json')],
-            [
-                'block_number',
-                'block_timestamp',
-                'block_hash',
-            ],
+            GETH_TRACE_FIELDS,
+            TRANSACTION_BLOCK_FIELDS,
+            index,
         )
     )
     if len(result) != len(traces_for_transactions):
@@ -271,26 +317,9 @@ def enrich_geth_traces(transactions, traces_for_transactions):
     return result
 
 
-def enrich_contracts(blocks, contracts):
+def enrich_contracts(blocks, contracts, index: EnrichIndex | None = None):
     result = list(
-        join(
-            contracts,
-            blocks,
-            ('block_number', 'number'),
-            [
-                'type',
-                'address',
-                'bytecode',
-                'function_sighashes',
-                'is_erc20',
-                'is_erc721',
-                'block_number',
-            ],
-            [
-                ('timestamp', 'block_timestamp'),
-                ('hash', 'block_hash'),
-            ],
-        )
+        join(contracts, blocks, ('block_number', 'number'), CONTRACT_FIELDS, BLOCK_FIELDS, index)
     )
 
     if len(result) != len(contracts):
@@ -299,18 +328,9 @@ def enrich_contracts(blocks, contracts):
     return result
 
 
-def enrich_tokens(blocks, tokens):
+def enrich_tokens(blocks, tokens, index: EnrichIndex | None = None):
     result = list(
-        join(
-            tokens,
-            blocks,
-            ('block_number', 'number'),
-            ['type', 'address', 'symbol', 'name', 'decimals', 'total_supply', 'block_number'],
-            [
-                ('timestamp', 'block_timestamp'),
-                ('hash', 'block_hash'),
-            ],
-        )
+        join(tokens, blocks, ('block_number', 'number'), TOKEN_FIELDS, BLOCK_FIELDS, index)
     )
 
     if len(result) != len(tokens):
@@ -319,89 +339,74 @@ def enrich_tokens(blocks, tokens):
     return result
 
 
-def enrich_errors(blocks, errors):
-    result = list(
-        join(
-            errors,
-            blocks,
-            ('block_number', 'number'),
-            EthErrorMapper.ERROR_ITEM_FIELDS,
-            [
-                ('timestamp', 'block_timestamp'),
-                ('hash', 'block_hash'),
-            ],
-        )
+def enrich_errors(blocks, errors, index: EnrichIndex | None = None):
+    return list(
+        join(errors, blocks, ('block_number', 'number'), ERROR_FIELDS, BLOCK_FIELDS, index)
     )
-    return result
 
 
-def enrich_native_balances(blocks, native_balances):
+def enrich_native_balances(blocks, native_balances, index: EnrichIndex | None = None):
     return list(
         join(
             native_balances,
             blocks,
             ('block_number', 'number'),
-            EthNativeBalanceItem.__required_keys__,
-            [
-                ('timestamp', 'block_timestamp'),
-                ('hash', 'block_hash'),
-            ],
+            NATIVE_BALANCE_FIELDS,
+            BLOCK_FIELDS,
+            index,
         )
     )
 
 
-def enrich_token_transfers_priced(blocks, token_transfers):
+def enrich_token_transfers_priced(blocks, token_transfers, index: EnrichIndex | None = None):
     return list(
         join(
             token_transfers,
             blocks,
             ('block_number', 'number'),
-            ['type'] + [f.name for f in dataclasses.fields(TokenTransferPriced)],
-            [
-                ('timestamp', 'timestamp'),
-            ],
+            TOKEN_TRANSFER_PRICED_FIELDS,
+            [('timestamp', 'timestamp')],
+            index,
         )
     )
 
 
-def enrich_dex_trades(blocks, dex_trades):
+def enrich_dex_trades(blocks, dex_trades, index: EnrichIndex | None = None):
     return list(
         join(
             dex_trades,
             blocks,
             ('block_number', 'number'),
-            ['type'] + [f.name for f in dataclasses.fields(EnrichedDexTrade)],
-            [
-                ('timestamp', 'block_timestamp'),
-                ('hash', 'block_hash'),
-            ],
+            ENRICHED_DEX_TRADE_FIELDS,
+            BLOCK_FIELDS,
+            index,
         )
     )
 
 
-def enrich_transfers_for_trades(transactions, transfers_for_trades):
+def enrich_transfers_for_trades(
+    transactions, transfers_for_trades, index: EnrichIndex | None = None
+):
     return list(
         join(
             transfers_for_trades,
             transactions,
             ('transaction_hash', 'hash'),
-            ['type', 'filter_column', 'wallet_addresses']
-            + [f.name for f in dataclasses.fields(EnrichedDexTrade)],
-            ('block_timestamp', 'block_number', 'block_hash'),
+            ENRICHED_TRANSFER_FIELDS,
+            TRANSACTION_BLOCK_FIELDS,
+            index,
         )
     )
 
 
-def enrich_parsed_logs(blocks, parsed_logs):
+def enrich_parsed_logs(blocks, parsed_logs, index: EnrichIndex | None = None):
     return list(
         join(
             parsed_logs,
             blocks,
             ('block_number', 'number'),
-            ['type'] + [f.name for f in dataclasses.fields(EnrichedDexTrade)],
-            [
-                ('timestamp', 'block_timestamp'),
-                ('hash', 'block_hash'),
-            ],
+            ENRICHED_DEX_TRADE_FIELDS,
+            BLOCK_FIELDS,
+            index,
         )
     )
@@ -2,7 +2,7 @@ import logging
 from collections.abc import Collection
 from copy import deepcopy
 from datetime import datetime
-from functools import cached_property
+from functools import cache, cached_property
 from typing import Any
 
 from elasticsearch import Elasticsearch
@@ -12,12 +12,14 @@ from blockchainetl.jobs.exporters.console_item_exporter import ConsoleItemExport
 from blockchainetl.jobs.exporters.in_memory_item_exporter import InMemoryItemExporter
 from blockchainetl.jobs.importers.price_importers.base_price_importer import BasePriceImporter
 from blockchainetl.jobs.importers.price_importers.interface import PriceImporterInterface
+from ethereumetl.domain.receipt_log import EthReceiptLog
 from ethereumetl.enumeration.entity_type import ALL_FOR_STREAMING, EntityType
 from ethereumetl.jobs.enrich_dex_trades_job import EnrichDexTradeJob
 from ethereumetl.jobs.export_blocks_job import ExportBlocksJob
 from ethereumetl.jobs.export_dex_pools_job import ExportPoolsJob
 from ethereumetl.jobs.export_dex_trades import ExportDexTradesJob
 from ethereumetl.jobs.export_geth_traces_job import ExportGethTracesJob
+from ethereumetl.jobs.export_logs_job import ExportLogsJob
 from ethereumetl.jobs.export_native_balances_job import ExportNativeBalancesJob
 from ethereumetl.jobs.export_prices_for_tokens_job import ExportPricesForTokensJob
 from ethereumetl.jobs.export_receipts_job import ExportReceiptsJob
@@ -32,8 +34,12 @@ from ethereumetl.jobs.extract_token_transfers_job import ExtractTokenTransfersJo
 from ethereumetl.jobs.extract_token_transfers_priced import ExtractTokenTransfersPricedJob
 from ethereumetl.jobs.extract_tokens_job import ExtractTokensJob
 from ethereumetl.jobs.parse_logs_job import ParseLogsJob
-from ethereumetl.misc.info import get_chain_config
+from ethereumetl.logs_bloom import LogsBloomFilter
+from ethereumetl.misc.info import PARSABLE_TRADE_EVENTS, get_chain_config
+from ethereumetl.service.eth_resolve_log_service import EthResolveLogService
+from ethereumetl.service.token_transfer_extractor import ALL_TRANSFER_EVENT_TOPICS
 from ethereumetl.streaming.enrich import (
+    EnrichIndex,
     enrich_dex_trades,
     enrich_errors,
     enrich_geth_traces,
@@ -50,9 +56,12 @@ from ethereumetl.streaming.enrich import (
 )
 from ethereumetl.streaming.eth_item_id_calculator import EthItemIdCalculator
 from ethereumetl.streaming.eth_item_timestamp_calculator import EthItemTimestampCalculator
+from ethereumetl.streaming.log_demultiplexer import LogDemultiplexer
 from ethereumetl.thread_local_proxy import ThreadLocalProxy
 from ethereumetl.web3_utils import build_web3
 
+logger = logging.getLogger(__name__)
+
 BLOCK = EntityType.BLOCK
 TRANSACTION = EntityType.TRANSACTION
 RECEIPT = EntityType.RECEIPT
@@ -102,7 +111,7 @@ class EthStreamerAdapter:
     }
 
     ENRICH = {
-        # entity_type: (enrich_with_entity_type, enrich_func(enrich_with_items, items))
+        # entity_type: (enrich_with_entity_type, enrich_func(enrich_with_items, items, index))
         LOG: (BLOCK, enrich_logs),
         TOKEN_TRANSFER: (BLOCK, enrich_token_transfers),
         TOKEN_BALANCE: (BLOCK, enrich_token_balances),
@@ -112,7 +121,7 @@ class EthStreamerAdapter:
         INTERNAL_TRANSFER: (TRANSACTION, enrich_internal_transfers),
         NATIVE_BALANCE: (BLOCK, enrich_native_balances),
         # lambda because here the arg order is different
-        TRANSACTION: (RECEIPT, lambda r, t: enrich_transactions(t, r)),
+        TRANSACTION: (RECEIPT, lambda r, t, index: enrich_transactions(t, r, index)),
         TOKEN_TRANSFER_PRICED: (BLOCK, enrich_token_transfers_priced),
         ENRICHED_DEX_TRADE: (BLOCK, enrich_dex_trades),
         ENRICHED_TRANSFER: (TRANSACTION, enrich_transfers_for_trades),
@@ -146,6 +155,9 @@ class EthStreamerAdapter:
         ENRICHED_TRANSFER: (ENRICHED_DEX_TRADE,),
     }
 
+    # entity types that need the receipts and logs of every transaction, errors of any receipt
+    ALL_RECEIPTS_ENTITY_TYPES = frozenset((TRANSACTION, RECEIPT, LOG, PRE_EVENT, ERROR))
+
     def __init__(
         self,
         batch_web3_provider,
@@ -156,6 +168,8 @@ class EthStreamerAdapter:
         chain_id=None,
         elastic_client: Elasticsearch | None = None,
         price_importer: PriceImporterInterface | None = None,
+        selective_receipts: bool = False,
+        logs_by_range: bool = False,
     ):
         self.EXPORT_DEPENDENCIES = deepcopy(self.__EXPORT_DEPENDENCIES)
         self.batch_web3_provider = batch_web3_provider
@@ -169,8 +183,13 @@ class EthStreamerAdapter:
         self.chain_id = chain_id
         self.elastic_client = elastic_client
         self.price_importer = price_importer or BasePriceImporter(chain_id)
+        self.selective_receipts = selective_receipts
+        self.logs_by_range = logs_by_range
         if CONTRACT in self.entity_types:
             self.EXPORT_DEPENDENCIES[TOKEN] = (CONTRACT,)
+        if self.logs_by_range and not self.entity_types & self.ALL_RECEIPTS_ENTITY_TYPES:
+            # ranged eth_getLogs needs no transactions to look receipts up by
+            self.EXPORT_DEPENDENCIES[LOG] = ()
         self.chain_config: dict[str, Any] = {}
 
     def open(self):
@@ -184,14 +203,34 @@ class EthStreamerAdapter:
     def export_batch(self, start_block: int, end_block: int) -> dict[EntityType, list[dict]]:
         exported: dict[EntityType, list[dict]] = {}
 
+        @cache
+        def route_logs() -> LogDemultiplexer:
+            return LogDemultiplexer(export(LOG))
+
         export_plan = {
             entity_type: (export_func, export_types)
             for export_types, export_func in {
                 (BLOCK, TRANSACTION): lambda: self.export_blocks_and_transactions(
                     start_block, end_block
                 ),
-                (RECEIPT, LOG, ERROR): lambda: self.export_receipts_and_logs(export(TRANSACTION)),
-                (TOKEN_TRANSFER,): lambda: self.extract_token_transfers(export(LOG)),
+                (RECEIPT, LOG, ERROR): (
+                    (
+                        lambda: self.export_receipts_and_logs(
+                            self.filter_transactions_by_logs_bloom(
+                                export(BLOCK), export(TRANSACTION)
+                            )
+                        )
+                    )
+                    if self.range_log_topics is None
+                    else lambda: (
+                        [],
+                        self.export_logs(start_block, end_block, self.range_log_topics),
+                        [],
+                    )
+                ),
+                (TOKEN_TRANSFER,): lambda: self.extract_token_transfers(
+                    route_logs().receipt_logs_with_topics(ALL_TRANSFER_EVENT_TOPICS)
+                ),
                 (TOKEN_BALANCE, ERROR): lambda: self.export_token_balances(export(TOKEN_TRANSFER)),
                 (TRACE,): lambda: self.export_traces(start_block, end_block),
                 (GETH_TRACE,): lambda: self.export_geth_traces(
@@ -229,7 +268,9 @@ class EthStreamerAdapter:
                 (DEX_TRADE,): lambda: self.export_dex_trades(
                     export(PARSED_LOG), export(TOKEN), export(DEX_POOL), export(TOKEN_TRANSFER)
                 ),
-                (PARSED_LOG,): lambda: self.parse_logs(export(LOG)),
+                (PARSED_LOG,): lambda: self.parse_logs(
+                    route_logs().receipt_logs_with_topics(self.parsable_log_topics)
+                ),
                 (ENRICHED_DEX_TRADE, ENRICHED_TRANSFER): lambda: self.export_enriched_dex_trades(
                     export(DEX_TRADE),
                     export(DEX_POOL),
@@ -264,8 +305,9 @@ class EthStreamerAdapter:
 
         all_items: list[dict] = []
         items_by_type: dict[EntityType, list[dict]] = {}
+        enrich_index = EnrichIndex()
         for entity_type in self.entity_types:
-            enriched_items = self.enrich(entity_type, exported.__getitem__)
+            enriched_items = self.enrich(entity_type, exported.__getitem__, enrich_index)
             sorted_items = sort_by(enriched_items, self.SORT_BY_FIELDS[entity_type])
             items_by_type[entity_type] = sorted_items
             all_items.extend(sorted_items)
@@ -277,6 +319,71 @@ class EthStreamerAdapter:
 
         self.item_exporter.export_items(all_items)
 
+    @cached_property
+    def parsable_log_topics(self) -> frozenset[str]:
+        resolve_log_service = EthResolveLogService(
+            ThreadLocalProxy(lambda: build_web3(self.batch_web3_provider)), self.chain_id
+        )
+        return resolve_log_service.get_topics_for_events(PARSABLE_TRADE_EVENTS)
+
+    @cached_property
+    def needed_log_topics(self) -> frozenset[str] | None:
+        """
+        Topics of the logs needed by the requested entity types.
+
+        None if receipts and logs must be fetched for every transaction.
+        """
+        if self.entity_types & self.ALL_RECEIPTS_ENTITY_TYPES:
+            return None
+        topics: set[str] = set()
+        if TOKEN_TRANSFER in self.should_export:
+            topics.update(ALL_TRANSFER_EVENT_TOPICS)
+        if PARSED_LOG in self.should_export:
+            topics.update(self.parsable_log_topics)
+        return frozenset(topics)
+
+    @cached_property
+    def receipt_logs_bloom_filter(self) -> LogsBloomFilter | None:
+        """
+        Matches blocks which may contain logs needed by the requested entity types.
+
+        None if receipts must be fetched for every transaction.
+        """
+        if not self.selective_receipts or self.needed_log_topics is None:
+            return None
+        return LogsBloomFilter(self.needed_log_topics)
+
+    @cached_property
+    def range_log_topics(self) -> frozenset[str] | None:
+        """
+        Topics to fetch with ranged eth_getLogs instead of fetching receipts.
+
+        None if logs come from receipts.
+        """
+        if not self.logs_by_range:
+            return None
+        return self.needed_log_topics
+
+    def filter_transactions_by_logs_bloom(
+        self, blocks: Collection[dict], transactions: Collection[dict]
+    ) -> Collection[dict]:
+        bloom_filter = self.receipt_logs_bloom_filter
+        if bloom_filter is None:
+            return transactions
+        skipped_block_numbers = {
+            block['number']
+            for block in blocks
+            if not bloom_filter.may_match(block.get('logs_bloom'))
+        }
+        if not skipped_block_numbers:
+            return transactions
+        logger.debug(
+            'Skipping receipts of %i blocks by logs bloom out of %i',
+            len(skipped_block_numbers),
+            len(blocks),
+        )
+        return [t for t in transactions if t['block_number'] not in skipped_block_numbers]
+
     @cached_property
     def should_export(self) -> set[EntityType]:
         should_export: set[EntityType] = set()
@@ -292,12 +399,12 @@ class EthStreamerAdapter:
                 stack.append(enrich_with_type)
         return should_export
 
-    def enrich(self, entity_type, get_exported):
+    def enrich(self, entity_type, get_exported, index: EnrichIndex | None = None):
         enrich_with_type, enrich_func = self.ENRICH.get(entity_type, (None, None))
         if enrich_with_type is None or enrich_func is None:
             return get_exported(entity_type)
         enrich_with_items = get_exported(enrich_with_type)
-        return enrich_func(enrich_with_items, get_exported(entity_type))
+        return enrich_func(enrich_with_items, get_exported(entity_type), index)
 
     def log_batch_export_progress(
         self,
@@ -354,6 +461,22 @@ class EthStreamerAdapter:
         transactions = blocks_and_transactions_item_exporter.get_items(EntityType.TRANSACTION)
         return blocks, transactions
 
+    def export_block_headers(self, start_block, end_block) -> list[dict]:
+        """Blocks with transaction hashes only, much lighter to fetch than full blocks."""
+        exporter = InMemoryItemExporter(item_types=[EntityType.BLOCK])
+        job = ExportBlocksJob(
+            start_block=start_block,
+            end_block=end_block,
+            batch_size=self.batch_size,
+            batch_web3_provider=self.batch_web3_provider,
+            max_workers=self.max_workers,
+            item_exporter=exporter,
+            export_blocks=True,
+            export_transactions=False,
+        )
+        job.run()
+        return exporter.get_items(EntityType.BLOCK)
+
     def export_receipts_and_logs(self, transactions) -> tuple[list[dict], list[dict], list[dict]]:
         exporter = InMemoryItemExporter(
             item_types=(EntityType.RECEIPT, EntityType.LOG, EntityType.ERROR)
@@ -373,7 +496,22 @@ class EthStreamerAdapter:
         errors = exporter.get_items(EntityType.ERROR)
         return receipts, logs, errors
 
-    def extract_token_transfers(self, logs):
+    def export_logs(self, start_block, end_block, topics: Collection[str] | None = None):
+        exporter = InMemoryItemExporter(item_types=[EntityType.LOG])
+        job = ExportLogsJob(
+            start_block=start_block,
+            end_block=end_block,
+            batch_size=self.batch_size,
+            batch_web3_provider=self.batch_web3_provider,
+            max_workers=self.max_workers,
+            item_exporter=exporter,
+            topics=topics,
+        )
+        job.run()
+        logs = exporter.get_items(EntityType.LOG)
+        return logs
+
+    def extract_token_transfers(self, logs: Collection[dict | EthReceiptLog]):
         exporter = InMemoryItemExporter(item_types=[EntityType.TOKEN_TRANSFER])
         job = ExtractTokenTransfersJob(
             logs_iterable=logs,
@@ -541,8 +679,9 @@ class EthStreamerAdapter:
 
     def prepare_events(self, blocks, logs, token_transfers, transactions, receipts):
         exporter = InMemoryItemExporter(item_types=[EntityType.PRE_EVENT])
-        enriched_transfers = enrich_token_transfers(blocks, token_transfers)
-        enriched_transactions = enrich_transactions(transactions, receipts)
+        index = EnrichIndex()
+        enriched_transfers = enrich_token_transfers(blocks, token_transfers, index)
+        enriched_transactions = enrich_transactions(transactions, receipts, index)
         job = PrepareForEventsJob(
             logs=logs,
             token_transfers=enriched_transfers,
@@ -593,7 +732,7 @@ class EthStreamerAdapter:
         trades = exporter.get_items(DEX_TRADE)
         return trades
 
-    def parse_logs(self, logs: Collection[dict]) -> list[dict]:
+    def parse_logs(self, logs: Collection[dict | EthReceiptLog]) -> list[dict]:
         exporter = InMemoryItemExporter(item_types=[PARSED_LOG])
         job = ParseLogsJob(
             logs_iterable=logs,
@@ -663,6 +802,9 @@ class EthStreamerAdapter:
         for item in items:
             item['item_timestamp'] = self.item_timestamp_calculator.calculate(item)
 
+    def flush(self):
+        self.item_exporter.flush()
+
     def close(self):
         self.item_exporter.close()
         self.price_importer.close()
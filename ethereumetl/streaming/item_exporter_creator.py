@@ -77,7 +77,6 @@ def create_item_exporter(output, chain_id) -> BaseItemExporter:
             UnixTimestampItemConverter,
         )
         from blockchainetl.jobs.exporters.postgres_item_exporter import PostgresItemExporter
-        from blockchainetl.streaming.postgres_utils import create_insert_statement_for_table
         from ethereumetl.streaming.postgres_tables import (
             BLOCKS,
             CONTRACTS,
@@ -90,14 +89,14 @@ def create_item_exporter(output, chain_id) -> BaseItemExporter:
 
         item_exporter = PostgresItemExporter(
             output,
-            item_type_to_insert_stmt_mapping={
-                EntityType.BLOCK: create_insert_statement_for_table(BLOCKS),
-                EntityType.TRANSACTION: create_insert_statement_for_table(TRANSACTIONS),
-                EntityType.LOG: create_insert_statement_for_table(LOGS),
-                EntityType.TOKEN_TRANSFER: create_insert_statement_for_table(TOKEN_TRANSFERS),
-                EntityType.TRACE: create_insert_statement_for_table(TRACES),
-                EntityType.TOKEN: create_insert_statement_for_table(TOKENS),
-                EntityType.CONTRACT: create_insert_statement_for_table(CONTRACTS),
+            item_type_to_table_mapping={
+                EntityType.BLOCK: BLOCKS,
+                EntityType.TRANSACTION: TRANSACTIONS,
+                EntityType.LOG: LOGS,
+                EntityType.TOKEN_TRANSFER: TOKEN_TRANSFERS,
+                EntityType.TRACE: TRACES,
+                EntityType.TOKEN: TOKENS,
+                EntityType.CONTRACT: CONTRACTS,
             },
             converters=[
                 UnixTimestampItemConverter(),
@@ -0,0 +1,48 @@
+from collections import defaultdict
+from collections.abc import Iterable
+
+from ethereumetl.domain.receipt_log import EthReceiptLog
+from ethereumetl.mappers.receipt_log_mapper import EthReceiptLogMapper
+
+
+class LogDemultiplexer:
+    """
+    Routes the logs of one batch to the jobs consuming them.
+
+    Logs are bucketed by topic0 in a single pass and every bucket is mapped to
+    EthReceiptLog at most once, so each consumer walks only the logs it can handle.
+    """
+
+    def __init__(self, logs: Iterable[dict]):
+        self._receipt_log_mapper = EthReceiptLogMapper()
+        self._logs_by_topic0: dict[str, list[dict]] = defaultdict(list)
+        self._receipt_logs_by_topic0: dict[str, list[EthReceiptLog]] = {}
+        for log in logs:
+            topic0 = get_topic0(log)
+            if topic0 is not None:
+                self._logs_by_topic0[topic0].append(log)
+
+    def receipt_logs_with_topics(self, topics: Iterable[str]) -> list[EthReceiptLog]:
+        """The logs of every topic, topic by topic in the order given, each topic once."""
+        result: list[EthReceiptLog] = []
+        for topic in dict.fromkeys(topic.casefold() for topic in topics):
+            if topic not in self._logs_by_topic0:
+                continue
+            receipt_logs = self._receipt_logs_by_topic0.get(topic)
+            if receipt_logs is None:
+                receipt_logs = [
+                    self._receipt_log_mapper.dict_to_receipt_log(log)
+                    for log in self._logs_by_topic0[topic]
+                ]
+                self._receipt_logs_by_topic0[topic] = receipt_logs
+            result.extend(receipt_logs)
+        return result
+
+
+def get_topic0(log: dict) -> str | None:
+    topics = log.get('topics')
+    if isinstance(topics, str):
+        topics = topics.strip().split(',') if topics.strip() else []
+    if not topics:
+        return None
+    return topics[0].casefold()
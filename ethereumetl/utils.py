@@ -25,8 +25,9 @@ import itertools
 import json
 import threading
 import time
+import uuid
 import warnings
-from collections.abc import Collection
+from collections.abc import Collection, Iterable, Mapping, Sequence
 from datetime import datetime
 from functools import cache
 from pathlib import Path
@@ -36,6 +37,7 @@ from urllib.parse import parse_qs, urlparse
 import clickhouse_connect
 import pytz
 from clickhouse_connect.driver import Client
+from clickhouse_connect.driver.query import format_query_value
 
 from ethereumetl.config.envs import envs
 from ethereumetl.executors.batch_work_executor import BatchWorkExecutor
@@ -142,6 +144,17 @@ def split_to_batches(start_incl, end_incl, batch_size):
         yield batch_start, batch_end
 
 
+def consecutive_ranges(numbers: Iterable[int]) -> list[tuple[int, int]]:
+    """Inclusive ranges of consecutive numbers, e.g. [7, 1, 2, 3] -> [(1, 3), (7, 7)]."""
+    ranges: list[tuple[int, int]] = []
+    for number in sorted(set(numbers)):
+        if ranges and ranges[-1][1] == number - 1:
+            ranges[-1] = (ranges[-1][0], number)
+        else:
+            ranges.append((number, number))
+    return ranges
+
+
 def pairwise(iterable):
     """S -> (s0,s1), (s1,s2), (s2, s3), ..."""
     a, b = itertools.tee(iterable)
@@ -162,11 +175,12 @@ def timestamp_now() -> int:
     return int(datetime.now(tz=pytz.UTC).timestamp())
 
 
-def dedup_list_of_dicts(items_list: list) -> list:
+def dedup_list_of_dicts_by_key(items_list: list, key_fields: Sequence[str]) -> list:
+    """Keep the first dict for every primary key, e.g. ('transaction_hash', 'log_index')."""
     seen = set()
     new_l = []
     for d in items_list:
-        t = tuple(d.items())
+        t = tuple(d[f] for f in key_fields)
         if t not in seen:
             seen.add(t)
             new_l.append(d)
@@ -303,7 +317,50 @@ class Singleton(type):
 
 @cache
 def clickhouse_client_from_url(url) -> Client:
+    return create_clickhouse_client(url)
+
+
+def create_clickhouse_client(url) -> Client:
+    """New client, unlike `clickhouse_client_from_url`, for queries running concurrently."""
     connect_kwargs = parse_clickhouse_url(url)
     return clickhouse_connect.create_client(
         **connect_kwargs, compress=False, query_limit=0, send_receive_timeout=600
     )
+
+
+def clickhouse_query_with_keys(
+    client: Client, query: str, keys: Mapping[str, Collection[str | int]]
+) -> list[dict]:
+    """
+    Runs `query` with every `{name}` placeholder replaced by the set of `keys[name]`,
+    for filters like `token_address IN {tokens}`.
+
+    Small key sets are inlined as literals. Larger ones are loaded into temporary tables of the
+    client session, so ClickHouse doesn't parse them as SQL and the query stays under
+    `max_query_size`. As the sets are meant for `IN`, an empty one matches no rows.
+    """
+    if not all(keys.values()):
+        return []
+    key_sources = {}
+    temporary_tables = []
+    try:
+        for name, values in keys.items():
+            unique_values = sorted(set(values))
+            if len(unique_values) <= envs.CLICKHOUSE_INLINE_KEYS_MAX:
+                key_sources[name] = format_query_value(tuple(unique_values))
+                continue
+            table = f'_keys_{uuid.uuid4().hex}'
+            key_type = 'Int64' if all(isinstance(v, int) for v in unique_values) else 'String'
+            client.command(f'CREATE TEMPORARY TABLE {table} (key {key_type}) ENGINE = Memory')
+            temporary_tables.append(table)
+            client.raw_insert(
+                table,
+                ['key'],
+                '\n'.join(json.dumps({'key': value}) for value in unique_values),
+                fmt='JSONEachRow',
+            )
+            key_sources[name] = table
+        return list(client.query(query.format(**key_sources)).named_results())
+    finally:
+        for table in temporary_tables:
+            client.command(f'DROP TEMPORARY TABLE IF EXISTS {table}')
@@ -33,6 +33,12 @@ setup(
     keywords="ethereum",
     python_requires=">=3.10,<4",
     install_requires=read("requirements.txt").strip().split("\n"),
+    extras_require={
+        # Parquet output of export_all and *.zst compressed files
+        "parquet": ["pyarrow==25.0.1"],
+        "zstd": ["zstandard==0.25.0"],
+        "dev": ["pyarrow==25.0.1", "zstandard==0.25.0"],
+    },
     entry_points={
         "console_scripts": [
             "ethereumetl=ethereumetl.cli:cli",
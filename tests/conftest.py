@@ -107,6 +107,39 @@ def clickhouse_url() -> Generator[str, None, None]:
         cleanup(admin_client)
 
 
+@pytest.fixture
+def postgres_url() -> Generator[str, None, None]:
+    url = os.getenv('TEST_POSTGRES_URL')
+    assert url, 'TEST_POSTGRES_URL env var must be set'
+
+    from sqlalchemy import create_engine
+
+    from ethereumetl.streaming.postgres_tables import metadata
+
+    engine = create_engine(url)
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    yield url
+    metadata.drop_all(engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def gcs_bucket() -> Generator[str, None, None]:
+    emulator_host = os.getenv('TEST_GCS_EMULATOR_HOST')
+    assert emulator_host, 'TEST_GCS_EMULATOR_HOST env var must be set, e.g. http://localhost:4443'
+
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import storage
+
+    test_bucket_name = f'ethereum-etl-test-{randint(0, 999_999)}'
+    with mock.patch.dict(os.environ, {'STORAGE_EMULATOR_HOST': emulator_host}):
+        client = storage.Client(credentials=AnonymousCredentials(), project='test')
+        bucket = client.create_bucket(test_bucket_name)
+        yield test_bucket_name
+        bucket.delete(force=True)
+
+
 @pytest.fixture
 def elastic_url() -> Generator[str, None, None]:
     url = os.getenv('TEST_ELASTICSEARCH_URL')
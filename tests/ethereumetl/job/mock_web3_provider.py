@@ -21,6 +21,7 @@
 # SOFTWARE.
 
 
+import hashlib
 import json
 
 from web3 import IPCProvider
@@ -57,14 +58,15 @@ class MockWeb3OrWeb3Provider(IPCProvider):
         return json.loads(file_content)
 
 
+# keeps file names within the 255 bytes most file systems allow
+MAX_PARAMS_STR_LENGTH = 160
+
+
 def build_file_name(method, params):
-    return (
-        'web3_response.'
-        + method
-        + '_'
-        + '_'.join([param_to_str(param) for param in params])
-        + '.json'
-    )
+    params_str = '_'.join([param_to_str(param) for param in params])
+    if len(params_str) > MAX_PARAMS_STR_LENGTH:
+        params_str = hashlib.sha1(params_str.encode()).hexdigest()
+    return 'web3_response.' + method + '_' + params_str + '.json'
 
 
 def param_to_str(param):
@@ -1,8 +1,11 @@
+import json
+import threading
+from collections import defaultdict
 from unittest.mock import MagicMock
 
 import pytest
 
-from blockchainetl.jobs.exporters.amqp_exporter import AMQPItemExporter
+from blockchainetl.jobs.exporters.amqp_exporter import AMQPItemExporter, PublisherConfirms
 
 
 @pytest.fixture
@@ -23,3 +26,71 @@ def test_amqp_exporter(amqp_exporter):
     amqp_exporter.export_item({'type': 'block', 'number': 1})
     assert amqp_exporter._producer.publish.call_count == 3
     assert amqp_exporter._reopen.call_count == 2
+
+
+def test_amqp_exporter_batches_items_and_waits_for_confirms(amqp_exporter):
+    channel = MagicMock()
+    channel.events = defaultdict(set)
+    amqp_exporter._confirms = PublisherConfirms(channel)
+    amqp_exporter._max_message_bytes = 70
+
+    def drain_events(timeout):
+        for callback in channel.events['basic_ack']:
+            callback(amqp_exporter._confirms.delivery_tag, True)
+
+    amqp_exporter._connection.drain_events.side_effect = drain_events
+
+    amqp_exporter.export_items([{'type': 'block', 'number': number} for number in range(3)])
+
+    bodies = [call.args[0] for call in amqp_exporter._producer.publish.call_args_list]
+    assert [json.loads(body) for body in bodies] == [
+        [{'type': 'block', 'number': 0}, {'type': 'block', 'number': 1}],
+        [{'type': 'block', 'number': 2}],
+    ]
+    assert amqp_exporter._connection.drain_events.call_count == 1
+    assert not amqp_exporter._confirms.unconfirmed
+
+
+def open_producer_in_thread(exporter) -> MagicMock:
+    """Gives a producer to another thread, like open() does for every publishing thread."""
+    producers = []
+
+    def open_producer():
+        exporter._producer = MagicMock()
+        exporter._producers.append(exporter._producer)
+        producers.append(exporter._producer)
+
+    thread = threading.Thread(target=open_producer)
+    thread.start()
+    thread.join()
+    return producers[0]
+
+
+def test_amqp_exporter_reopens_only_the_channel_of_the_failed_thread(amqp_exporter):
+    amqp_exporter._connection.connected = True
+    amqp_exporter._producers.append(amqp_exporter._producer)
+    failed_producer = amqp_exporter._producer
+    other_producer = open_producer_in_thread(amqp_exporter)
+    amqp_exporter.open = MagicMock()
+
+    amqp_exporter._reopen()
+
+    failed_producer.channel.close.assert_called_once()
+    other_producer.channel.close.assert_not_called()
+    amqp_exporter._connection.close.assert_not_called()
+    assert amqp_exporter._producers == [other_producer]
+    amqp_exporter.open.assert_called_once()
+
+
+def test_amqp_exporter_reopens_broken_connection(amqp_exporter):
+    connection = amqp_exporter._connection
+    connection.connected = False
+    amqp_exporter._producers.append(amqp_exporter._producer)
+    open_producer_in_thread(amqp_exporter)
+    amqp_exporter.open = MagicMock()
+
+    amqp_exporter._reopen()
+
+    connection.close.assert_called_once()
+    assert amqp_exporter._producers == []
+    amqp_exporter.open.assert_called_once()
@@ -0,0 +1,43 @@
+import pytest
+
+from blockchainetl.jobs.exporters.buffered_writer import BufferedWriter
+
+
+class ListBuffer:
+    """Buffers batches and writes them when forced, failing when told to."""
+
+    def __init__(self):
+        self.buffered: list = []
+        self.written: list = []
+        self.error: Exception | None = None
+
+    def write(self, batch, force):
+        if batch is not None:
+            self.buffered.extend(batch)
+        if force:
+            if self.error is not None:
+                error, self.error = self.error, None
+                self.buffered = []
+                raise error
+            self.written.extend(self.buffered)
+            self.buffered = []
+
+
+def test_buffered_writer_flush_writes_queued_batches_and_raises_errors_once():
+    buffer = ListBuffer()
+    writer = BufferedWriter('test-writer', buffer.write, lambda: None, queue_size=1)
+    writer.start()
+
+    writer.put([1, 2])
+    writer.flush()
+    assert buffer.written == [1, 2]
+
+    buffer.error = ConnectionError('sink is down')
+    writer.put([3])
+    with pytest.raises(ConnectionError):
+        writer.flush()
+
+    writer.put([4])
+    writer.close()
+    assert buffer.written == [1, 2, 4]
+    assert writer.thread is None
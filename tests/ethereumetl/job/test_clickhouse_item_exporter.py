@@ -0,0 +1,236 @@
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+from clickhouse_connect.datatypes.registry import get_from_name
+from clickhouse_connect.driver.exceptions import OperationalError
+
+from blockchainetl.jobs.exporters import clickhouse_exporter
+from blockchainetl.jobs.exporters.clickhouse_exporter import (
+    ClickHouseItemExporter,
+    Table,
+    TableBuffer,
+)
+
+
+class RecordingInsert:
+    """Replaces ClickHouseItemExporter._insert, records the rows and can block or fail."""
+
+    def __init__(self):
+        self.rows_by_table: dict[str, list[tuple]] = {}
+        self.called = threading.Event()
+        self.inserted = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        self.error: Exception | None = None
+
+    def __call__(self, column_names, column_types, table, columns, chunk='0'):
+        self.called.set()
+        assert self.release.wait(timeout=5)
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        self.rows_by_table.setdefault(table, []).extend(zip(*columns))
+        self.inserted.set()
+
+
+def make_exporter(monkeypatch, min_insert_batch_size=1, max_bytes=10**9, max_age_seconds=60.0):
+    monkeypatch.setattr(clickhouse_exporter, 'MIN_INSERT_BATCH_SIZE', min_insert_batch_size)
+    monkeypatch.setattr(clickhouse_exporter, 'INSERT_MAX_BYTES', max_bytes)
+    monkeypatch.setattr(clickhouse_exporter, 'INSERT_MAX_AGE_SECONDS', max_age_seconds)
+    exporter = ClickHouseItemExporter('clickhouse://default:@localhost:8123/ethereum')
+    exporter.tables = {
+        'blocks': Table(
+            ['number', 'hash', 'is_reorged'],
+            [get_from_name('UInt64'), get_from_name('String'), get_from_name('Bool')],
+        ),
+        'logs': Table(
+            ['block_number', 'data'], [get_from_name('UInt64'), get_from_name('String')]
+        ),
+    }
+    exporter.buffers = {table: TableBuffer() for table in exporter.tables}
+    insert = RecordingInsert()
+    exporter._insert = insert
+    exporter._start_writer()
+    return exporter, insert
+
+
+def block(number, hash_='0x'):
+    return {'type': 'block', 'number': number, 'hash': hash_}
+
+
+@pytest.fixture()
+def close_exporters():
+    exporters = []
+    yield exporters.append
+    for exporter in exporters:
+        exporter._insert.release.set()
+        exporter.close()
+
+
+def test_items_to_columns():
+    exporter = ClickHouseItemExporter('clickhouse://default:@localhost:8123/ethereum')
+    exporter.tables = {'blocks': Table(['number', 'hash', 'is_reorged'], [])}
+
+    columns = exporter.items_to_columns('blocks', [block(1, '0x1'), {'number': 2, 'extra': 1}])
+
+    assert columns == [[1, 2], ['0x1', None], [False, False]]
+
+
+def test_insert_tables_inserts_column_oriented_with_a_client_per_thread():
+    exporter = ClickHouseItemExporter('clickhouse://default:@localhost:8123/ethereum')
+    exporter.tables = {
+        'blocks': Table(['number', 'hash'], [get_from_name('UInt64'), get_from_name('String')]),
+        'logs': Table(['block_number'], [get_from_name('UInt64')]),
+    }
+    both_inserting = threading.Barrier(2, timeout=5)
+    clients = []
+
+    def create_connection():
+        client = MagicMock()
+        client.insert.side_effect = lambda *args, **kwargs: both_inserting.wait()
+        clients.append(client)
+        return client
+
+    exporter.create_connection = create_connection
+    exporter._start_writer()
+    try:
+        exporter.insert_tables({'blocks': [block(1, '0x1')], 'logs': [{'block_number': 1}]})
+    finally:
+        exporter.close()
+
+    # both tables were inserted at the same time, each from its own client
+    assert len(clients) == 2
+    inserts = {client.insert.call_args.args[0]: client.insert.call_args for client in clients}
+    assert inserts['blocks'].kwargs['data'] == [[1], ['0x1']]
+    assert inserts['blocks'].kwargs['column_oriented'] is True
+    assert inserts['logs'].kwargs['data'] == [[1]]
+    assert all(client.close.called for client in clients)
+
+
+def test_rows_are_buffered_until_min_insert_batch_size(monkeypatch, close_exporters):
+    exporter, insert = make_exporter(monkeypatch, min_insert_batch_size=3)
+    close_exporters(exporter)
+
+    exporter.export_items([block(1), block(2)])
+    assert not insert.inserted.wait(timeout=0.2)
+
+    exporter.export_items([block(3)])
+    assert insert.inserted.wait(timeout=5)
+    assert [row[0] for row in insert.rows_by_table['blocks']] == [1, 2, 3]
+
+
+def test_rows_are_inserted_when_buffer_reaches_max_bytes(monkeypatch, close_exporters):
+    exporter, insert = make_exporter(monkeypatch, min_insert_batch_size=1000, max_bytes=100)
+    close_exporters(exporter)
+
+    exporter.export_items([block(1, '0x1')])
+    assert not insert.inserted.wait(timeout=0.2)
+
+    exporter.export_items([block(2, '0x' + 'a' * 100)])
+    assert insert.inserted.wait(timeout=5)
+    assert len(insert.rows_by_table['blocks']) == 2
+
+
+def test_rows_are_inserted_when_buffer_reaches_max_age(monkeypatch, close_exporters):
+    exporter, insert = make_exporter(monkeypatch, min_insert_batch_size=1000, max_age_seconds=0.2)
+    close_exporters(exporter)
+
+    exporter.export_items([block(1)])
+
+    assert insert.inserted.wait(timeout=5)
+    assert len(insert.rows_by_table['blocks']) == 1
+
+
+def test_flush_inserts_buffered_rows(monkeypatch, close_exporters):
+    exporter, insert = make_exporter(monkeypatch, min_insert_batch_size=1000)
+    close_exporters(exporter)
+
+    exporter.export_items([block(1), {'type': 'log', 'block_number': 1, 'data': '0x'}])
+    exporter.flush()
+
+    assert len(insert.rows_by_table['blocks']) == 1
+    assert len(insert.rows_by_table['logs']) == 1
+
+
+def test_full_insert_queue_blocks_export(monkeypatch, close_exporters):
+    exporter, insert = make_exporter(monkeypatch)
+    close_exporters(exporter)
+    insert.release.clear()
+
+    # one batch is being inserted, the queue holds CLICKHOUSE_INSERT_QUEUE_SIZE more
+    exporter.export_items([block(0)])
+    assert insert.called.wait(timeout=5)
+    for number in range(1, exporter.writer.queue.maxsize + 1):
+        exporter.export_items([block(number)])
+    exported = threading.Event()
+    thread = threading.Thread(
+        target=lambda: (exporter.export_items([block(100)]), exported.set()), daemon=True
+    )
+    thread.start()
+    assert not exported.wait(timeout=0.2)
+
+    insert.release.set()
+    assert exported.wait(timeout=5)
+    exporter.flush()
+    assert len(insert.rows_by_table['blocks']) == exporter.writer.queue.maxsize + 2
+
+
+def test_insert_error_is_raised_by_flush_and_writer_recovers(monkeypatch, close_exporters):
+    exporter, insert = make_exporter(monkeypatch)
+    close_exporters(exporter)
+    insert.error = ConnectionError('ClickHouse is down')
+
+    exporter.export_items([block(1)])
+    with pytest.raises(ConnectionError):
+        exporter.flush()
+
+    # the error is raised once, later batches are inserted by the same writer
+    exporter.export_items([block(2)])
+    exporter.flush()
+    assert [row[0] for row in insert.rows_by_table['blocks']] == [2]
+    assert exporter.writer.thread.is_alive()
+
+
+def test_insert_timeout_retries_the_same_chunks_with_the_same_tokens(monkeypatch):
+    monkeypatch.setattr(clickhouse_exporter, 'INSERT_CHUNK_ROWS', 2)
+    exporter = ClickHouseItemExporter('clickhouse://default:@localhost:8123/ethereum')
+    client = MagicMock()
+    client.insert.side_effect = [None, OperationalError('timed out'), None]
+    exporter.create_connection = lambda: client
+    column_names = ['number', 'hash']
+    column_types = [get_from_name('UInt64'), get_from_name('String')]
+
+    exporter._insert(column_names, column_types, 'blocks', [[1, 2, 3], ['0x1', '0x2', '0x3']])
+
+    # chunks [1, 2] and [3], the timed out chunk is sent again unchanged
+    inserts = [call.kwargs for call in client.insert.call_args_list]
+    assert [insert['data'] for insert in inserts] == [
+        [[1, 2], ['0x1', '0x2']],
+        [[3], ['0x3']],
+        [[3], ['0x3']],
+    ]
+    tokens = [insert['settings']['insert_deduplication_token'] for insert in inserts]
+    assert tokens[1] == tokens[2]
+    assert tokens[0] != tokens[1]
+
+
+def test_rewritten_blocks_are_inserted_with_a_token_of_the_rewrite():
+    exporter = ClickHouseItemExporter('clickhouse://default:@localhost:8123/ethereum')
+    client = MagicMock()
+    exporter.create_connection = lambda: client
+    column_names = ['block_number', 'data']
+    column_types = [get_from_name('UInt64'), get_from_name('String')]
+
+    def insert_token():
+        exporter._insert(column_names, column_types, 'logs', [[1, 2], ['0x', '0x']])
+        return client.insert.call_args.kwargs['settings']['insert_deduplication_token']
+
+    exported = insert_token()
+    # the chain switched back, the same rows are exported again
+    exporter.rewrite_blocks([2, 3])
+    rewritten = insert_token()
+    assert rewritten != exported
+    assert insert_token() == rewritten
+    exporter.rewrite_blocks([2])
+    assert insert_token() not in (exported, rewritten)
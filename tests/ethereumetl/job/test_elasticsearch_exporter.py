@@ -0,0 +1,89 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from blockchainetl.jobs.exporters.elasticsearch_exporter import (
+    AdaptiveChunkSize,
+    ElasticsearchItemExporter,
+)
+
+
+def test_adaptive_chunk_size():
+    chunk_size = AdaptiveChunkSize(initial=100, minimum=10, maximum=120, target_latency_seconds=1)
+
+    chunk_size.observe(0.5, rejected=False)
+    assert chunk_size.size == 120
+    chunk_size.observe(2, rejected=False)
+    assert chunk_size.size == 60
+    chunk_size.observe(0.5, rejected=True)
+    assert chunk_size.size == 30
+    assert [len(chunk) for chunk in chunk_size.split([{}] * 70)] == [30, 30, 10]
+
+
+def test_elasticsearch_exporter_retries_only_rejected_documents():
+    exporter = ElasticsearchItemExporter('http://localhost:9200', {'transfer': 'transactions'})
+    exporter.client = MagicMock()
+    exporter.bulk_executor = ThreadPoolExecutor(1)
+    sent_ids = []
+
+    def bulk(operations):
+        ids = [operation['index']['_id'] for operation in operations[::2]]
+        sent_ids.append(ids)
+        statuses = [429 if id_ == 'b' and len(sent_ids) == 1 else 201 for id_ in ids]
+        return {'errors': 429 in statuses, 'items': [{'index': {'status': s}} for s in statuses]}
+
+    exporter.client.bulk.side_effect = bulk
+    exporter._buffer_actions(
+        [{'_index': 'transactions', '_id': id_, '_source': {'id': id_}} for id_ in ('a', 'b', 'c')]
+    )
+    with patch('blockchainetl.jobs.exporters.elasticsearch_exporter.time.sleep') as sleep:
+        exporter._flush_bulk_data()
+
+    assert sent_ids == [['a', 'b', 'c'], ['b']]
+    sleep.assert_called_once_with(1)
+    assert not exporter.buffer.actions
+    exporter.bulk_executor.shutdown()
+
+
+def start_exporter() -> ElasticsearchItemExporter:
+    exporter = ElasticsearchItemExporter('http://localhost:9200', {'transfer': 'transactions'})
+    exporter.client = MagicMock()
+    exporter.client.bulk.return_value = {'errors': False, 'items': []}
+    exporter.bulk_executor = ThreadPoolExecutor(1)
+    exporter.writer.start()
+    return exporter
+
+
+def transfer(id_):
+    return {'type': 'transfer', 'id': id_}
+
+
+def test_elasticsearch_exporter_flush_waits_for_buffered_documents():
+    exporter = start_exporter()
+    client = exporter.client
+
+    exporter.export_items([transfer('a'), transfer('b')])
+    exporter.flush()
+
+    operations = client.bulk.call_args.kwargs['operations']
+    assert [operation['index']['_id'] for operation in operations[::2]] == ['a', 'b']
+    exporter.close()
+
+
+def test_elasticsearch_exporter_error_is_raised_by_flush_and_writer_recovers():
+    exporter = start_exporter()
+    client = exporter.client
+    client.bulk.side_effect = [RuntimeError('cluster is down'), {'errors': False, 'items': []}]
+
+    exporter.export_items([transfer('a')])
+    with pytest.raises(RuntimeError):
+        exporter.flush()
+
+    # the error is raised once, later documents are indexed by the same writer
+    exporter.export_items([transfer('b')])
+    exporter.flush()
+    operations = client.bulk.call_args.kwargs['operations']
+    assert [operation['index']['_id'] for operation in operations[::2]] == ['b']
+    assert exporter.writer.thread.is_alive()
+    exporter.close()
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from blockchainetl.jobs.exporters.in_memory_item_exporter import InMemoryItemExporter
+from ethereumetl.enumeration.entity_type import EntityType
+from ethereumetl.get_logs import get_logs_in_range
+from ethereumetl.jobs.export_logs_job import ExportLogsJob
+
+TRANSFER_TOPIC = '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
+
+
+class RangeLimitedBatchWeb3Provider:
+    """Serves one log per block and refuses eth_getLogs ranges wider than `max_blocks`."""
+
+    def __init__(self, max_blocks):
+        self.max_blocks = max_blocks
+        self.requests = []
+
+    def make_batch_request(self, text):
+        responses = []
+        for request in json.loads(text):
+            assert request['method'] == 'eth_getLogs'
+            (filter_params,) = request['params']
+            self.requests.append(filter_params)
+            from_block = int(filter_params['fromBlock'], 16)
+            to_block = int(filter_params['toBlock'], 16)
+            if to_block - from_block + 1 > self.max_blocks:
+                error = {'code': -32005, 'message': 'query returned more than 10000 results'}
+                responses.append({'jsonrpc': '2.0', 'id': request['id'], 'error': error})
+                continue
+            logs = [
+                {
+                    'address': '0x00000000000000000000000000000000000000aa',
+                    'blockHash': hex(block_number),
+                    'blockNumber': hex(block_number),
+                    'data': '0x',
+                    'logIndex': '0x0',
+                    'removed': False,
+                    'topics': [TRANSFER_TOPIC],
+                    'transactionHash': hex(block_number),
+                    'transactionIndex': '0x0',
+                }
+                for block_number in range(from_block, to_block + 1)
+            ]
+            responses.append({'jsonrpc': '2.0', 'id': request['id'], 'result': logs})
+        return responses
+
+
+def test_get_logs_in_range_splits_rejected_ranges():
+    calls = []
+
+    def get_logs(from_block, to_block):
+        calls.append((from_block, to_block))
+        if to_block - from_block + 1 > 2:
+            raise ValueError('query returned more than 10000 results')
+        return list(range(from_block, to_block + 1))
+
+    assert get_logs_in_range(get_logs, 1, 5) == [1, 2, 3, 4, 5]
+    assert calls == [(1, 5), (1, 3), (1, 2), (3, 3), (4, 5)]
+
+
+def test_get_logs_in_range_raises_other_errors():
+    def get_logs(from_block, to_block):
+        raise ValueError('invalid argument 0: hex string without 0x prefix')
+
+    with pytest.raises(ValueError, match='hex string'):
+        get_logs_in_range(get_logs, 1, 5)
+
+
+def test_export_logs_job():
+    provider = RangeLimitedBatchWeb3Provider(max_blocks=3)
+    exporter = InMemoryItemExporter(item_types=[EntityType.LOG])
+    job = ExportLogsJob(
+        start_block=10,
+        end_block=19,
+        batch_size=10,
+        batch_web3_provider=provider,
+        max_workers=1,
+        item_exporter=exporter,
+        topics=[TRANSFER_TOPIC],
+    )
+    job.run()
+
+    logs = exporter.get_items(EntityType.LOG)
+    assert sorted(log['block_number'] for log in logs) == list(range(10, 20))
+    assert logs[0]['type'] == 'log'
+    assert logs[0]['topics'] == [TRANSFER_TOPIC]
+    assert all(params['topics'] == [[TRANSFER_TOPIC]] for params in provider.requests)
@@ -0,0 +1,113 @@
+import gzip
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+pytest.importorskip('google.cloud.storage')
+
+from blockchainetl.jobs.exporters import gcs_item_exporter  # noqa: E402
+from blockchainetl.jobs.exporters.gcs_item_exporter import GcsItemExporter  # noqa: E402
+
+
+def test_gcs_item_exporter_uploads_bundles_and_manifest(gcs_bucket):
+    exporter = GcsItemExporter(bucket=gcs_bucket, path='blocks', bundle_blocks=2, compress=True)
+    exporter.open()
+    exporter.export_items(
+        [{'type': 'block', 'number': number} for number in range(1, 4)]
+        + [{'type': 'transaction', 'block_number': 2, 'hash': '0x2'}]
+    )
+    exporter.close()
+
+    bucket = exporter.storage_client.bucket(gcs_bucket)
+    manifest = sorted(
+        (
+            json.loads(blob.download_as_bytes())
+            for blob in bucket.list_blobs(prefix='blocks/manifest/')
+        ),
+        key=lambda entry: entry['first_block_number'],
+    )
+    assert [(e['first_block_number'], e['last_block_number']) for e in manifest] == [
+        (1, 1),
+        (2, 3),
+    ]
+    assert manifest[1]['object'] == 'blocks/000000000002-000000000003.json.gz'
+
+    lines = gzip.decompress(bucket.blob(manifest[1]['object']).download_as_bytes()).splitlines()
+    bundles = [json.loads(line) for line in lines]
+    assert [bundle['block']['number'] for bundle in bundles] == [2, 3]
+    assert bundles[0]['transactions'] == [
+        {'type': 'transaction', 'block_number': 2, 'hash': '0x2'}
+    ]
+
+
+class FakeBlob:
+    def __init__(self, objects: dict, name: str):
+        self.objects = objects
+        self.name = name
+
+    def exists(self):
+        return self.name in self.objects
+
+    def download_as_bytes(self):
+        return self.objects[self.name]
+
+    def upload_from_string(self, data, content_type=None):
+        if self.name.startswith('fail/'):
+            raise ConnectionError('GCS is down')
+        self.objects[self.name] = data.encode() if isinstance(data, str) else data
+
+
+def make_exporter(monkeypatch, path='blocks', **kwargs) -> tuple[GcsItemExporter, dict]:
+    monkeypatch.setattr(gcs_item_exporter.storage, 'Client', MagicMock())
+    exporter = GcsItemExporter(bucket='bucket', path=path, **kwargs)
+    objects: dict[str, bytes] = {}
+    exporter.storage_bucket.blob.side_effect = lambda name: FakeBlob(objects, name)
+    exporter.open()
+    return exporter, objects
+
+
+def blocks(*numbers):
+    return [{'type': 'block', 'number': number} for number in numbers]
+
+
+def test_gcs_item_exporter_uploads_an_object_per_block_by_default(monkeypatch):
+    exporter, objects = make_exporter(monkeypatch)
+
+    exporter.export_items(blocks(1, 2))
+    exporter.close()
+
+    assert sorted(objects) == ['blocks/1.json', 'blocks/2.json']
+    assert json.loads(objects['blocks/1.json'])['block'] == {'type': 'block', 'number': 1}
+
+
+def test_gcs_item_exporter_flushed_window_keeps_blocks_uploaded_before(monkeypatch):
+    exporter, objects = make_exporter(monkeypatch, bundle_blocks=4)
+
+    exporter.export_items(blocks(4, 5))
+    exporter.flush()
+    assert sorted(objects) == [
+        'blocks/000000000004-000000000007.json',
+        'blocks/manifest/000000000004-000000000007.json',
+    ]
+
+    # restarted from block 5, the window is overwritten with blocks 4 to 6
+    restarted, _ = make_exporter(monkeypatch, bundle_blocks=4)
+    restarted.storage_bucket.blob.side_effect = lambda name: FakeBlob(objects, name)
+    restarted.export_items(blocks(5, 6))
+    restarted.close()
+
+    lines = objects['blocks/000000000004-000000000007.json'].splitlines()
+    assert [json.loads(line)['block']['number'] for line in lines] == [4, 5, 6]
+    manifest = json.loads(objects['blocks/manifest/000000000004-000000000007.json'])
+    assert (manifest['first_block_number'], manifest['last_block_number']) == (4, 6)
+
+
+def test_gcs_item_exporter_flush_raises_upload_errors(monkeypatch):
+    exporter, _objects = make_exporter(monkeypatch, path='fail')
+
+    exporter.export_items(blocks(1))
+    with pytest.raises(ConnectionError):
+        exporter.flush()
+    assert not exporter.uploads
+    exporter.close()
@@ -0,0 +1,64 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from blockchainetl.jobs.exporters.kafka_exporter import (
+    KafkaItemExporter,
+    block_number_partition_key,
+)
+
+
+@pytest.fixture
+def kafka_exporter():
+    with patch('blockchainetl.jobs.exporters.kafka_exporter.KafkaProducer'):
+        exporter = KafkaItemExporter(
+            'kafka/127.0.0.1:9092',
+            item_type_to_topic_mapping={'block': 'blocks', 'transaction': 'transactions'},
+            partition_key_callable=block_number_partition_key,
+        )
+    return exporter
+
+
+def test_kafka_exporter_sends_keyed_batch(kafka_exporter):
+    kafka_exporter.export_items(
+        [
+            {'type': 'block', 'number': 1},
+            {'type': 'transaction', 'block_number': 1, 'hash': '0x1'},
+            {'type': 'log', 'block_number': 1},
+        ]
+    )
+
+    sends = kafka_exporter.producer.send.call_args_list
+    assert [(call.args[0], call.kwargs['key']) for call in sends] == [
+        ('blocks', b'1'),
+        ('transactions', b'1'),
+    ]
+    kafka_exporter.producer.flush.assert_called_once()
+
+
+def test_kafka_exporter_raises_on_delivery_errors(kafka_exporter):
+    def send(topic, value, key):
+        future = MagicMock()
+        future.add_errback.side_effect = lambda errback: errback(TimeoutError('no leader'))
+        return future
+
+    kafka_exporter.producer.send.side_effect = send
+
+    with pytest.raises(RuntimeError, match='2 Kafka records were not delivered'):
+        kafka_exporter.export_items(
+            [{'type': 'block', 'number': 1}, {'type': 'block', 'number': 2}]
+        )
+
+    kafka_exporter.export_items([])
+
+
+def test_kafka_exporter_leaves_partitioning_to_the_producer_by_default():
+    with patch('blockchainetl.jobs.exporters.kafka_exporter.KafkaProducer') as producer_class:
+        exporter = KafkaItemExporter('kafka/127.0.0.1:9092', {'block': 'blocks'})
+
+    assert producer_class.call_args.kwargs['compression_type'] is None
+    exporter.export_items([{'type': 'block', 'number': 1}])
+    assert exporter.producer.send.call_args.kwargs['key'] is None
+
+    exporter.close()
+    exporter.producer.close.assert_called_once()
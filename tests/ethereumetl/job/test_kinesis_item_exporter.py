@@ -0,0 +1,93 @@
+import hashlib
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+pytest.importorskip('boto3')
+
+from blockchainetl.jobs.exporters.kinesis_item_exporter import (  # noqa: E402
+    KinesisItemExporter,
+    aggregate_records,
+)
+
+
+def test_aggregate_records():
+    records = aggregate_records([('1', b'a'), ('2', b'b'), ('1', b'c')])
+
+    assert [record['PartitionKey'] for record in records] == ['1', '2']
+    data = records[0]['Data']
+    assert data[:4] == b'\xf3\x89\x9a\xc2'
+    message = data[4:-16]
+    assert hashlib.md5(message).digest() == data[-16:]
+    # partition key table ['1'], records with data b'a' and b'c'
+    assert message == b'\n\x011' + b'\x1a\x05\x08\x00\x1a\x01a' + b'\x1a\x05\x08\x00\x1a\x01c'
+
+
+def make_exporter(**kwargs) -> tuple[KinesisItemExporter, MagicMock]:
+    exporter = KinesisItemExporter('stream', **kwargs)
+    with patch('blockchainetl.jobs.exporters.kinesis_item_exporter.boto3'):
+        exporter.open()
+    client = exporter._kinesis_client = MagicMock()
+    return exporter, client
+
+
+def test_kinesis_exporter_puts_a_json_record_per_item_by_default():
+    exporter, client = make_exporter()
+    client.put_records.return_value = {'FailedRecordCount': 0}
+
+    exporter.export_items([{'type': 'block', 'number': 1}])
+    exporter.close()
+
+    (record,) = client.put_records.call_args.kwargs['Records']
+    assert json.loads(record['Data']) == {'type': 'block', 'number': 1}
+    assert len(record['PartitionKey']) == 32
+
+
+def test_kinesis_exporter_retries_failed_records_in_order():
+    exporter, client = make_exporter(partition_key='block_number', max_workers=1)
+    client.put_records.side_effect = [
+        {
+            'FailedRecordCount': 1,
+            'Records': [
+                {'ErrorCode': 'ProvisionedThroughputExceededException', 'ErrorMessage': 'slow'},
+                {'SequenceNumber': '1'},
+                {'SequenceNumber': '2'},
+            ],
+        },
+        {'FailedRecordCount': 0, 'Records': [{'SequenceNumber': '3'}, {'SequenceNumber': '4'}]},
+    ]
+
+    with patch('blockchainetl.jobs.exporters.kinesis_item_exporter.time.sleep'):
+        exporter.export_items(
+            [
+                {'type': 'transaction', 'block_number': 2, 'hash': '0x1'},
+                {'type': 'block', 'number': 1},
+                {'type': 'transaction', 'block_number': 2, 'hash': '0x2'},
+            ]
+        )
+    exporter.close()
+
+    calls = client.put_records.call_args_list
+    assert [r['PartitionKey'] for r in calls[0].kwargs['Records']] == ['2', '1', '2']
+    # the record accepted after the failed one of its key is resent after it
+    retried = [json.loads(r['Data'])['hash'] for r in calls[1].kwargs['Records']]
+    assert retried == ['0x1', '0x2']
+
+
+def test_kinesis_exporter_sends_a_partition_key_by_one_lane():
+    exporter, client = make_exporter(partition_key='block_number', aggregate=True, max_workers=4)
+    client.put_records.return_value = {'FailedRecordCount': 0}
+
+    exporter.export_items([{'type': 'transaction', 'block_number': n % 3} for n in range(30)])
+    exporter.close()
+
+    requests = [call.kwargs['Records'] for call in client.put_records.call_args_list]
+    for records in requests:
+        assert all(record['Data'][:4] == b'\xf3\x89\x9a\xc2' for record in records)
+    assert sorted(r['PartitionKey'] for records in requests for r in records) == ['0', '1', '2']
+
+
+def test_kinesis_exporter_rejects_unknown_partition_key():
+    with pytest.raises(ValueError):
+        KinesisItemExporter('stream', partition_key='hash')
@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+from blockchainetl.jobs.exporters.in_memory_item_exporter import InMemoryItemExporter
+from blockchainetl.jobs.exporters.multi_item_exporter import MultiItemExporter
+
+
+class BlockingItemExporter(InMemoryItemExporter):
+    """Exports only after `release` is set."""
+
+    def __init__(self, item_types):
+        super().__init__(item_types)
+        self.release = threading.Event()
+
+    def export_items(self, items):
+        assert self.release.wait(timeout=5)
+        super().export_items(items)
+
+
+class FailingItemExporter(InMemoryItemExporter):
+    def export_items(self, items):
+        raise ConnectionError('sink is down')
+
+
+def test_multi_item_exporter_flush_waits_for_every_exporter():
+    slow = BlockingItemExporter(item_types=['block'])
+    fast = InMemoryItemExporter(item_types=['block'])
+    exporter = MultiItemExporter([slow, fast], queue_size=2)
+    exporter.open()
+
+    # batches are queued, not waited for
+    exporter.export_items([{'type': 'block', 'number': 1}])
+    exporter.export_items([{'type': 'block', 'number': 2}])
+
+    flushed = threading.Event()
+    thread = threading.Thread(target=lambda: (exporter.flush(), flushed.set()))
+    thread.start()
+    assert not flushed.wait(timeout=0.2)
+
+    slow.release.set()
+    assert flushed.wait(timeout=5)
+    thread.join()
+    exporter.close()
+
+    assert (
+        slow.get_items('block')
+        == fast.get_items('block')
+        == [
+            {'type': 'block', 'number': 1},
+            {'type': 'block', 'number': 2},
+        ]
+    )
+
+
+def test_multi_item_exporter_flush_raises_exporter_errors():
+    healthy = InMemoryItemExporter(item_types=['block'])
+    exporter = MultiItemExporter([healthy, FailingItemExporter(item_types=['block'])])
+    exporter.open()
+
+    exporter.export_items([{'type': 'block', 'number': 1}])
+    with pytest.raises(ConnectionError, match='sink is down'):
+        exporter.flush()
+    # the error is raised once
+    exporter.flush()
+    exporter.close()
+
+    assert healthy.get_items('block') == [{'type': 'block', 'number': 1}]
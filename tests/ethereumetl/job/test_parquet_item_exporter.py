@@ -0,0 +1,58 @@
+import pytest
+
+pq = pytest.importorskip('pyarrow.parquet')
+
+from ethereumetl.jobs.export_all_common import extract_csv_column_unique  # noqa: E402
+from ethereumetl.jobs.exporters.receipts_and_logs_item_exporter import (  # noqa: E402
+    receipts_and_logs_item_exporter,
+)
+
+
+def test_parquet_item_exporter_writes_row_groups(tmp_path):
+    receipts_file = tmp_path / 'receipts' / 'block_date=2023-01-01' / 'receipts_0_1.parquet'
+    logs_file = tmp_path / 'logs' / 'block_date=2023-01-01' / 'logs_0_1.parquet'
+    exporter = receipts_and_logs_item_exporter(str(receipts_file), str(logs_file))
+    exporter.open()
+    exporter.exporter_mapping['log'].row_group_size = 2
+    for log_index in range(5):
+        exporter.export_item(
+            {
+                'type': 'log',
+                'log_index': log_index,
+                'transaction_hash': '0xabc',
+                'transaction_index': 0,
+                'block_hash': '0xdef',
+                'block_number': 1,
+                'address': '0x1',
+                'data': '0x',
+                'topics': ['0xddf2', '0x01'],
+            }
+        )
+    exporter.export_item(
+        {
+            'type': 'receipt',
+            'transaction_hash': '0xabc',
+            'block_number': 1,
+            'gas_used': 21000,
+            'contract_address': None,
+            'effective_gas_price': 10**20,
+        }
+    )
+    exporter.close()
+
+    logs = pq.ParquetFile(logs_file)
+    assert logs.metadata.num_row_groups == 3
+    assert logs.schema_arrow.field('block_number').type == 'int64'
+    rows = logs.read().to_pylist()
+    assert [row['log_index'] for row in rows] == [0, 1, 2, 3, 4]
+    assert rows[0]['topics'] == ['0xddf2', '0x01']
+
+    receipt = pq.read_table(receipts_file).to_pylist()[0]
+    assert receipt['gas_used'] == 21000
+    assert receipt['effective_gas_price'] == str(10**20)
+    assert receipt['contract_address'] is None
+    assert receipt['status'] is None
+
+    contract_addresses_file = tmp_path / 'contract_addresses.csv'
+    extract_csv_column_unique(str(receipts_file), str(contract_addresses_file), 'contract_address')
+    assert contract_addresses_file.read_text().strip() == ''
@@ -0,0 +1,53 @@
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import create_engine, select
+
+from blockchainetl.jobs.exporters.postgres_item_exporter import PostgresItemExporter, items_to_csv
+from ethereumetl.streaming.postgres_tables import TOKENS
+
+
+def test_items_to_csv():
+    items = [
+        {'address': '0xa"b', 'name': '', 'decimals': None, 'function_sighashes': ['0x1', None]},
+        {'address': '0xc', 'name': 'Token', 'decimals': 18, 'function_sighashes': {'a': 1}},
+    ]
+    columns = ['address', 'name', 'decimals', 'function_sighashes']
+
+    assert items_to_csv(items, columns) == (
+        '"0xa""b","",,"{""0x1"",NULL}"\n' '"0xc","Token","18","{""a"": 1}"\n'
+    )
+
+
+def test_postgres_item_exporter_merges_copied_items(postgres_url):
+    exporter = PostgresItemExporter(
+        postgres_url,
+        item_type_to_table_mapping={'token': TOKENS},
+        print_sql=False,
+    )
+    token = {
+        'type': 'token',
+        'address': '0xa',
+        'name': 'Token',
+        'symbol': 'TKN',
+        'decimals': 18,
+        'function_sighashes': ['0x1'],
+        'total_supply': Decimal(10**30),
+        'block_number': 1,
+    }
+    exporter.export_items([token, {**token, 'symbol': 'OLD'}])
+    # the last copy of a repeated primary key wins
+    exporter.export_items(
+        [{**token, 'symbol': 'OLD'}, {**token, 'block_number': 2}, {**token, 'symbol': 'NEW'}]
+    )
+    exporter.close()
+
+    engine = create_engine(postgres_url)
+    with engine.connect() as connection:
+        rows = connection.execute(
+            select(TOKENS.c.block_number, TOKENS.c.symbol, TOKENS.c.function_sighashes).order_by(
+                TOKENS.c.block_number
+            )
+        ).fetchall()
+    engine.dispose()
+    assert [tuple(row) for row in rows] == [(1, 'NEW', ['0x1']), (2, 'TKN', ['0x1'])]
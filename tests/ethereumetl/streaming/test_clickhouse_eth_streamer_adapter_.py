@@ -1,4 +1,5 @@
 from collections.abc import Generator, Sequence
+from concurrent.futures import Future
 from copy import deepcopy
 from unittest.mock import MagicMock
 
@@ -6,9 +7,13 @@ import clickhouse_connect
 import pytest
 from clickhouse_connect.driver.client import Client
 
+from ethereumetl.clickhouse import ITEM_TYPE_TO_TABLE_MAPPING
 from ethereumetl.enumeration.entity_type import EntityType
 from ethereumetl.providers.auto import get_provider_from_uri
-from ethereumetl.streaming.clickhouse_eth_streamer_adapter import ClickhouseEthStreamerAdapter
+from ethereumetl.streaming.clickhouse_eth_streamer_adapter import (
+    ClickhouseEthStreamerAdapter,
+    VerifyingClickhouseEthStreamerAdapter,
+)
 from ethereumetl.streaming.eth_streamer_adapter import EthStreamerAdapter
 from ethereumetl.streaming.item_exporter_creator import create_item_exporters
 from ethereumetl.thread_local_proxy import ThreadLocalProxy
@@ -13238,3 +13243,248 @@ def test_export_dex_trades(
     )
     assert len(exported_trades) == len(dex_trades_sample)
     assert exported_trades[0]['factory_address']
+
+
+def test_fill_blocks_and_transactions_from_node():
+    eth_streamer = MagicMock(
+        entity_types=[EntityType.BLOCK, EntityType.TRANSACTION],
+        should_export={EntityType.BLOCK, EntityType.TRANSACTION},
+        SORT_BY_FIELDS=EthStreamerAdapter.SORT_BY_FIELDS,
+    )
+    adapter = ClickhouseEthStreamerAdapter(eth_streamer, clickhouse_url='', chain_id=1)
+
+    def block(number, transaction_count):
+        return {'number': number, 'transaction_count': transaction_count}
+
+    def transaction(block_number, transaction_index):
+        return {'block_number': block_number, 'transaction_index': transaction_index}
+
+    # block 2 is missing, block 4 is missing one of its transactions
+    blocks_ch = [block(1, 1), block(3, 0), block(4, 2), block(5, 0)]
+    transactions_ch = [transaction(1, 0), transaction(4, 1)]
+    eth_streamer.export_blocks_and_transactions.side_effect = lambda start, end: (
+        [block(n, 1 if n == 2 else 2) for n in range(start, end + 1)],
+        [transaction(n, i) for n in range(start, end + 1) for i in range(1 if n == 2 else 2)],
+    )
+
+    blocks_to_fetch = adapter.blocks_to_fetch_from_node(1, 5, blocks_ch, transactions_ch)
+    assert blocks_to_fetch == {2, 4}
+
+    blocks, transactions = adapter.fill_blocks_and_transactions_from_node(
+        blocks_to_fetch, blocks_ch, transactions_ch
+    )
+    assert [call.args for call in eth_streamer.export_blocks_and_transactions.call_args_list] == [
+        (2, 2),
+        (4, 4),
+    ]
+    assert [b['number'] for b in blocks] == [1, 2, 3, 4, 5]
+    assert [(t['block_number'], t['transaction_index']) for t in transactions] == [
+        (1, 0),
+        (2, 0),
+        (4, 0),
+        (4, 1),
+    ]
+
+
+def test_export_all_fetches_only_missing_blocks_from_node():
+    entity_types = [EntityType.BLOCK, EntityType.TRANSACTION, EntityType.LOG, EntityType.TRACE]
+    eth_streamer = MagicMock(
+        entity_types=entity_types,
+        should_export=set(entity_types),
+        SORT_BY_FIELDS=EthStreamerAdapter.SORT_BY_FIELDS,
+        range_log_topics=None,
+    )
+    adapter = ClickhouseEthStreamerAdapter(eth_streamer, clickhouse_url='', chain_id=1)
+    adapter.exporting_to_the_same_clickhouse = True
+
+    def block(number):
+        return {'number': number, 'transaction_count': 1, 'type': EntityType.BLOCK}
+
+    def transaction(block_number):
+        return {
+            'hash': f'0x{block_number}',
+            'block_number': block_number,
+            'transaction_index': 0,
+            'receipt_logs_count': 1,
+            'type': EntityType.TRANSACTION,
+        }
+
+    def log(block_number):
+        return {
+            'block_number': block_number,
+            'log_index': 0,
+            'transaction_hash': f'0x{block_number}',
+        }
+
+    def trace(block_number):
+        return {'block_number': block_number, 'trace_id': f'call_{block_number}'}
+
+    # block 2 is missing in ClickHouse
+    rows_in_ch = {
+        EntityType.BLOCK: [block(1), block(3)],
+        EntityType.TRANSACTION: [transaction(1), transaction(3)],
+        EntityType.LOG: [log(1), log(3)],
+        EntityType.TRACE: [trace(1), trace(3)],
+    }
+
+    def select_distinct_async(entity_type, start_block, end_block, columns=None):
+        future: Future = Future()
+        future.set_result([dict(row) for row in rows_in_ch.get(entity_type, [])])
+        return future
+
+    adapter.select_distinct_async = select_distinct_async
+    eth_streamer.export_blocks_and_transactions.return_value = ([block(2)], [transaction(2)])
+    eth_streamer.filter_transactions_by_logs_bloom.side_effect = lambda blocks, txs: txs
+    eth_streamer.export_receipts_and_logs.return_value = ([], [log(2)], [])
+    eth_streamer.export_traces.return_value = [trace(2)]
+    eth_streamer.enrich.side_effect = lambda entity_type, get_items, index: get_items(entity_type)
+
+    adapter.export_all(1, 3)
+
+    eth_streamer.export_blocks_and_transactions.assert_called_once_with(2, 2)
+    eth_streamer.export_receipts_and_logs.assert_called_once_with([transaction(2)])
+    eth_streamer.export_traces.assert_called_once_with(2, 2)
+    exported = eth_streamer.item_exporter.export_items.call_args.args[0]
+    assert sorted(i['block_number'] for i in exported if 'log_index' in i) == [1, 2, 3]
+    assert sorted(i['block_number'] for i in exported if 'trace_id' in i) == [1, 2, 3]
+
+
+def test_export_all_fetches_missing_logs_by_range():
+    entity_types = [EntityType.BLOCK, EntityType.LOG]
+    topics = frozenset({'0xddf252ad'})
+    eth_streamer = MagicMock(
+        entity_types=entity_types,
+        should_export=set(entity_types),
+        SORT_BY_FIELDS=EthStreamerAdapter.SORT_BY_FIELDS,
+        range_log_topics=topics,
+    )
+    adapter = ClickhouseEthStreamerAdapter(eth_streamer, clickhouse_url='', chain_id=1)
+    adapter.exporting_to_the_same_clickhouse = True
+
+    def block(number):
+        return {'number': number, 'transaction_count': 0, 'type': EntityType.BLOCK}
+
+    def log(block_number):
+        return {'block_number': block_number, 'log_index': 0, 'transaction_hash': '0x1'}
+
+    def select_distinct_async(entity_type, start_block, end_block, columns=None):
+        future: Future = Future()
+        future.set_result([block(1)] if entity_type == EntityType.BLOCK else [])
+        return future
+
+    adapter.select_distinct_async = select_distinct_async
+    eth_streamer.export_blocks_and_transactions.return_value = ([block(2), block(3)], [])
+    eth_streamer.export_logs.side_effect = lambda start, end, topics: [log(start)]
+    eth_streamer.enrich.side_effect = lambda entity_type, get_items, index: get_items(entity_type)
+
+    adapter.export_all(1, 3)
+
+    eth_streamer.export_logs.assert_called_once_with(2, 3, topics)
+    eth_streamer.export_receipts_and_logs.assert_not_called()
+    exported = eth_streamer.item_exporter.export_items.call_args.args[0]
+    assert [i['block_number'] for i in exported if 'log_index' in i] == [2]
+
+
+def test_verifier_finds_forked_blocks():
+    ch_streamer = MagicMock()
+    verifier = VerifyingClickhouseEthStreamerAdapter(ch_streamer)
+    ch_streamer.select_distinct.return_value = [
+        {'number': n, 'hash': f'hash_{n}', 'parent_hash': f'hash_{n - 1}'} for n in (1, 3, 4, 5)
+    ]
+    verifier.seed_headers(start_block=6)
+    # block 2 is missing in ClickHouse, so only the consecutive headers are kept
+    assert [h.number for h in verifier.headers] == [3, 4, 5]
+
+    # the node replaced blocks 4 and 5
+    node_blocks = {
+        n: {'number': n, 'hash': f'new_hash_{n}', 'parent_hash': f'new_hash_{n - 1}'}
+        for n in (4, 5, 6)
+    }
+    node_blocks[4]['parent_hash'] = 'hash_3'
+    ch_streamer.eth_streamer.export_block_headers.side_effect = lambda start, end: [
+        node_blocks[n] for n in range(start, end + 1)
+    ]
+    forked_blocks = verifier.find_forked_blocks(node_blocks[6])
+    assert [b['number'] for b in forked_blocks] == [4, 5]
+
+    verifier.remember_headers([*forked_blocks, node_blocks[6]])
+    assert [h.hash for h in verifier.headers] == [
+        'hash_3',
+        'new_hash_4',
+        'new_hash_5',
+        'new_hash_6',
+    ]
+    assert (
+        verifier.find_forked_blocks(
+            {'number': 7, 'hash': 'new_hash_7', 'parent_hash': 'new_hash_6'}
+        )
+        == []
+    )
+
+
+def test_verifier_marks_blocks_exported_again_after_being_marked(clickhouse_migrated):
+    ch_streamer = MagicMock(item_type_to_table_mapping=ITEM_TYPE_TO_TABLE_MAPPING)
+    ch_streamer._get_read_client.return_value = clickhouse_migrated
+    verifier = VerifyingClickhouseEthStreamerAdapter(ch_streamer)
+    block = {'number': 1, 'hash': '0xa', 'timestamp': 100, 'is_reorged': False}
+
+    def latest_is_reorged():
+        return clickhouse_migrated.query(
+            "SELECT is_reorged FROM blocks FINAL WHERE hash = '0xa'"
+        ).result_rows
+
+    # the chain switches A -> B -> A -> B, block A is exported, marked, exported and marked again
+    insert_records(clickhouse_migrated, 'blocks', [block])
+    verifier._mark_table_records_as_reorged(EntityType.BLOCK, [1], [100], ['0xa'])
+    assert latest_is_reorged() == [(True,)]
+
+    # exported again with the token of the rewrite
+    clickhouse_migrated.insert(
+        'blocks',
+        [list(block.values())],
+        list(block),
+        settings={'insert_deduplication_token': 'blocks:1-1:0:rewrite'},
+    )
+    assert latest_is_reorged() == [(False,)]
+
+    verifier._mark_table_records_as_reorged(EntityType.BLOCK, [1], [100], ['0xa'])
+    assert latest_is_reorged() == [(True,)]
+
+
+def test_select_distinct_reads_the_latest_copy_of_rows(
+    clickhouse_migrated_url, clickhouse_migrated
+):
+    adapter = ClickhouseEthStreamerAdapter(
+        MagicMock(entity_types=[EntityType.BLOCK]), clickhouse_migrated_url, chain_id=1
+    )
+    adapter.open()
+    block = {'number': 1, 'hash': '0xa', 'timestamp': 100, 'extra_data': 'v1'}
+
+    def insert_block(token, **values):
+        row = {**block, 'is_reorged': False, **values}
+        clickhouse_migrated.insert(
+            'blocks',
+            [list(row.values())],
+            list(row),
+            settings={'insert_deduplication_token': token},
+        )
+
+    def read_blocks():
+        return [
+            (b['hash'], b['extra_data'])
+            for b in adapter.select_distinct(EntityType.BLOCK, 1, 1, 'number')
+        ]
+
+    try:
+        insert_block('exported')
+        # rewritten with the same key and hash
+        insert_block('rewritten', extra_data='v2')
+        assert read_blocks() == [('0xa', 'v2')]
+
+        # the chain switches A -> B -> A
+        insert_block('marked', extra_data='v2', is_reorged=True)
+        assert read_blocks() == []
+        insert_block('exported again', extra_data='v2')
+        assert read_blocks() == [('0xa', 'v2')]
+    finally:
+        adapter.close()
@@ -0,0 +1,62 @@
+import pytest
+
+from ethereumetl.streaming.enrich import (
+    EnrichIndex,
+    enrich_logs,
+    enrich_token_transfers,
+    enrich_transactions,
+)
+
+
+@pytest.fixture
+def blocks():
+    return [
+        {'number': 1, 'hash': '0xb1', 'timestamp': 100},
+        {'number': 2, 'hash': '0xb2', 'timestamp': 200},
+    ]
+
+
+def test_enrich_index_builds_map_once(blocks):
+    index = EnrichIndex()
+    block_by_number = index.lookup(blocks, 'number')
+
+    assert index.lookup(blocks, 'number') is block_by_number
+    assert index.lookup(list(blocks), 'number') is not block_by_number
+    assert block_by_number[2]['hash'] == '0xb2'
+
+
+def test_enrich_shares_index_between_entity_types(blocks):
+    index = EnrichIndex()
+    logs = [{'type': 'log', 'block_number': 2, 'log_index': 0, 'transaction_hash': '0xt1'}]
+    transfers = [{'type': 'token_transfer', 'block_number': 1, 'log_index': 1}]
+
+    enriched_logs = enrich_logs(blocks, logs, index)
+    enriched_transfers = enrich_token_transfers(blocks, transfers, index)
+
+    assert len(index._maps) == 1
+    assert enriched_logs[0]['block_hash'] == '0xb2'
+    assert enriched_logs[0]['block_timestamp'] == 200
+    assert enriched_transfers[0]['block_hash'] == '0xb1'
+
+
+def test_enrich_skips_items_without_match(blocks):
+    logs = [{'type': 'log', 'block_number': 3, 'log_index': 0}]
+    assert enrich_logs(blocks, logs) == []
+
+
+def test_enrich_transactions_dedups_by_hash():
+    transactions = [
+        {'type': 'transaction', 'hash': '0xt1', 'block_number': 1, 'nonce': 1},
+        {'type': 'transaction', 'hash': '0xt1', 'block_number': 1, 'nonce': 1, 'extra': 1},
+        {'type': 'transaction', 'hash': '0xt2', 'block_number': 1, 'nonce': 2},
+    ]
+    receipts = [
+        {'transaction_hash': '0xt1', 'status': 1, 'gas_used': 21000},
+        {'transaction_hash': '0xt2', 'status': 0, 'gas_used': 30000},
+        {'transaction_hash': '0xt2', 'status': 0, 'gas_used': 30000},
+    ]
+
+    result = enrich_transactions(transactions, receipts)
+
+    assert [(t['hash'], t['receipt_status']) for t in result] == [('0xt1', 1), ('0xt2', 0)]
+    assert result[1]['receipt_gas_used'] == 30000
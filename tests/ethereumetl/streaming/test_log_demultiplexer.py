@@ -0,0 +1,60 @@
+from ethereumetl.domain.receipt_log import EthReceiptLog
+from ethereumetl.jobs.extract_events_job import group_by_block_number
+from ethereumetl.service.token_transfer_extractor import (
+    ALL_TRANSFER_EVENT_TOPICS,
+    ERC1155_SINGLE_TRANSFER_EVENT_TOPIC,
+    TRANSFER_EVENT_TOPIC,
+)
+from ethereumetl.streaming.log_demultiplexer import LogDemultiplexer
+
+SWAP_TOPIC = '0xd78ad95fa46c994b6551d0da85fc275fe613ce37657fb8d5e3d130840159d822'
+
+
+def make_log(block_number, log_index, topics):
+    return {
+        'type': 'log',
+        'log_index': log_index,
+        'transaction_hash': f'0x{block_number:02x}{log_index:02x}',
+        'transaction_index': 0,
+        'block_number': block_number,
+        'address': '0x0000000000000000000000000000000000000001',
+        'data': '0x',
+        'topics': topics,
+    }
+
+
+def test_receipt_logs_with_topics():
+    logs = [
+        make_log(1, 0, [TRANSFER_EVENT_TOPIC, '0x01', '0x02']),
+        make_log(1, 1, [SWAP_TOPIC.upper().replace('0X', '0x')]),
+        make_log(2, 0, f'{ERC1155_SINGLE_TRANSFER_EVENT_TOPIC},0x01,0x02,0x03'),
+        make_log(2, 1, []),
+    ]
+    log_demultiplexer = LogDemultiplexer(logs)
+
+    transfer_logs = log_demultiplexer.receipt_logs_with_topics(ALL_TRANSFER_EVENT_TOPICS)
+    swap_logs = log_demultiplexer.receipt_logs_with_topics([SWAP_TOPIC])
+
+    assert all(isinstance(log, EthReceiptLog) for log in transfer_logs + swap_logs)
+    assert sorted((log.block_number, log.log_index) for log in transfer_logs) == [(1, 0), (2, 0)]
+    assert [(log.block_number, log.log_index) for log in swap_logs] == [(1, 1)]
+    # logs come topic by topic in the order of the topics, a repeated topic once
+    assert [
+        (log.block_number, log.log_index)
+        for log in log_demultiplexer.receipt_logs_with_topics(
+            [
+                ERC1155_SINGLE_TRANSFER_EVENT_TOPIC,
+                TRANSFER_EVENT_TOPIC,
+                TRANSFER_EVENT_TOPIC.upper(),
+            ]
+        )
+    ] == [(2, 0), (1, 0)]
+    # every bucket is mapped once and shared between consumers
+    assert log_demultiplexer.receipt_logs_with_topics([SWAP_TOPIC])[0] is swap_logs[0]
+
+
+def test_group_by_block_number():
+    logs = [make_log(1, 0, []), make_log(2, 0, []), make_log(1, 1, [])]
+    logs_by_block_number = group_by_block_number(logs)
+    assert [log['log_index'] for log in logs_by_block_number[1]] == [0, 1]
+    assert len(logs_by_block_number[2]) == 1
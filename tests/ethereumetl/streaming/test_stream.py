@@ -37,7 +37,11 @@ from blockchainetl.jobs.exporters.composite_item_exporter import CompositeItemEx
 from blockchainetl.jobs.exporters.elasticsearch_exporter import ElasticsearchItemExporter
 from blockchainetl.jobs.exporters.in_memory_item_exporter import InMemoryItemExporter
 from blockchainetl.jobs.importers.price_importers.base_price_importer import BasePriceImporter
-from blockchainetl.streaming.streamer import Streamer
+from blockchainetl.streaming.streamer import (
+    LastSyncedBlockProviderFile,
+    Streamer,
+    WriteBehindLastSyncedBlockProvider,
+)
 from blockchainetl.streaming.streamer_adapter_stub import StreamerAdapterStub
 from ethereumetl.domain.token_transfer import TokenStandard
 from ethereumetl.enumeration import entity_type
@@ -677,6 +681,20 @@ def test_item_id_calculator_id_fields_contains_all_entity_types():
         ), f"missing item_id calculator for entity type {type_!r}"
 
 
+def test_write_behind_last_synced_block_provider(tmp_path):
+    file_provider = LastSyncedBlockProviderFile(str(tmp_path / 'last_synced_block.txt'))
+    file_provider.set_last_synced_block(10)
+    provider = WriteBehindLastSyncedBlockProvider(file_provider, write_interval=3600)
+
+    for block in range(11, 20):
+        provider.set_last_synced_block(block)
+
+    assert provider.get_last_synced_block() == 19
+    assert file_provider.get_last_synced_block() == 10
+    provider.close()
+    assert file_provider.get_last_synced_block() == 19
+
+
 @pytest.fixture()
 def ch_verifier(clickhouse_url):
     exporter = ClickHouseItemExporter(clickhouse_url)
@@ -708,16 +726,17 @@ def ch_verifier(clickhouse_url):
 
 
 @patch.object(ClickhouseEthStreamerAdapter, 'select_distinct')
-@patch.object(EthStreamerAdapter, 'export_blocks_and_transactions')
+@patch.object(EthStreamerAdapter, 'export_block_headers')
 @patch.object(ClickhouseEthStreamerAdapter, 'export_all')
 def test_verify_all_with_consistent_data(
     export_all_mock,
-    mock_export_blocks_and_transactions,
+    mock_export_block_headers,
     mock_select_distinct,
     ch_verifier,
 ):
     # Configure the mock return values
     mock_select_distinct.side_effect = (
+        [],  # headers before the range
         [
             {'number': 1, 'hash': 'block_hash_1', 'transaction_count': 3},
             {'number': 2, 'hash': 'block_hash_2', 'transaction_count': 2},
@@ -765,54 +784,11 @@ def test_verify_all_with_consistent_data(
             },
         ],
     )
-    mock_export_blocks_and_transactions.return_value = (
-        [
-            {'number': 1, 'hash': 'block_hash_1', 'transaction_count': 3},
-            {'number': 2, 'hash': 'block_hash_2', 'transaction_count': 2},
-            {'number': 3, 'hash': 'block_hash_3', 'transaction_count': 1},
-        ],
-        [
-            {
-                'hash': 'txn_hash_1',
-                'block_hash': 'block_hash_1',
-                'block_number': 1,
-                'transaction_index': 0,
-                'from_address': 'address_1',
-                'to_address': 'address_2',
-                'value': 100,
-                'gas': 200,
-                'gas_price': 20,
-                'input': 'input_1',
-                'nonce': 1,
-            },
-            {
-                'hash': 'txn_hash_2',
-                'block_hash': 'block_hash_1',
-                'block_number': 1,
-                'transaction_index': 1,
-                'from_address': 'address_2',
-                'to_address': 'address_3',
-                'value': 200,
-                'gas': 300,
-                'gas_price': 30,
-                'input': 'input_2',
-                'nonce': 2,
-            },
-            {
-                'hash': 'txn_hash_3',
-                'block_hash': 'block_hash_1',
-                'block_number': 1,
-                'transaction_index': 2,
-                'from_address': 'address_3',
-                'to_address': 'address_4',
-                'value': 300,
-                'gas': 400,
-                'gas_price': 40,
-                'input': 'input_3',
-                'nonce': 3,
-            },
-        ],
-    )
+    mock_export_block_headers.return_value = [
+        {'number': 1, 'hash': 'block_hash_1', 'parent_hash': 'block_hash_0'},
+        {'number': 2, 'hash': 'block_hash_2', 'parent_hash': 'block_hash_1'},
+        {'number': 3, 'hash': 'block_hash_3', 'parent_hash': 'block_hash_2'},
+    ]
 
     ch_verifier.export_all(start_block=1, end_block=3)
 
@@ -820,20 +796,23 @@ def test_verify_all_with_consistent_data(
 
 
 @patch.object(ClickhouseEthStreamerAdapter, 'select_distinct')
-@patch.object(EthStreamerAdapter, 'export_blocks_and_transactions')
+@patch.object(EthStreamerAdapter, 'export_block_headers')
 @patch.object(EthStreamerAdapter, 'export_receipts_and_logs')
 @patch.object(EthStreamerAdapter, 'export_all', new_callable=Mock)
 def test_verify_all_with_inconsistent_data(
     export_all_mock,
     mock_export_receipts_and_logs,
-    mock_export_blocks_and_transactions,
+    mock_export_block_headers,
     mock_select_distinct,
     ch_verifier,
 ):
-    fake_ch_client = ch_verifier.ch_streamer.clickhouse = Mock()
+    fake_ch_client = Mock()
+    fake_ch_client.query.return_value.result_rows = [('invalid',)]
+    ch_verifier.ch_streamer._get_read_client = Mock(return_value=fake_ch_client)
 
     # Configure the mock return values to introduce inconsistencies
     mock_select_distinct.side_effect = (
+        [],  # headers before the range
         [
             {'number': 1, 'hash': 'block_hash_1', 'transaction_count': 3, 'timestamp': 10},
             {'number': 3, 'hash': 'invalid', 'transaction_count': 1, 'timestamp': 30},
@@ -887,6 +866,7 @@ def test_verify_all_with_inconsistent_data(
                 'type': 'block',
                 'number': 1,
                 'hash': 'block_hash_1',
+                'parent_hash': 'block_hash_0',
                 'transaction_count': 3,
                 'timestamp': 10,
             },
@@ -894,6 +874,7 @@ def test_verify_all_with_inconsistent_data(
                 'type': 'block',
                 'number': 2,
                 'hash': 'block_hash_2',
+                'parent_hash': 'block_hash_1',
                 'transaction_count': 1,
                 'timestamp': 20,
             },
@@ -901,6 +882,7 @@ def test_verify_all_with_inconsistent_data(
                 'type': 'block',
                 'number': 3,
                 'hash': 'block_hash_3',
+                'parent_hash': 'block_hash_2',
                 'transaction_count': 2,
                 'timestamp': 30,
             },
@@ -1026,10 +1008,7 @@ def test_verify_all_with_inconsistent_data(
             },
         ],
     }
-    mock_export_blocks_and_transactions.return_value = (
-        mock_blockchain_data['blocks'],
-        mock_blockchain_data['transactions'],
-    )
+    mock_export_block_headers.return_value = mock_blockchain_data['blocks']
     mock_export_receipts_and_logs.return_value = (
         mock_blockchain_data['receipts'],
         mock_blockchain_data['logs'],
@@ -1154,3 +1133,25 @@ def test_elastic_export_items(
             check_indexed_items(elastic)
     finally:
         exporter.close()
+
+
+def test_receipts_are_not_filtered_by_logs_bloom_when_exporting_errors():
+    empty_block = {'number': 1, 'logs_bloom': '0x' + '00' * 256}
+    transactions = [{'block_number': 1, 'hash': '0x1'}]
+
+    transfers_only = EthStreamerAdapter(
+        Mock(), entity_types=[EntityType.TOKEN_TRANSFER], chain_id=1, selective_receipts=True
+    )
+    assert transfers_only.filter_transactions_by_logs_bloom([empty_block], transactions) == []
+
+    # errors of any receipt are exported, so every receipt is fetched
+    with_errors = EthStreamerAdapter(
+        Mock(),
+        entity_types=[EntityType.TOKEN_TRANSFER, EntityType.ERROR],
+        chain_id=1,
+        selective_receipts=True,
+    )
+    assert with_errors.receipt_logs_bloom_filter is None
+    assert with_errors.filter_transactions_by_logs_bloom([empty_block], transactions) == (
+        transactions
+    )
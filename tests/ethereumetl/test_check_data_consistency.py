@@ -0,0 +1,83 @@
+from unittest.mock import MagicMock
+
+from ethereumetl.scripts import check_data_consistency
+from ethereumetl.scripts.check_data_consistency import (
+    find_blocks_gaps,
+    find_duplicated_blocks,
+    find_inconsistent_blocks,
+    find_repair_ranges,
+    merge_block_ranges,
+)
+
+
+def test_merge_block_ranges():
+    assert merge_block_ranges([]) == []
+    assert merge_block_ranges([(10, 12), (0, 3), (4, 5), (2, 3), (7, 7), (11, 20)]) == [
+        (0, 5),
+        (7, 7),
+        (10, 20),
+    ]
+
+
+def test_find_blocks_gaps():
+    client = MagicMock()
+    client.execute.return_value = [(0, 0), (5, 9)]
+
+    assert find_blocks_gaps(client, 1, 0, 9) == [(0, 0), (5, 9)]
+
+    query, params = client.execute.call_args.args
+    assert params == {'start': 0, 'end': 9}
+    assert 'dex_etl.1_blocks' in query
+    # the row before the genesis block is -1, not a wrapped around UInt64
+    assert 'toInt64(%(start)s) - 1' in query
+
+
+def test_find_duplicated_blocks():
+    client = MagicMock()
+    client.execute.return_value = [(5,), (3,), (4,), (9,)]
+
+    assert find_duplicated_blocks(client, 1) == [(3, 5), (9, 9)]
+    assert 'dex_etl.1_blocks' in client.execute.call_args.args[0]
+
+
+def test_find_inconsistent_blocks():
+    client = MagicMock()
+    client.execute.return_value = [(3,), (4,)]
+
+    assert find_inconsistent_blocks(client, 1, 0, 9, check_logs=False) == [3, 4]
+    query, params = client.execute.call_args.args
+    assert params == {'start': 0, 'end': 9}
+    assert 'dex_etl.1_transactions' in query
+    assert 'dex_etl.1_logs' not in query
+
+    find_inconsistent_blocks(client, 1, 0, 9, check_logs=True)
+    query, _params = client.execute.call_args.args
+    assert 'dex_etl.1_logs' in query
+    assert 'l.logged_transactions_hash != t.logged_transactions_hash' in query
+
+
+def test_find_repair_ranges_checks_chunks_from_genesis(monkeypatch):
+    client = MagicMock()
+    client.execute.return_value = [(1,)]
+    monkeypatch.setattr(
+        check_data_consistency, 'clickhouse_client_from_url', lambda url: (client, 'ethereum')
+    )
+    checked_chunks = []
+
+    def find_blocks_gaps(client, chain_id, start, end):
+        checked_chunks.append((start, end))
+        return [(0, 0)] if start == 0 else []
+
+    def find_inconsistent_blocks(client, chain_id, start, end, check_logs):
+        assert check_logs
+        return [8, 9] if start == 5 else []
+
+    monkeypatch.setattr(check_data_consistency, 'find_blocks_gaps', find_blocks_gaps)
+    monkeypatch.setattr(
+        check_data_consistency, 'find_inconsistent_blocks', find_inconsistent_blocks
+    )
+
+    repair_ranges = find_repair_ranges(1, last_block=12, chunk_size=5, max_workers=2)
+
+    assert sorted(checked_chunks) == [(0, 4), (5, 9), (10, 12)]
+    assert repair_ranges == [(0, 0), (8, 9)]
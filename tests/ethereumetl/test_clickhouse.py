@@ -4,7 +4,11 @@ from collections.abc import Sequence
 import pytest
 from clickhouse_connect.driver.client import Client
 
-from blockchainetl.jobs.exporters.clickhouse_exporter import ClickHouseItemExporter
+from blockchainetl.jobs.exporters.clickhouse_exporter import (
+    ClickHouseItemExporter,
+    insert_deduplication_token,
+)
+from ethereumetl.config.envs import envs
 from ethereumetl.enumeration.entity_type import EntityType
 from ethereumetl.scripts.load_abi_to_event_inventory import load_abis_to_event_inventory
 from ethereumetl.streaming.clickhouse_eth_streamer_adapter import ClickhouseEthStreamerAdapter
@@ -217,3 +221,36 @@ def test_select_where_with_results(clickhouse_adapter, clickhouse_migrated):
     )
     assert len(results) == 1
     assert results[0]["number"] == 12347
+
+
+def test_select_where_with_keys_in_temporary_table(
+    clickhouse_adapter, clickhouse_migrated, monkeypatch
+):
+    """Test that `select_where()` filters on key sets loaded into a temporary table."""
+    monkeypatch.setattr(envs, 'CLICKHOUSE_INLINE_KEYS_MAX', 1)
+    insert_records(
+        clickhouse_migrated,
+        'blocks',
+        [
+            {'number': 12345, 'is_reorged': False, 'hash': 'hash_1'},
+            {'number': 12346, 'is_reorged': False, 'hash': 'hash_2'},
+            {'number': 12347, 'is_reorged': False, 'hash': 'hash_3'},
+        ],
+    )
+    results = clickhouse_adapter.select_where(
+        EntityType.BLOCK, "number", number=[12345, 12347], hash=['hash_1', 'hash_2', 'hash_3']
+    )
+    assert sorted(r["number"] for r in results) == [12345, 12347]
+
+
+def test_insert_deduplication_token():
+    column_names = ['number', 'hash']
+    token = insert_deduplication_token('blocks', column_names, [[2, 1], ['h2', 'h1']], '0')
+
+    assert token.startswith('blocks:1-2:0:')
+    assert token == insert_deduplication_token('blocks', column_names, [[2, 1], ['h2', 'h1']], '0')
+    # split chunks and re-exported blocks with new data get other tokens
+    assert token != insert_deduplication_token(
+        'blocks', column_names, [[2, 1], ['h2', 'h1']], '0.0'
+    )
+    assert token != insert_deduplication_token('blocks', column_names, [[2, 1], ['h2', 'h3']], '0')
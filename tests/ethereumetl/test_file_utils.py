@@ -0,0 +1,43 @@
+import threading
+
+import pytest
+
+from blockchainetl.file_utils import smart_open
+from ethereumetl.jobs.exporters.blocks_and_transactions_item_exporter import (
+    blocks_and_transactions_item_exporter,
+)
+from ethereumetl.misc_utils import filter_items
+
+
+@pytest.mark.parametrize(
+    'extension, magic',
+    [('.gz', b'\x1f\x8b'), ('.lz4', b'\x04\x22\x4d\x18'), ('.zst', b'\x28\xb5\x2f\xfd')],
+)
+def test_compressed_csv_export_is_read_back(tmp_path, extension, magic):
+    if extension == '.zst':
+        pytest.importorskip('zstandard')
+    blocks_file = str(tmp_path / f'blocks.csv{extension}')
+    exporter = blocks_and_transactions_item_exporter(blocks_file, None)
+    exporter.open()
+    threads = [
+        threading.Thread(
+            target=exporter.export_items,
+            args=([{'type': 'block', 'number': n, 'hash': f'0x{n}'} for n in range(t, 1000, 4)],),
+        )
+        for t in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    exporter.close()
+
+    with open(blocks_file, 'rb') as raw_file:
+        assert raw_file.read(len(magic)) == magic
+
+    filtered_file = str(tmp_path / f'filtered.csv{extension}')
+    filter_items(blocks_file, filtered_file, lambda item: int(item['number']) % 100 == 0)
+    with smart_open(filtered_file, 'r') as f:
+        lines = f.read().splitlines()
+    assert lines[0].startswith('number,hash,')
+    assert sorted(int(line.split(',')[0]) for line in lines[1:]) == list(range(0, 1000, 100))
@@ -0,0 +1,34 @@
+import json
+
+import tests.resources
+from ethereumetl.logs_bloom import LogsBloomFilter
+from ethereumetl.service.token_transfer_extractor import (
+    ALL_TRANSFER_EVENT_TOPICS,
+    ERC1155_BATCH_TRANSFER_EVENT_TOPIC,
+)
+
+EMPTY_LOGS_BLOOM = '0x' + '0' * 512
+
+
+def read_logs_bloom(block_number_hex):
+    response = tests.resources.read_resource(
+        ['test_stream', 'blocks_1755634_1755635'],
+        f'web3_response.eth_getBlockByNumber_{block_number_hex}_true.json',
+    )
+    return json.loads(response)['result']['logsBloom']
+
+
+def test_logs_bloom_filter_matches_block_with_topic():
+    # block 1755635 contains an ERC20 Transfer log
+    logs_bloom = read_logs_bloom('0x1ac9f3')
+    assert LogsBloomFilter(ALL_TRANSFER_EVENT_TOPICS).may_match(logs_bloom)
+    assert not LogsBloomFilter([ERC1155_BATCH_TRANSFER_EVENT_TOPIC]).may_match(logs_bloom)
+
+
+def test_logs_bloom_filter_skips_block_without_logs():
+    assert not LogsBloomFilter(ALL_TRANSFER_EVENT_TOPICS).may_match(read_logs_bloom('0x1ac9f2'))
+    assert not LogsBloomFilter(ALL_TRANSFER_EVENT_TOPICS).may_match(EMPTY_LOGS_BLOOM)
+
+
+def test_logs_bloom_filter_matches_unknown_bloom():
+    assert LogsBloomFilter(ALL_TRANSFER_EVENT_TOPICS).may_match(None)
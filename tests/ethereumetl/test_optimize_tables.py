@@ -0,0 +1,177 @@
+from unittest.mock import MagicMock
+
+from ethereumetl.scripts import optimize_tables
+from ethereumetl.scripts.optimize_tables import (
+    OptimizeProgress,
+    PartitionToOptimize,
+    get_partitions_of_blocks,
+    get_partitions_to_optimize,
+    get_tables_to_optimize,
+    optimize_tables_service,
+)
+
+
+def test_optimize_progress_resumes_unfinished_run(tmp_path):
+    path = str(tmp_path / 'optimize_progress.txt')
+    progress = OptimizeProgress(path)
+    assert not progress.is_done('1_blocks', '202301')
+
+    progress.mark_done('1_blocks', '202301')
+    progress.mark_done('1_logs', '202302')
+
+    resumed = OptimizeProgress(path)
+    assert resumed.is_done('1_blocks', '202301')
+    assert resumed.is_done('1_logs', '202302')
+    assert not resumed.is_done('1_logs', '202301')
+
+    resumed.finish()
+    assert not OptimizeProgress(path).is_done('1_blocks', '202301')
+    # finishing twice, or a run without progress, is fine
+    resumed.finish()
+
+
+def test_get_tables_to_optimize():
+    client = MagicMock()
+    client.execute.return_value = [
+        ('1_blocks', 'ReplicatedReplacingMergeTree'),
+        ('1_logs', 'ReplacingMergeTree'),
+        ('1_chain_counts', 'AggregatingMergeTree'),
+        ('10_blocks', 'ReplacingMergeTree'),
+        ('blocks', 'ReplacingMergeTree'),
+    ]
+
+    assert get_tables_to_optimize(client, 'dex_etl', 1) == ['1_blocks', '1_logs']
+
+
+def test_get_partitions_to_optimize():
+    client = MagicMock()
+    client.execute.return_value = [('1_logs', '202302', 5), ('1_blocks', '202301', 2)]
+
+    assert get_partitions_to_optimize(client, 'dex_etl', []) == []
+    client.execute.assert_not_called()
+
+    partitions = get_partitions_to_optimize(client, 'dex_etl', ['1_blocks', '1_logs'])
+
+    assert partitions == [
+        PartitionToOptimize('1_logs', '202302', 5),
+        PartitionToOptimize('1_blocks', '202301', 2),
+    ]
+    query, params = client.execute.call_args.args
+    assert 'HAVING parts > 1' in query
+    assert params == {'database': 'dex_etl', 'tables': ('1_blocks', '1_logs')}
+
+
+def test_get_partitions_of_blocks():
+    client = MagicMock()
+
+    def execute(query, params=None):
+        if 'system.columns' in query:
+            return [('1_logs', 'block_number'), ('1_blocks', 'number')]
+        return [('202301', 1)]
+
+    client.execute.side_effect = execute
+
+    assert get_partitions_of_blocks(client, 'dex_etl', ['1_blocks'], []) == []
+    client.execute.assert_not_called()
+
+    partitions = get_partitions_of_blocks(
+        client, 'dex_etl', ['1_blocks', '1_logs', '1_tokens'], [(1, 2), (5, 5)]
+    )
+
+    assert partitions == [
+        PartitionToOptimize('1_blocks', '202301', 1),
+        PartitionToOptimize('1_logs', '202301', 1),
+    ]
+    queries = [call.args[0] for call in client.execute.call_args_list[1:]]
+    assert queries == [
+        'SELECT _partition_id, uniqExact(_part) FROM `dex_etl`.`1_blocks`'
+        ' WHERE number BETWEEN 1 AND 2 OR number BETWEEN 5 AND 5 GROUP BY _partition_id',
+        'SELECT _partition_id, uniqExact(_part) FROM `dex_etl`.`1_logs`'
+        ' WHERE block_number BETWEEN 1 AND 2 OR block_number BETWEEN 5 AND 5'
+        ' GROUP BY _partition_id',
+    ]
+
+
+def test_optimize_tables_service_skips_partitions_done_before(monkeypatch, tmp_path):
+    client = MagicMock()
+
+    def execute(query, params=None):
+        if 'system.tables' in query:
+            return [('1_blocks', 'ReplacingMergeTree')]
+        if 'system.parts' in query:
+            return [('1_blocks', '202301', 3), ('1_blocks', '202302', 2)]
+        if 'system.merges' in query:
+            return [(0,)]
+        return []
+
+    client.execute.side_effect = execute
+    monkeypatch.setattr(
+        optimize_tables, 'clickhouse_client_from_url', lambda url: (client, 'dex_etl')
+    )
+    progress_file = str(tmp_path / 'optimize_progress.txt')
+    OptimizeProgress(progress_file).mark_done('1_blocks', '202301')
+
+    optimize_tables_service(1, max_workers=2, max_merges=1, progress_file=progress_file)
+
+    optimized = [
+        call.args[1]['partition_id']
+        for call in client.execute.call_args_list
+        if call.args[0].startswith('OPTIMIZE')
+    ]
+    assert optimized == ['202302']
+    assert not (tmp_path / 'optimize_progress.txt').exists()
+
+
+def test_optimize_tables_service_optimizes_partitions_of_known_blocks(monkeypatch, tmp_path):
+    client = MagicMock()
+
+    def execute(query, params=None):
+        if 'system.tables' in query:
+            return [('1_blocks', 'ReplacingMergeTree')]
+        if 'system.columns' in query:
+            return [('1_blocks', 'number')]
+        if '_partition_id' in query:
+            # a single part holding the duplicated block
+            return [('202301', 1)]
+        if 'system.parts' in query:
+            return [('1_blocks', '202302', 2)]
+        if 'system.merges' in query:
+            return [(0,)]
+        return []
+
+    client.execute.side_effect = execute
+    monkeypatch.setattr(
+        optimize_tables, 'clickhouse_client_from_url', lambda url: (client, 'dex_etl')
+    )
+
+    optimize_tables_service(
+        1, max_workers=1, progress_file=str(tmp_path / 'progress.txt'), block_ranges=[(7, 7)]
+    )
+
+    optimized = [
+        call.args[1]['partition_id']
+        for call in client.execute.call_args_list
+        if call.args[0].startswith('OPTIMIZE')
+    ]
+    assert optimized == ['202301', '202302']
+
+
+def test_optimize_tables_service_optimizes_every_table_whole(monkeypatch):
+    client = MagicMock()
+    client.execute.side_effect = lambda query, params=None: (
+        [('1_blocks', 'ReplacingMergeTree'), ('1_logs', 'ReplacingMergeTree')]
+        if 'system.tables' in query
+        else []
+    )
+    monkeypatch.setattr(
+        optimize_tables, 'clickhouse_client_from_url', lambda url: (client, 'dex_etl')
+    )
+
+    optimize_tables_service(1, by_partition=False)
+
+    optimized = [
+        call.args[0]
+        for call in client.execute.call_args_list
+        if call.args[0].startswith('OPTIMIZE')
+    ]
+    assert optimized == ['OPTIMIZE TABLE 1_blocks FINAL', 'OPTIMIZE TABLE 1_logs FINAL']